@@ -19,4 +19,23 @@ class Agent:
 
     def get_copy(self):
         """ Returns a copy of the agent."""
-        raise Exception('Abstract class.')
\ No newline at end of file
+        raise Exception('Abstract class.')
+
+    def cache_key(self):
+        """ Key of the configuration of the agent: agents with the same key
+        choose the same moves, so they can share their cached replies (see
+        `CachedAgent`). By default the class and the attributes of basic
+        types (not the color), None if the agent has other attributes.
+        """
+        params = []
+        for name, value in sorted(vars(self).items()):
+            if name == 'color':
+                continue
+            if isinstance(value, Agent):
+                value = value.cache_key()
+                if value is None:
+                    return None
+            elif value is not None and not isinstance(value, (bool, int, float, str)):
+                return None
+            params.append((name, value))
+        return type(self).__name__, tuple(params)
\ No newline at end of file
@@ -0,0 +1,192 @@
+import sqlite3
+import chess
+from collections import OrderedDict
+from threading import Lock
+
+from src.agents.agent import Agent
+from src.envs.game import Game
+from src.mcts.transposition import position_key
+
+
+class ReplyCache:
+    """ Bounded cache of the moves chosen by an agent in some positions,
+    keyed by the Zobrist hash of the position. The least recently used moves
+    are evicted from memory when it's full.
+
+    With a path, the moves are also stored in a SQLite file, so they are
+    kept between processes and runs (the moves evicted from memory are
+    read back from the file).
+
+    Caches can be shared by name in a process (see `shared`), so searches
+    and games with the same opponent reuse its replies.
+
+    Parameters:
+        size: int. Max. number of moves kept in memory.
+        path: str. SQLite file of the persistent layer, None for none.
+        commit_every: int. Writes to the file are committed in groups of
+        this size (and by `flush`).
+
+    Attributes:
+        hits: int. Lookups answered from memory.
+        disk_hits: int. Lookups answered from the file.
+        misses: int. Lookups of unknown positions.
+        evictions: int. Moves removed from memory.
+    """
+
+    _shared = {}
+    _shared_lock = Lock()
+
+    def __init__(self, size=2 ** 16, path=None, commit_every=64):
+        self.size = size
+        self.path = path
+        self.commit_every = commit_every
+        self.lock = Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._open()
+
+    @classmethod
+    def shared(cls, name, size=2 ** 16, path=None):
+        """ Returns the cache of the process with the name, made the first
+        time with the size and path.
+        """
+        with cls._shared_lock:
+            if name not in cls._shared:
+                cls._shared[name] = cls(size=size, path=path)
+            return cls._shared[name]
+
+    def _open(self):
+        self.moves = OrderedDict()
+        self._pending = 0
+        self.db = None
+        if self.path is not None:
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS replies (key INTEGER PRIMARY KEY, move TEXT)')
+
+    def __getstate__(self):
+        # Processes open their own connection and start with empty memory
+        state = self.__dict__.copy()
+        for name in ('lock', 'moves', 'db', '_pending'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+        self._open()
+
+    @staticmethod
+    def _db_key(key):
+        # SQLite integers are signed 64 bits
+        return key - (1 << 64) if key >= (1 << 63) else key
+
+    def get(self, key):
+        """ Returns the move cached for the position key, None if unknown. """
+        with self.lock:
+            move = self.moves.get(key)
+            if move is not None:
+                self.moves.move_to_end(key)
+                self.hits += 1
+                return move
+            if self.db is not None:
+                row = self.db.execute('SELECT move FROM replies WHERE key = ?', (self._db_key(key),)).fetchone()
+                if row is not None:
+                    self.disk_hits += 1
+                    self._remember(key, row[0])
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key, move):
+        """ Caches the move for the position key. """
+        with self.lock:
+            self._remember(key, move)
+            if self.db is not None:
+                self.db.execute('INSERT OR REPLACE INTO replies VALUES (?, ?)', (self._db_key(key), move))
+                self._pending += 1
+                if self._pending >= self.commit_every:
+                    self.db.commit()
+                    self._pending = 0
+
+    def _remember(self, key, move):
+        self.moves[key] = move
+        self.moves.move_to_end(key)
+        if len(self.moves) > self.size:
+            self.moves.popitem(last=False)
+            self.evictions += 1
+
+    def discard(self, key):
+        """ Removes the move of a position (e.g. illegal after a collision). """
+        with self.lock:
+            self.moves.pop(key, None)
+            if self.db is not None:
+                self.db.execute('DELETE FROM replies WHERE key = ?', (self._db_key(key),))
+
+    def flush(self):
+        """ Commits the moves written to the file. """
+        with self.lock:
+            if self.db is not None:
+                self.db.commit()
+                self._pending = 0
+
+    def close(self):
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __len__(self):
+        return len(self.moves)
+
+    def stats(self):
+        """ Returns a dict with the usage of the cache. """
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'size': self.size,
+            'entries': len(self),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / max(lookups, 1),
+            'evictions': self.evictions,
+        }
+
+
+class CachedAgent(Agent):
+    """ Opponent model for the tree expansion which remembers the moves of
+    another agent (e.g. a Stockfish or a nested MCTS agent) in a
+    `ReplyCache`, so every position is asked to it only once. The agent
+    should be deterministic for the cached moves to be its moves.
+
+    Params:
+        agent: Agent, Agent whose moves are cached.
+        cache: ReplyCache, Cache of the moves. By default, the cache shared
+        in the process by the agents of the same configuration (see
+        `Agent.cache_key`), a new one if the agent has no key.
+    """
+
+    def __init__(self, agent: Agent, cache=None):
+        super().__init__(agent.color)
+        self.agent = agent
+        self.cache = cache
+        if self.cache is None:
+            key = agent.cache_key()
+            self.cache = ReplyCache() if key is None else ReplyCache.shared(key)
+
+    def best_move(self, game: Game) -> str:
+        key = position_key(game.board)
+        move = self.cache.get(key)
+        if move is not None:
+            if move == Game.NULL_MOVE or chess.Move.from_uci(move) in game.board.legal_moves:
+                return move
+            self.cache.discard(key)  # Another position with the same key
+
+        move = self.agent.best_move(game)
+        self.cache.put(key, move)
+        return move
+
+    def get_copy(self):
+        """ Returns a copy of this agent sharing the cache. """
+        return CachedAgent(self.agent.get_copy(), cache=self.cache)
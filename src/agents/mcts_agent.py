@@ -1,5 +1,8 @@
 from src.mcts.self_play import SelfPlayTree
+from src.mcts.transposition import TranspositionTable
 from src.agents.agent import Agent
+from src.agents.random_agent import RandomAgent
+from src.agents.cached_agent import CachedAgent
 from src.envs.game import Game
 
 
@@ -8,30 +11,166 @@ class MCTSAgent(Agent):
 
     Params:
         color: bool, Color of the player.
+        backend: str, Storage of the search tree nodes ('object', 'array' or 'move').
+        threads: int, Number of threads searching the tree.
+        processes: int, Number of processes searching independent trees.
+        rollouts: int, Random playouts evaluating each new node of the tree.
+        opponent: Agent, Plays the opponent replies while expanding the tree.
+        A random agent by default (a nested search for every reply would be
+        too expensive).
+        reuse_tree: bool, Whether to keep the tree between moves. The next
+        search starts from the subtree of the moves played (ours and the
+        opponent reply) if the tree has it.
+        transpositions: TranspositionTable or int, Table (or its size) sharing
+        the statistics of transposed positions. It's kept between searches
+        (and shared with the copies of this agent). None to disable it.
+        reply_cache: ReplyCache or bool, Cache of the opponent replies during
+        the expansion (see `CachedAgent`), True for the cache shared in the
+        process by the opponents of the same configuration. None to disable it.
+        stats_path: str, JSON lines file where the statistics of every search
+        are appended (see `SearchStats`), None to only keep the last ones.
+        node_cap: int, Max. number of nodes of the tree, pruned when it's
+        exceeded (see `SelfPlayTree.prune`). None for no limit.
+        memory_cap: int, Max. bytes of the tree, None for no limit.
+        evaluator: BatchEvaluator, Network evaluating the nodes instead of the
+        random playouts (see `SelfPlayTree`). It can be shared by the agents
+        of many games to batch their evaluations. None for the playouts.
+        widening: ProgressiveWidening, Limits the expanded moves of the nodes
+        by their visits (see `SelfPlayTree`), None to expand all of them.
+        adaptive_rollouts: AdaptiveRollouts, Adapts the playouts of each new
+        node to its uncertainty, None for `rollouts` each.
+        rollout_moves: int, Max. moves of each random playout.
+        static_evaluator: StaticEvaluator, Scores the unfinished playouts
+        instead of as a draw, so they can be short (see `SelfPlayTree`).
+        endgame_tables: EndgameTables, Score exactly the positions of their
+        endgames instead of searching them (see `build_table`).
+        opening_book: OpeningBook, Book probed before searching: its moves
+        are played without a search (see `build_book`). None to disable it.
      """
 
-    def __init__(self, color):
+    def __init__(self, color, backend='object', threads=6, processes=1, rollouts=500, opponent=None,
+                 reuse_tree=True, transpositions=None, reply_cache=None, stats_path=None,
+                 node_cap=None, memory_cap=None, evaluator=None, widening=None,
+                 adaptive_rollouts=None, rollout_moves=100, static_evaluator=None,
+                 endgame_tables=None, opening_book=None):
         super().__init__(color)
+        self.backend = backend
+        self.threads = threads
+        self.processes = processes
+        self.rollouts = rollouts
+        self.opponent = opponent
+        if self.opponent is None:
+            self.opponent = RandomAgent(not color)
+        if reply_cache is True:
+            self.opponent = CachedAgent(self.opponent)
+        elif reply_cache is not None:
+            self.opponent = CachedAgent(self.opponent, cache=reply_cache)
+        self.reuse_tree = reuse_tree
+        self.tree = None
+        if isinstance(transpositions, int):
+            transpositions = TranspositionTable(transpositions)
+        self.transpositions = transpositions
+        self.stats_path = stats_path
+        self.node_cap = node_cap
+        self.memory_cap = memory_cap
+        self.evaluator = evaluator
+        self.widening = widening
+        self.adaptive_rollouts = adaptive_rollouts
+        self.rollout_moves = rollout_moves
+        self.static_evaluator = static_evaluator
+        self.endgame_tables = endgame_tables
+        self.opening_book = opening_book
+        self.book_moves = 0  # Moves played from the book
+        self.last_search = None
+        self.last_stats = None
+        self.last_ponder = None
+        self.last_move = None
 
-    def best_move(self, game: Game, max_iters=900, verbose=False) -> str:
-        """ Finds and returns the best possible move (UCI encoded)
+    def best_move(self, game: Game, max_iters=900, verbose=False, max_time=None, max_nodes=None,
+                  early_stop=False, max_playouts=None) -> str:
+        """ Finds and returns the best possible move (UCI encoded). The search
+        stops with the first limit reached and the budget it used is left in
+        `last_search` (see `SearchBudget.report`), its statistics in
+        `last_stats` (see `SearchStats`). The moves of the opening book are
+        played without searching.
 
         Parameters:
             game: Game. Current game before the move of this agent is made.
-            max_iters: The max number of iterations of the MCTS algorithm.
+            max_iters: The max number of iterations of the MCTS algorithm (None
+            for no limit).
             verbose: Whether to print the search information.
+            max_time: Max. seconds of search (None for no limit).
+            max_nodes: Max. number of nodes added to the tree (None for no
+            limit).
+            early_stop: Whether to stop when the best move can't change in the
+            remaining budget.
+            max_playouts: Max. number of random playouts (None for no limit).
 
         Returns:
             str. UCI encoded movement.
         """
         best_move = '00000'  # Null move
-        if game.get_result() is None:
-            current_tree = SelfPlayTree(game)
-            best_move = current_tree.search_move(self, max_iters=max_iters, verbose=verbose)
+        self.stop_pondering()
+        book_move = None if self.opening_book is None else self.opening_book.best_move(game.board)
+        if book_move is not None:
+            best_move = book_move
+            self.book_moves += 1
+            self.tree = None  # Out of date
+        elif game.get_result() is None:
+            if not (self.reuse_tree and self.tree is not None and self.tree.reroot(game)):
+                self.tree = SelfPlayTree(game, threads=self.threads, processes=self.processes,
+                                         backend=self.backend, rollouts=self.rollouts,
+                                         transpositions=self.transpositions, node_cap=self.node_cap,
+                                         memory_cap=self.memory_cap, evaluator=self.evaluator,
+                                         widening=self.widening, adaptive_rollouts=self.adaptive_rollouts,
+                                         rollout_moves=self.rollout_moves,
+                                         static_evaluator=self.static_evaluator,
+                                         endgame_tables=self.endgame_tables)
+            best_move = self.tree.search_move(self.opponent, max_iters=max_iters, verbose=verbose,
+                                              max_time=max_time, max_nodes=max_nodes, early_stop=early_stop,
+                                              max_playouts=max_playouts)
+            self.last_search = self.tree.last_search
+            self.last_stats = self.tree.last_stats
+            if self.stats_path is not None:
+                self.last_stats.write_jsonl(self.stats_path, fen=game.board.fen(), backend=self.backend,
+                                            threads=self.threads, processes=self.processes)
             #print("Best move: ", best_move)
 
+        self.last_move = best_move
         return best_move
 
+    def ponder(self, max_time=None):
+        """ Searches in a background thread, while the opponent thinks, the
+        subtree of the reply expected after the last move of this agent. The
+        next `best_move` stops it and, if the opponent played that reply,
+        continues from the pondered subtree.
+
+        Parameters:
+            max_time: Max. seconds of pondering (None until stopped).
+        Returns:
+            bool. Whether the pondering started (it needs the tree of the last
+            move, searched by a single process).
+        """
+        if not self.reuse_tree or self.tree is None or self.processes > 1 or self.last_move is None:
+            return False
+        matching = [c for c in self.tree.root.children if c.moves[:1] == [self.last_move]]
+        if not matching or matching[0].is_terminal_state:
+            return False
+        self.tree.start_pondering(self.opponent, matching[0], max_time=max_time)
+        return True
+
+    def stop_pondering(self):
+        """ Stops the pondering, leaving the budget it used in `last_ponder`. """
+        if self.tree is not None and self.tree.stop_pondering():
+            self.last_ponder = self.tree.last_ponder
+
     def get_copy(self):
         """ Returns a copy of this agent """
-        return MCTSAgent(self.color)
\ No newline at end of file
+        return MCTSAgent(self.color, backend=self.backend, threads=self.threads,
+                         processes=self.processes, rollouts=self.rollouts, opponent=self.opponent,
+                         reuse_tree=self.reuse_tree, transpositions=self.transpositions,
+                         stats_path=self.stats_path, node_cap=self.node_cap, memory_cap=self.memory_cap,
+                         evaluator=self.evaluator, widening=self.widening,
+                         adaptive_rollouts=self.adaptive_rollouts, rollout_moves=self.rollout_moves,
+                         static_evaluator=self.static_evaluator, endgame_tables=self.endgame_tables,
+                         opening_book=self.opening_book)
\ No newline at end of file
@@ -0,0 +1,27 @@
+import random
+
+from src.agents.agent import Agent
+from src.envs.game import Game
+
+
+class RandomAgent(Agent):
+    """ Agent which plays a random legal move. It is a cheap opponent for
+    the expansion of the search trees, tests and benchmarks.
+
+    Params:
+        color: bool, Color of the player.
+    """
+
+    def __init__(self, color):
+        super().__init__(color)
+
+    def best_move(self, game: Game) -> str:
+        """ Returns a random legal move (UCI encoded) of the game. """
+        legal_moves = game.get_legal_moves()
+        if not legal_moves:
+            return Game.NULL_MOVE
+        return random.choice(legal_moves)
+
+    def get_copy(self):
+        """ Returns a copy of this agent """
+        return RandomAgent(self.color)
@@ -19,6 +19,7 @@ class StockfishAgent(Agent):
 
     def __init__(self, color: bool, binary_path: str, thinking_time=0.01, search_depth=5):
         super().__init__(color)
+        self.binary_path = binary_path
         self.engine = chess.engine.SimpleEngine.popen_uci(binary_path)
 
         self.thinking_time = thinking_time
@@ -40,5 +41,9 @@ class StockfishAgent(Agent):
 
         return result.move.uci()
 
+    def cache_key(self):
+        """ The engine and its limits (see `Agent.cache_key`). """
+        return type(self).__name__, self.binary_path, self.thinking_time, self.search_depth
+
     def kill(self):
         self.engine.quit()
@@ -0,0 +1,70 @@
+import sys
+import os
+import argparse
+import numpy as np
+from timeit import default_timer as timer
+sys.path.append(os.path.abspath("."))
+
+from src.agents.random_agent import RandomAgent
+from src.envs.game import Game
+from src.mcts.evaluator import BatchEvaluator
+from src.mcts.self_play import SelfPlayTree
+
+
+class DenseModel:
+    """ Stand-in for the policy/value network: a NumPy MLP over the encoded
+    state, so the cost of a forward pass grows with the batch like a real
+    model on CPU.
+    """
+
+    def __init__(self, hidden=1024, seed=0):
+        rng = np.random.default_rng(seed)
+        self.w1 = rng.normal(0, 0.01, (8 * 8 * 127, hidden)).astype(np.float32)
+        self.w_policy = rng.normal(0, 0.01, (hidden, 1968)).astype(np.float32)
+        self.w_value = rng.normal(0, 0.01, (hidden, 1)).astype(np.float32)
+
+    def __call__(self, states):
+        h = np.maximum(states.reshape(len(states), -1).astype(np.float32) @ self.w1, 0)
+        logits = h @ self.w_policy
+        policies = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return policies / policies.sum(axis=1, keepdims=True), np.tanh(h @ self.w_value)[:, 0]
+
+
+def evaluated_search(batch_size, threads=8, max_iters=200, max_wait=0.005, backend='move', cache=None):
+    """ Searches the initial position evaluating the nodes with the model.
+
+    Returns:
+        iters_per_second: float. Search speed.
+        stats: dict. Usage of the evaluator (see `BatchEvaluator.stats`).
+    """
+    with BatchEvaluator(DenseModel(), batch_size=batch_size, max_wait=max_wait, cache=cache) as evaluator:
+        tree = SelfPlayTree(Game(), threads=threads, backend=backend, evaluator=evaluator)
+        start = timer()
+        tree.search_move(RandomAgent(Game.BLACK), max_iters=max_iters)
+        elapsed = timer() - start
+    return max_iters / elapsed, evaluator.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the search speed with the leaves evaluated "
+                                                 "by a network in batches of several sizes.")
+    parser.add_argument('--iters', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--max-wait', type=float, default=0.005)
+    parser.add_argument('--backend', default='move', choices=SelfPlayTree.BACKENDS)
+    parser.add_argument('--cache-bytes', type=int, default=None,
+                        help="Memory of the evaluation cache, none by default.")
+    args = parser.parse_args()
+
+    print(f"{'batch':>6} {'iters/s':>8} {'avg batch':>10} {'avg wait (ms)':>14} {'cache hits':>11}")
+    for batch_size in args.batch_sizes:
+        ips, stats = evaluated_search(batch_size, args.threads, args.iters, args.max_wait, args.backend,
+                                      args.cache_bytes)
+        hit_rate = stats['cache']['hit_rate'] if 'cache' in stats else 0.
+        print(f"{batch_size:>6} {ips:>8.1f} {stats['avg_batch_size']:>10.2f} {1000 * stats['avg_wait']:>14.2f} "
+              f"{hit_rate:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import sys
+import os
+import random
+import argparse
+from timeit import default_timer as timer
+
+import numpy as np
+sys.path.append(os.path.abspath("."))
+
+from src.envs.game import Game
+from src.envs.batch_game import BatchGame
+from src.utils.encoder_decoder import get_game_state, get_uci_labels
+
+
+def game_plies(n_games, plies):
+    """ Random play of n games one `Game` at a time. Returns the games, the
+    plies made and the seconds taken.
+    """
+    games = [Game() for _ in range(n_games)]
+    made = 0
+    start = timer()
+    for _ in range(plies):
+        for game in games:
+            moves = game.get_legal_moves()
+            if game.get_result() is None and moves:
+                game.move(random.choice(moves), trusted=True)
+                made += 1
+    return games, made, timer() - start
+
+
+def batch_plies(n_games, plies):
+    """ The same random play with a `BatchGame`. """
+    batch = BatchGame.new_games(n_games)
+    made = 0
+    start = timer()
+    for _ in range(plies):
+        made += int((batch.step() >= 0).sum())
+    return made, timer() - start
+
+
+def game_inputs(games, labels):
+    """ Encoded states and legal masks of the games for a batched forward
+    pass, one `Game` at a time. Returns the seconds taken.
+    """
+    start = timer()
+    states = np.array([get_game_state(game) for game in games])
+    masks = np.zeros((len(games), len(labels)), dtype=bool)
+    for i, game in enumerate(games):
+        masks[i, [labels[m] for m in game.get_legal_moves()]] = True
+    assert len(states) == len(masks)
+    return timer() - start
+
+
+def batch_inputs(batch):
+    """ The same inputs from a `BatchGame`. """
+    start = timer()
+    states, masks = batch.encode(), batch.legal_mask()
+    assert len(states) == len(masks)
+    return timer() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares Game and BatchGame on random play of many games "
+                                                 "and on the inputs of a batched forward pass.")
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--plies', type=int, default=40)
+    args = parser.parse_args()
+
+    random.seed(0)
+    np.random.seed(0)
+    games, loop_made, loop_time = game_plies(args.games, args.plies)
+    batch_made, batch_time = batch_plies(args.games, args.plies)
+    loop_speed, batch_speed = loop_made / loop_time, batch_made / batch_time
+    print(f"Random play, Game:      {loop_speed:10.0f} plies/s")
+    print(f"Random play, BatchGame: {batch_speed:10.0f} plies/s ({batch_speed / loop_speed:.1f}x)")
+
+    # Positions of the random games, with their previous moves
+    batch = BatchGame([game.board for game in games])
+    labels = {label: i for i, label in enumerate(get_uci_labels())}
+    loop_time, batch_time = game_inputs(games, labels), batch_inputs(batch)
+    print(f"Network inputs, Game:      {1e6 * loop_time / args.games:8.1f} us/position")
+    print(f"Network inputs, BatchGame: {1e6 * batch_time / args.games:8.1f} us/position "
+          f"({loop_time / batch_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
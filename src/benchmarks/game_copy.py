@@ -0,0 +1,49 @@
+import sys
+import os
+import random
+import argparse
+from timeit import default_timer as timer
+sys.path.append(os.path.abspath("."))
+
+from src.envs.game import Game
+
+
+def random_game(plies, seed=0):
+    """ Game of random moves with up to `plies` moves (pushed on the board
+    directly, so the draws by repetition or the fifty-move rule don't stop it).
+    """
+    random.seed(seed)
+    game = Game()
+    for _ in range(plies):
+        moves = list(game.board.legal_moves)
+        if not moves:
+            break
+        game.board.push(random.choice(moves))
+    return game
+
+
+def copy_time(game, history, n_copies):
+    """ Mean seconds of a copy of the game. """
+    start = timer()
+    for _ in range(n_copies):
+        game.get_copy(history=history)
+    return (timer() - start) / n_copies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the cost of copying a game as it gets longer, "
+                                                 "with its full move stack or as a light copy.")
+    parser.add_argument('--plies', type=int, nargs='*', default=[10, 100, 300, 1000])
+    parser.add_argument('--copies', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'plies':>6} {'full (us)':>10} {'light (us)':>11} {'speedup':>8}")
+    for plies in args.plies:
+        game = random_game(plies)
+        full = copy_time(game, None, args.copies)
+        light = copy_time(game, Game.HISTORY, args.copies)
+        print(f"{len(game):>6} {1e6 * full:>10.1f} {1e6 * light:>11.1f} {full / light:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import sys
+import os
+import random
+import argparse
+from timeit import default_timer as timer
+sys.path.append(os.path.abspath("."))
+
+import chess
+
+from src.envs.game import Game
+
+
+def uncached_ply(board: chess.Board):
+    """ A ply of a random game as `Game` played it before caching: the
+    result, the legal moves, the checked move and the result again.
+    """
+    def result():
+        if board.can_claim_fifty_moves() or board.is_insufficient_material():
+            return 0
+        if board.is_checkmate():
+            return 1 if board.turn == chess.WHITE else -1
+        return None
+
+    if result() is not None:
+        return False
+    moves = [m.uci() for m in board.legal_moves]
+    if not moves:
+        return False
+    move = random.choice(moves)
+    if move in [m.uci() for m in board.legal_moves]:
+        board.push(chess.Move.from_uci(move))
+    result()
+    return True
+
+
+def cached_ply(game: Game, trusted=True):
+    """ The same ply with the cached moves and result of `Game`. """
+    if game.get_result() is not None:
+        return False
+    moves = game.get_legal_moves()
+    if not moves:
+        return False
+    game.move(random.choice(moves), trusted=trusted)
+    game.get_result()
+    return True
+
+
+def plies_per_second(play, n_games=20, max_plies=200, seed=0):
+    """ Plays random games with a ply function and returns its speed. """
+    random.seed(seed)
+    plies = 0
+    start = timer()
+    for _ in range(n_games):
+        game = Game()
+        for _ in range(max_plies):
+            if not play(game):
+                break
+            plies += 1
+    return plies / (timer() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the cost of a ply of a random game with the "
+                                                 "legal moves and results of Game cached or not.")
+    parser.add_argument('--games', type=int, default=20)
+    parser.add_argument('--max_plies', type=int, default=200)
+    args = parser.parse_args()
+
+    modes = {'uncached': lambda game: uncached_ply(game.board),
+             'cached': lambda game: cached_ply(game, trusted=False),
+             'cached, trusted move': cached_ply}
+    base = None
+    print(f"{'mode':>22} {'plies/s':>9} {'us/ply':>8} {'speedup':>8}")
+    for name, play in modes.items():
+        speed = plies_per_second(play, args.games, args.max_plies)
+        base = base or speed
+        print(f"{name:>22} {speed:>9.0f} {1e6 / speed:>8.1f} {speed / base:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import sys
+import os
+import argparse
+import subprocess
+sys.path.append(os.path.abspath("."))
+
+# Seconds each module may take to import in a new interpreter
+BUDGETS = {'src.envs.game': 0.3,
+           'src.mcts.self_play': 0.6,
+           'src.stockfish.stockfish': 0.6}
+
+# Modules only loaded by the features which need them
+HEAVY_MODULES = ('IPython', 'tensorflow', 'requests', 'chess.svg')
+
+
+def import_time(module, repeats=3):
+    """ Best seconds of importing a module in a new interpreter (the process
+    pool workers pay it too), and the heavy modules it loaded.
+    """
+    code = ("import sys, time\n"
+            "start = time.perf_counter()\n"
+            f"import {module}\n"
+            "print(time.perf_counter() - start)\n"
+            f"print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    best, heavy = None, []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                cwd=os.path.abspath(".")).stdout.splitlines()
+        seconds = float(output[0])
+        best = seconds if best is None else min(best, seconds)
+        heavy = output[1].split() if len(output) > 1 else []
+    return best, heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the import time of the entry points and fails if "
+                                                 "one goes over its budget or loads a heavy dependency.")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--scale', type=float, default=1., help="Factor of the budgets (e.g. for slow machines).")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':>24} {'seconds':>8} {'budget':>7} {'heavy modules':>14}")
+    for module, budget in BUDGETS.items():
+        seconds, heavy = import_time(module, args.repeats)
+        over = seconds > budget * args.scale or bool(heavy)
+        failed |= over
+        print(f"{module:>24} {seconds:>8.3f} {budget * args.scale:>7.2f} {' '.join(heavy) or '-':>14}"
+              f"{'  OVER' if over else ''}")
+    if failed:
+        sys.exit("Import time over budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import sys
+import os
+import argparse
+import gc
+import tracemalloc
+from timeit import default_timer as timer
+sys.path.append(os.path.abspath("."))
+
+from src.agents.random_agent import RandomAgent
+from src.envs.game import Game
+from src.mcts.self_play import SelfPlayTree
+
+
+def _count_nodes(node):
+    return 1 + sum(_count_nodes(c) for c in node.children)
+
+
+def tree_memory(backend, max_iters=100, rollouts=1):
+    """ Searches a tree and measures the memory it holds.
+
+    Returns:
+        nodes: int. Nodes of the tree.
+        bytes_per_node: float. Memory retained by the tree per node.
+        iters_per_second: float. Search speed while tracing the allocations.
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tree = SelfPlayTree(Game(), threads=1, backend=backend, rollouts=rollouts)
+    start = timer()
+    tree.search_move(RandomAgent(Game.BLACK), max_iters=max_iters)
+    elapsed = timer() - start
+    tree._walks = None  # The game walked by the search is not part of the tree
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    nodes = _count_nodes(tree.root)
+    return nodes, retained / nodes, max_iters / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the memory per node of the tree backends.")
+    parser.add_argument('--iters', type=int, default=100)
+    parser.add_argument('--backends', nargs='+', default=list(SelfPlayTree.BACKENDS),
+                        choices=SelfPlayTree.BACKENDS)
+    args = parser.parse_args()
+
+    print(f"{'backend':>8} {'nodes':>6} {'bytes/node':>11} {'iters/s':>8}")
+    for backend in args.backends:
+        nodes, per_node, ips = tree_memory(backend, args.iters)
+        print(f"{backend:>8} {nodes:>6} {per_node:>11.0f} {ips:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
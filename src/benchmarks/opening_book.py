@@ -0,0 +1,67 @@
+import sys
+import os
+import random
+import argparse
+import tempfile
+from timeit import default_timer as timer
+sys.path.append(os.path.abspath("."))
+
+from src.agents.mcts_agent import MCTSAgent
+from src.envs.game import Game
+from src.envs.game_store import GameStore
+from src.mcts.opening_book import build_book
+
+
+def random_games(n_games, plies, width=3, seed=0):
+    """ Games picking each move among the first `width` legal ones, so they
+    share their openings like the games of a dataset.
+    """
+    random.seed(seed)
+    store = GameStore()
+    for _ in range(n_games):
+        game = Game()
+        for _ in range(plies):
+            moves = game.get_legal_moves()[:width]
+            if not moves:
+                break
+            game.move(random.choice(moves))
+        store.append(game)
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the cost of an opening move probed in a book "
+                                                 "with a search of the same position.")
+    parser.add_argument('--datasets', nargs='*', default=[],
+                        help="JSON datasets of games, random games if none.")
+    parser.add_argument('--games', type=int, default=1000, help="Random games of the book.")
+    parser.add_argument('--max_plies', type=int, default=20)
+    parser.add_argument('--probes', type=int, default=10000)
+    parser.add_argument('--iters', type=int, default=50, help="Iterations of the search.")
+    args = parser.parse_args()
+
+    store = GameStore()
+    for path in args.datasets:
+        store.load(path)
+    if not args.datasets:
+        store = random_games(args.games, args.max_plies)
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = timer()
+        book = build_book(store, os.path.join(directory, 'book'), args.max_plies)
+        print(f"Book of {len(book)} positions from {len(store)} games built in {timer() - start:.2f}s")
+
+        game = Game()
+        start = timer()
+        for _ in range(args.probes):
+            book.best_move(game.board)
+        probe = (timer() - start) / args.probes
+        start = timer()
+        MCTSAgent(Game.WHITE, threads=1, reuse_tree=False).best_move(game, max_iters=args.iters)
+        search = timer() - start
+        print(f"Book move: {1e6 * probe:.1f} us, search of {args.iters} iterations: {search:.2f} s "
+              f"({search / probe:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
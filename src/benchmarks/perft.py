@@ -0,0 +1,120 @@
+import sys
+import os
+import argparse
+from timeit import default_timer as timer
+
+import numpy as np
+import chess
+sys.path.append(os.path.abspath("."))
+
+from src.envs.game import Game
+from src.envs.batch_board import BatchBoard
+
+# Leaf nodes at each depth (from 1) of well known perft positions
+POSITIONS = {
+    'start': (chess.STARTING_FEN, [20, 400, 8902, 197281, 4865609]),
+    'kiwipete': ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+                 [48, 2039, 97862, 4085603]),
+    'position3': ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', [14, 191, 2812, 43238, 674624]),
+    'position4': ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+                  [6, 264, 9467, 422333]),
+    'position5': ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', [44, 1486, 62379, 2103487]),
+    'position6': ('r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+                  [46, 2079, 89890, 3894594]),
+}
+
+
+def perft_game(game: Game, depth):
+    """ Leaf nodes at a depth with the string API of `Game`. The moves of the
+    last ply are counted, not made (bulk counting, as the other backends).
+    """
+    if depth == 0:
+        return 1
+    moves = game.get_legal_moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        game.move(move, trusted=True)
+        nodes += perft_game(game, depth - 1)
+        game.pop()
+    return nodes
+
+
+def perft_board(board: chess.Board, depth):
+    """ Leaf nodes at a depth with python-chess. """
+    if depth == 0:
+        return 1
+    if depth == 1:
+        return board.legal_moves.count()
+    nodes = 0
+    for move in board.legal_moves:
+        board.push(move)
+        nodes += perft_board(board, depth - 1)
+        board.pop()
+    return nodes
+
+
+def perft_batch(boards: BatchBoard, depth, chunk=2 ** 16):
+    """ Leaf nodes at a depth with `BatchBoard`, a ply of every board at
+    once (the boards after each ply are expanded in chunks of boards).
+    """
+    if depth == 0:
+        return len(boards)
+    moves = boards.legal_moves()
+    if depth == 1:
+        return len(moves.row)
+    nodes = 0
+    for start in range(0, len(moves.row), chunk):
+        index = np.arange(start, min(start + chunk, len(moves.row)))
+        after = boards.take(moves.row[index])
+        after.push(np.arange(len(index)), moves.from_square[index], moves.to_square[index],
+                   moves.promotion[index])
+        nodes += perft_batch(after, depth - 1, chunk)
+    return nodes
+
+
+BACKENDS = {
+    'game': lambda fen, depth: perft_game(Game(board=chess.Board(fen)), depth),
+    'python-chess': lambda fen, depth: perft_board(chess.Board(fen), depth),
+    'batch': lambda fen, depth: perft_batch(BatchBoard([chess.Board(fen)]), depth),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perft of well known positions with each move generator: "
+                                                 "the leaf nodes are checked against the known counts and "
+                                                 "the nodes per second are reported.")
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--positions', nargs='*', default=list(POSITIONS), choices=list(POSITIONS))
+    parser.add_argument('--backends', nargs='*', default=list(BACKENDS), choices=list(BACKENDS))
+    args = parser.parse_args()
+
+    print(f"{'position':>10} {'backend':>13} {'nodes':>10} {'seconds':>8} {'nodes/s':>10} {'check':>6}")
+    failed = False
+    totals = {backend: [0, 0.] for backend in args.backends}
+    for name in args.positions:
+        fen, counts = POSITIONS[name]
+        if args.depth > len(counts):
+            print(f"{name:>10} has known counts up to depth {len(counts)}")
+            continue
+        for backend in args.backends:
+            start = timer()
+            nodes = BACKENDS[backend](fen, args.depth)
+            elapsed = timer() - start
+            ok = nodes == counts[args.depth - 1]
+            failed |= not ok
+            totals[backend][0] += nodes
+            totals[backend][1] += elapsed
+            print(f"{name:>10} {backend:>13} {nodes:>10} {elapsed:>8.2f} {nodes / elapsed:>10.0f} "
+                  f"{'ok' if ok else 'WRONG':>6}")
+
+    for backend, (nodes, elapsed) in totals.items():
+        if elapsed:
+            print(f"{'total':>10} {backend:>13} {nodes:>10} {elapsed:>8.2f} {nodes / elapsed:>10.0f}")
+    if failed:
+        sys.exit("Wrong node counts")
+
+
+if __name__ == "__main__":
+    main()
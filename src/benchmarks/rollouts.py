@@ -0,0 +1,49 @@
+import sys
+import os
+import argparse
+import random
+from timeit import default_timer as timer
+
+import numpy as np
+sys.path.append(os.path.abspath("."))
+
+from src.envs.game import Game
+from src.mcts.simulation import RandomSimulation, BatchRandomSimulation
+from src.mcts.static_evaluation import StaticEvaluator
+
+
+def playouts_per_second(simulation, repetitions, max_moves=100, evaluator=None):
+    """ Measures the random playouts per second of a simulation class from
+    the initial position.
+    """
+    start = timer()
+    simulation(Game()).run(max_moves=max_moves, repetitions=repetitions, evaluator=evaluator)
+    return repetitions / (timer() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the random playouts per second of "
+                                                 "RandomSimulation and BatchRandomSimulation, "
+                                                 "with full and truncated playouts.")
+    parser.add_argument('--repetitions', type=int, default=500,
+                        help="Playouts of the batch simulation.")
+    parser.add_argument('--loop_repetitions', type=int, default=20,
+                        help="Playouts of the one at a time simulation.")
+    parser.add_argument('--max_moves', type=int, default=100)
+    parser.add_argument('--truncated_moves', type=int, default=16,
+                        help="Moves of the playouts scored by the static evaluator.")
+    args = parser.parse_args()
+
+    random.seed(0)
+    np.random.seed(0)
+    loop = playouts_per_second(RandomSimulation, args.loop_repetitions, args.max_moves)
+    batch = playouts_per_second(BatchRandomSimulation, args.repetitions, args.max_moves)
+    print(f"RandomSimulation:      {loop:10.1f} playouts/s")
+    truncated = playouts_per_second(BatchRandomSimulation, args.repetitions, args.truncated_moves,
+                                    StaticEvaluator())
+    print(f"BatchRandomSimulation: {batch:10.1f} playouts/s ({batch / loop:.1f}x)")
+    print(f"  {args.truncated_moves} moves + eval:    {truncated:10.1f} playouts/s ({truncated / loop:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
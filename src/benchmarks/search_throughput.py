@@ -0,0 +1,58 @@
+import sys
+import os
+import argparse
+from timeit import default_timer as timer
+sys.path.append(os.path.abspath("."))
+
+from src.agents.random_agent import RandomAgent
+from src.envs.game import Game
+from src.mcts.self_play import SelfPlayTree
+
+
+def iterations_per_second(mode, workers, max_iters=200, backend='object', rollouts=500):
+    """ Measures the search throughput of `SelfPlayTree.search_move`.
+
+    Parameters:
+        mode: str. 'tree' (threads over one tree) or 'root' (processes
+        searching independent trees).
+        workers: int. Number of threads or processes.
+        max_iters: int. Iterations of the search.
+        backend: str. Storage of the tree nodes.
+        rollouts: int. Random playouts evaluating each new node.
+    Returns:
+        float. Iterations per second.
+    """
+    game = Game()
+    if mode == 'tree':
+        tree = SelfPlayTree(game, threads=workers, backend=backend, rollouts=rollouts)
+    else:
+        tree = SelfPlayTree(game, threads=1, processes=workers, backend=backend, rollouts=rollouts)
+
+    start = timer()
+    tree.search_move(RandomAgent(Game.BLACK), max_iters=max_iters)
+    return max_iters / (timer() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the iterations per second of the "
+                                                 "parallel MCTS search.")
+    parser.add_argument('--iters', type=int, default=200,
+                        help="Iterations of each search.")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help="Numbers of threads/processes to measure.")
+    parser.add_argument('--modes', nargs='+', default=['tree', 'root'],
+                        choices=['tree', 'root'])
+    parser.add_argument('--backend', default='object', choices=SelfPlayTree.BACKENDS)
+    parser.add_argument('--rollouts', type=int, default=500,
+                        help="Random playouts evaluating each new node.")
+    args = parser.parse_args()
+
+    print(f"{'mode':>6} {'workers':>8} {'iters/s':>10}")
+    for mode in args.modes:
+        for workers in args.workers:
+            ips = iterations_per_second(mode, workers, args.iters, args.backend, args.rollouts)
+            print(f"{mode:>6} {workers:>8} {ips:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import sys
+import os
+import argparse
+import timeit
+sys.path.append(os.path.abspath("."))
+
+import numpy as np
+
+from src.envs.game import Game
+from src.mcts.node import Node
+from src.mcts.array_tree import NodeArrays, ArrayNode
+
+
+def _object_node(state, branching):
+    node = Node(state)
+    for _ in range(branching):
+        child = node.add_child(state)
+        child.visits, child.value = np.random.randint(1, 100), np.random.rand()
+    return node
+
+
+def _array_node(state, branching):
+    store = NodeArrays(state, capacity=branching + 1)
+    start = store.allocate(branching)
+    store.parent[start:] = 0
+    store.first_child[0], store.n_children[0], store.n_expanded[0] = start, branching, branching
+    store.visits[start:] = np.random.randint(1, 100, size=branching)
+    store.value[start:] = np.random.rand(branching)
+    return ArrayNode(store, 0)
+
+
+def selection_time(backend, branching, ucb1=False, number=1000):
+    """ Measures the time (seconds) of a selection step (`get_best_child`) of
+    a node with the given number of children.
+    """
+    state = Game()
+    node = _object_node(state, branching) if backend == 'object' else _array_node(state, branching)
+    return timeit.timeit(lambda: node.get_best_child(ucb1=ucb1), number=number) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the cost of a selection step against "
+                                                 "the branching factor.")
+    parser.add_argument('--branching', type=int, nargs='+', default=[8, 32, 128, 512])
+    args = parser.parse_args()
+
+    print(f"{'backend':>8} {'metric':>7} {'children':>9} {'us/step':>8}")
+    for backend in ('object', 'array'):
+        for ucb1 in (False, True):
+            for branching in args.branching:
+                t = selection_time(backend, branching, ucb1)
+                print(f"{backend:>8} {'ucb1' if ucb1 else 'puct':>7} {branching:>9} {t * 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import sys
+import os
+import argparse
+from timeit import default_timer as timer
+sys.path.append(os.path.abspath("."))
+
+import chess
+
+from src.agents.random_agent import RandomAgent
+from src.envs.game import Game
+from src.mcts.self_play import SelfPlayTree
+
+# Italian game after 4 moves each
+MIDDLEGAME_FEN = 'r1bq1rk1/pppp1ppp/2n2n2/2b1p3/2B1P3/2NP1N2/PPP2PPP/R1BQK2R w KQ - 1 6'
+
+
+def transposition_stats(fen=MIDDLEGAME_FEN, max_iters=300, size=2 ** 16, backend='object', rollouts=50):
+    """ Searches a position with a transposition table.
+
+    Returns:
+        dict. Statistics of the table (see `TranspositionTable.stats`) and
+        the iterations per second of the search.
+    """
+    game = Game(board=chess.Board(fen))
+    tree = SelfPlayTree(game, threads=1, backend=backend, rollouts=rollouts, transpositions=size)
+    start = timer()
+    tree.search_move(RandomAgent(not game.board.turn), max_iters=max_iters)
+    stats = tree.transpositions.stats()
+    stats['iters/s'] = max_iters / (timer() - start)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reports the hit and collision rates of the "
+                                                 "MCTS transposition table.")
+    parser.add_argument('--fen', default=MIDDLEGAME_FEN)
+    parser.add_argument('--iters', type=int, default=300)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2 ** 8, 2 ** 16],
+                        help="Sizes of the table to measure.")
+    parser.add_argument('--backend', default='object', choices=SelfPlayTree.BACKENDS)
+    parser.add_argument('--rollouts', type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'size':>8} {'hit rate':>9} {'collisions':>11} {'evictions':>10} {'shared':>8} {'iters/s':>8}")
+    for size in args.sizes:
+        s = transposition_stats(args.fen, args.iters, size, args.backend, args.rollouts)
+        print(f"{s['size']:>8} {s['hit_rate']:>9.3f} {s['collision_rate']:>11.3f} "
+              f"{s['evictions']:>10} {s['shared_visits']:>8} {s['iters/s']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,449 @@
+from collections import namedtuple
+
+import numpy as np
+import chess
+
+from src.utils.bitboards import BIT, KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, \
+    bishop_attacks, rook_attacks, popcount, scan
+
+# Piece indexes in the bitboard arrays (python-chess piece type - 1)
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+PROMOTIONS = np.array([chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT])
+
+ONGOING = 2  # Result of a board whose game is not over
+
+_BACK_RANKS = np.array([chess.BB_RANK_8, chess.BB_RANK_1], dtype=np.uint64)
+_DARK_SQUARES = np.uint64(chess.BB_DARK_SQUARES)
+_LIGHT_SQUARES = np.uint64(chess.BB_LIGHT_SQUARES)
+
+# Offsets of the hashed fields: 12 bitboards, castling rights and en passant square
+_HASH_OFFSETS = np.random.RandomState(0).randint(1, 2 ** 63, size=14, dtype=np.uint64)
+_WHITE_HASH = np.uint64(0x9e3779b97f4a7c15)
+_HISTORY = 101  # Positions since the last capture or pawn move (at most 100 half-moves)
+
+
+def _mix(x):
+    """ splitmix64 finalizer: a well spread 64-bit hash of each value. """
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+Moves = namedtuple('Moves', ['row', 'from_square', 'to_square', 'promotion', 'piece', 'zeroing'])
+Moves.__doc__ = """ Legal moves of several boards, grouped by board.
+
+    Attributes:
+        row: np.array. Board of each move.
+        from_square, to_square: np.array. Squares of each move.
+        promotion: np.array. python-chess piece type of the promotion, 0 if none.
+        piece: np.array. Index (PAWN ... KING) of the moved piece.
+        zeroing: np.array. Whether the move resets the fifty-move counter.
+    """
+
+
+class BatchBoard:
+    """ Several chess positions stored as arrays of bitboards, so the move
+    generation, the moves and the game results of all of them are computed
+    with NumPy operations over the whole batch instead of one python-chess
+    call per board. Only standard chess is supported.
+
+    Attributes:
+        pieces: np.array (N, 2, 6) uint64. Bitboards of each board, color
+        (python-chess BLACK = 0, WHITE = 1) and piece.
+        turn: np.array (N,) bool. Whether it is white turn.
+        castling: np.array (N,) uint64. Rooks with castling rights.
+        ep_square: np.array (N,) int. En passant square, -1 if none.
+        halfmove_clock: np.array (N,) int. Half-moves since the last capture
+        or pawn move.
+        fullmove_number: np.array (N,) int.
+        history: np.array (N, 101) uint64. Hash of the positions of each board
+        indexed by their half-move clock (0 if unknown), so the repetitions
+        since the last capture or pawn move are found. None unless tracked
+        (see `track_repetitions`).
+    """
+
+    def __init__(self, boards):
+        """ Parameters:
+                boards: List[chess.Board]. Initial positions.
+        """
+        self.pieces = np.array([[[board.pieces_mask(piece_type, color) for piece_type in chess.PIECE_TYPES]
+                                 for color in chess.COLORS[::-1]]
+                                for board in boards], dtype=np.uint64).reshape(-1, 2, 6)
+        self.turn = np.array([board.turn for board in boards], dtype=bool)
+        self.castling = np.array([board.clean_castling_rights() for board in boards], dtype=np.uint64)
+        self.ep_square = np.array([-1 if board.ep_square is None else board.ep_square
+                                   for board in boards], dtype=np.int64)
+        self.halfmove_clock = np.array([board.halfmove_clock for board in boards], dtype=np.int64)
+        self.fullmove_number = np.array([board.fullmove_number for board in boards], dtype=np.int64)
+        self.history = None
+
+    FIELDS = ('pieces', 'turn', 'castling', 'ep_square', 'halfmove_clock', 'fullmove_number')
+
+    @classmethod
+    def from_board(cls, board, n, track_repetitions=False):
+        """ Builds a batch with n copies of a board (see `track_repetitions`). """
+        batch = cls([board])
+        if track_repetitions:
+            batch.track_repetitions()
+        return batch.take(np.zeros(n, dtype=np.intp))
+
+    def take(self, rows):
+        """ Returns a new batch with copies of the boards (rows can repeat). """
+        batch = BatchBoard([])
+        for name in self.FIELDS:
+            setattr(batch, name, getattr(self, name)[rows])
+        if self.history is not None:
+            batch.history = self.history[rows]
+        return batch
+
+    def track_repetitions(self):
+        """ Starts keeping the `history` of the boards, so their games end in
+        a draw by threefold repetition as in `Game.get_result`. Only the
+        positions from now on are counted. Returns the batch.
+        """
+        self.history = np.zeros((len(self), _HISTORY), dtype=np.uint64)
+        self._record(np.arange(len(self)))
+        return self
+
+    def hash(self, rows=None):
+        """ Hash of the position of each board for the repetition rules (the
+        en passant square only counts if a pawn attacks it). Never 0.
+        """
+        rows = self._rows(rows)
+        us = self.turn[rows].astype(np.intp)
+        ep_square = self.ep_square[rows]
+        capturable = (ep_square >= 0) & \
+            ((PAWN_ATTACKS[1 - us, np.maximum(ep_square, 0)] & self.pieces[rows, us, PAWN]) != 0)
+        fields = np.concatenate([self.pieces[rows].reshape(-1, 12), self.castling[rows, None],
+                                 np.where(capturable, ep_square, 64).astype(np.uint64)[:, None]], axis=1)
+        keys = np.bitwise_xor.reduce(_mix(fields + _HASH_OFFSETS), axis=1)
+        return (keys ^ np.where(self.turn[rows], _WHITE_HASH, np.uint64(0))) | np.uint64(1)
+
+    def _record(self, rows):
+        """ Adds the current positions of the boards to their history. """
+        self.history[rows, np.minimum(self.halfmove_clock[rows], _HISTORY - 1)] = self.hash(rows)
+
+    def is_repetition(self, rows=None, count=3):
+        """ Whether the position of each board was reached at least `count`
+        times (False if the repetitions aren't tracked).
+        """
+        rows = self._rows(rows)
+        if self.history is None:
+            return np.zeros(len(rows), dtype=bool)
+        clock = np.minimum(self.halfmove_clock[rows], _HISTORY - 1)
+        history = self.history[rows]
+        current = history[np.arange(len(rows)), clock]
+        earlier = np.arange(_HISTORY) < clock[:, None]
+        return ((history == current[:, None]) & earlier).sum(axis=1) + 1 >= count
+
+    def __len__(self):
+        return len(self.turn)
+
+    def to_board(self, i):
+        """ Returns the python-chess board of the position i. """
+        board = chess.Board(None)
+        for color in chess.COLORS:
+            for piece_type in chess.PIECE_TYPES:
+                for square in chess.SquareSet(int(self.pieces[i, int(color), piece_type - 1])):
+                    board.set_piece_at(square, chess.Piece(piece_type, color))
+        board.turn = bool(self.turn[i])
+        board.castling_rights = int(self.castling[i])
+        board.ep_square = None if self.ep_square[i] < 0 else int(self.ep_square[i])
+        board.halfmove_clock = int(self.halfmove_clock[i])
+        board.fullmove_number = int(self.fullmove_number[i])
+        return board
+
+    def _rows(self, rows):
+        return np.arange(len(self)) if rows is None else np.asarray(rows, dtype=np.intp)
+
+    @staticmethod
+    def _attacked(square, occupied, their, color):
+        """ Whether the squares of a color are attacked by the pieces `their`
+        (array (K, 6)) with the occupied bitboards.
+        """
+        attackers = (KNIGHT_ATTACKS[square] & their[:, KNIGHT]) | \
+                    (KING_ATTACKS[square] & their[:, KING]) | \
+                    (PAWN_ATTACKS[color, square] & their[:, PAWN]) | \
+                    (bishop_attacks(square, occupied) & (their[:, BISHOP] | their[:, QUEEN])) | \
+                    (rook_attacks(square, occupied) & (their[:, ROOK] | their[:, QUEEN]))
+        return attackers != 0
+
+    def _king_squares(self, rows, color):
+        king_rows, squares = scan(self.pieces[rows, color, KING])
+        king_square = np.zeros(len(rows), dtype=np.intp)
+        king_square[king_rows] = squares
+        return king_square
+
+    def is_check(self, rows=None):
+        """ Whether the side to move of each board is in check. """
+        rows = self._rows(rows)
+        us = self.turn[rows].astype(np.intp)
+        their = self.pieces[rows, 1 - us]
+        occupied = np.bitwise_or.reduce(self.pieces[rows], axis=(1, 2))
+        return self._attacked(self._king_squares(rows, us), occupied, their, us)
+
+    def _pseudo_legal_moves(self, rows):
+        """ Generates the moves of the boards without checking if they leave
+        the king in check (castling moves are already legal).
+
+        Returns:
+            candidates: Moves. Moves whose `row` is the position in `rows`.
+            context: tuple. Arrays of each row needed by `_legal`.
+        """
+        local = np.arange(len(rows))
+        us = self.turn[rows].astype(np.intp)
+        own = self.pieces[rows, us]
+        their = self.pieces[rows, 1 - us]
+        own_occupied = np.bitwise_or.reduce(own, axis=1)
+        their_occupied = np.bitwise_or.reduce(their, axis=1)
+        occupied = own_occupied | their_occupied
+        king_square = self._king_squares(rows, us)
+        ep_square = self.ep_square[rows]
+        ep_bb = np.where(ep_square >= 0, BIT[np.maximum(ep_square, 0)], np.uint64(0))
+
+        # Targets of every piece
+        flat, square = scan(own.reshape(-1))
+        r, piece = flat // 6, flat % 6
+        targets = np.zeros(len(square), dtype=np.uint64)
+        for index, table in ((KNIGHT, KNIGHT_ATTACKS), (KING, KING_ATTACKS)):
+            mask = piece == index
+            targets[mask] = table[square[mask]]
+        mask = (piece == BISHOP) | (piece == QUEEN)
+        targets[mask] |= bishop_attacks(square[mask], occupied[r[mask]])
+        mask = (piece == ROOK) | (piece == QUEEN)
+        targets[mask] |= rook_attacks(square[mask], occupied[r[mask]])
+
+        mask = piece == PAWN
+        p_square, p_r = square[mask], r[mask]
+        color = us[p_r]
+        step = 16 * color - 8
+        single = BIT[p_square + step] & ~occupied[p_r]
+        start_rank = np.where(color == 1, 1, 6)
+        double_square = np.where(p_square // 8 == start_rank, p_square + 2 * step, p_square)
+        double = np.where((p_square // 8 == start_rank) & (single != 0),
+                          BIT[double_square] & ~occupied[p_r], np.uint64(0))
+        captures = PAWN_ATTACKS[color, p_square] & (their_occupied[p_r] | ep_bb[p_r])
+        targets[mask] = single | double | captures
+        targets &= ~own_occupied[r]
+
+        i, to_square = scan(targets)
+        r, from_square, piece = r[i], square[i], piece[i]
+
+        # Promotions to every piece
+        promoting = (piece == PAWN) & ((to_square // 8 == 0) | (to_square // 8 == 7))
+        if promoting.any():
+            repeats = np.where(promoting, 4, 1)
+            r, from_square, to_square, piece = [np.repeat(a, repeats) for a in (r, from_square, to_square, piece)]
+            promotion = np.zeros(len(r), dtype=np.int64)
+            promotion[np.repeat(promoting, repeats)] = np.tile(PROMOTIONS, int(promoting.sum()))
+        else:
+            promotion = np.zeros(len(r), dtype=np.int64)
+        zeroing = (piece == PAWN) | ((their_occupied[r] & BIT[to_square]) != 0)
+        moves = [r, from_square, to_square, promotion, piece, zeroing]
+
+        # Castling: path empty and the king doesn't cross attacked squares
+        base = np.where(us == 1, 0, 56)
+        for rook_file, king_file, path_files in ((7, 6, (5, 6)), (0, 2, (1, 2, 3))):
+            path = np.bitwise_or.reduce([BIT[base + f] for f in path_files], axis=0)
+            can = ((self.castling[rows] & own[:, ROOK] & BIT[base + rook_file]) != 0) & \
+                (king_square == base + 4) & ((occupied & path) == 0)
+            for f in sorted({4, (4 + king_file) // 2, king_file}):
+                can[can] &= ~self._attacked(base[can] + f, occupied[can], their[can], us[can])
+            if can.any():
+                zeros = np.zeros(can.sum(), dtype=np.int64)
+                castles = (local[can], base[can] + 4, base[can] + king_file, zeros, zeros + KING, zeros.astype(bool))
+                moves = [np.concatenate([m, c]) for m, c in zip(moves, castles)]
+
+        order = np.argsort(moves[0], kind='stable')
+        return Moves(*[m[order] for m in moves]), (us, occupied, their, king_square, ep_square)
+
+    def _legal(self, candidates, context, index):
+        """ Whether the candidates at the positions `index` don't leave the
+        king in check.
+        """
+        us, occupied, their, king_square, ep_square = context
+        r = candidates.row[index]
+        from_square, to_square = candidates.from_square[index], candidates.to_square[index]
+        piece = candidates.piece[index]
+        to_bb = BIT[to_square]
+        en_passant = (piece == PAWN) & (to_square == ep_square[r])
+        captured_bb = np.where(en_passant, BIT[np.clip(to_square - (16 * us[r] - 8), 0, 63)], to_bb)
+        after = (occupied[r] & ~BIT[from_square] & ~captured_bb) | to_bb
+        checked = np.where(piece == KING, to_square, king_square[r])
+        return ~self._attacked(checked, after, their[r] & ~captured_bb[:, None], us[r])
+
+    def legal_moves(self, rows=None):
+        """ Generates the legal moves of the boards.
+
+        Parameters:
+            rows: np.array. Boards whose moves are generated (all by default).
+        Returns:
+            Moves. Moves sorted following the order of `rows`.
+        """
+        rows = self._rows(rows)
+        candidates, context = self._pseudo_legal_moves(rows)
+        legal = self._legal(candidates, context, np.arange(len(candidates.row)))
+        moves = [m[legal] for m in candidates]
+        moves[0] = rows[moves[0]]
+        return Moves(*moves)
+
+    def random_moves(self, rows=None):
+        """ Picks a uniformly random legal move of each board whose game is
+        not over. Only the picked pseudo-legal move is checked, and the boards
+        where it is illegal pick again among their legal moves (rejection
+        sampling), so most boards never check all their moves.
+
+        Parameters:
+            rows: np.array. Boards whose moves are picked (all by default).
+        Returns:
+            moves: Moves. One move of each board whose game is not over.
+            results, stalemate: np.array. See `results`.
+        """
+        rows = self._rows(rows)
+        candidates, context = self._pseudo_legal_moves(rows)
+        counts = np.bincount(candidates.row, minlength=len(rows))
+        first = np.cumsum(counts) - counts
+        picked = first + (np.random.random(len(rows)) * counts).astype(np.intp)
+        has_moves = counts > 0
+        accepted = np.zeros(len(rows), dtype=bool)
+        accepted[has_moves] = self._legal(candidates, context, picked[has_moves])
+
+        # All the moves are needed by rejected boards and close to the fifty-move rule
+        n_moves = accepted.astype(np.int64)
+        n_quiet = np.zeros(len(rows))
+        full = has_moves & (~accepted | (self.halfmove_clock[rows] >= 99))
+        if full.any():
+            index = np.flatnonzero(full[candidates.row])
+            index = index[self._legal(candidates, context, index)]
+            r = candidates.row[index]
+            n_moves[full] = np.bincount(r, minlength=len(rows))[full]
+            n_quiet = np.bincount(r, weights=~candidates.zeroing[index], minlength=len(rows))
+            redo = full & ~accepted & (n_moves > 0)
+            offsets = np.cumsum(n_moves[full]) - n_moves[full]
+            position = np.zeros(len(rows), dtype=np.intp)
+            position[full] = offsets
+            nth = (np.random.random(redo.sum()) * n_moves[redo]).astype(np.intp)
+            picked[redo] = index[position[redo] + nth]
+            accepted |= redo
+
+        results, stalemate = self._outcome(rows, n_moves, n_quiet)
+        playing = accepted & (results == ONGOING)
+        moves = [m[picked[playing]] for m in candidates]
+        moves[0] = rows[moves[0]]
+        return Moves(*moves), results, stalemate
+
+    def count_moves(self, moves, rows=None):
+        """ Number of legal moves of each board (in the order of `rows`). """
+        rows = self._rows(rows)
+        position = np.zeros(len(self), dtype=np.intp)
+        position[rows] = np.arange(len(rows))
+        return np.bincount(position[moves.row], minlength=len(rows))
+
+    def push(self, rows, from_square, to_square, promotion):
+        """ Makes a move in each of the boards (rows must be unique).
+
+        Parameters:
+            rows: np.array. Boards where the moves are made.
+            from_square, to_square: np.array. Squares of the moves.
+            promotion: np.array. python-chess piece type of the promotions
+            (0 if none).
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        n = np.arange(len(rows))
+        us = self.turn[rows].astype(np.intp)
+        own = self.pieces[rows, us]
+        their = self.pieces[rows, 1 - us]
+        from_bb, to_bb = BIT[from_square], BIT[to_square]
+        piece = np.argmax((own & from_bb[:, None]) != 0, axis=1)
+        capture = (np.bitwise_or.reduce(their, axis=1) & to_bb) != 0
+
+        en_passant = (piece == PAWN) & (to_square == self.ep_square[rows])
+        captured_bb = np.where(en_passant, BIT[np.clip(to_square - (16 * us - 8), 0, 63)], to_bb)
+        their &= ~captured_bb[:, None]
+
+        own[n, piece] &= ~from_bb
+        own[n, np.where(promotion > 0, promotion - 1, piece)] |= to_bb
+
+        # Castling moves the rook too
+        castle = (piece == KING) & (np.abs(to_square - from_square) == 2)
+        kingside = to_square > from_square
+        rook_from = np.where(kingside, to_square + 1, to_square - 2)[castle]
+        rook_to = np.where(kingside, to_square - 1, to_square + 1)[castle]
+        own[castle, ROOK] = (own[castle, ROOK] & ~BIT[rook_from]) | BIT[rook_to]
+
+        self.pieces[rows, us] = own
+        self.pieces[rows, 1 - us] = their
+
+        castling = self.castling[rows] & ~from_bb & ~to_bb
+        self.castling[rows] = np.where(piece == KING, castling & ~_BACK_RANKS[us], castling)
+        double = (piece == PAWN) & (np.abs(to_square - from_square) == 16)
+        self.ep_square[rows] = np.where(double, (from_square + to_square) // 2, -1)
+        zeroing = (piece == PAWN) | capture
+        self.halfmove_clock[rows] = np.where(zeroing, 0, self.halfmove_clock[rows] + 1)
+        self.fullmove_number[rows] += 1 - us
+        self.turn[rows] = ~self.turn[rows]
+        if self.history is not None:
+            self._record(rows)
+
+    def is_insufficient_material(self, rows=None):
+        """ Whether neither side has sufficient winning material (same rules
+        as python-chess).
+        """
+        rows = self._rows(rows)
+        pieces = self.pieces[rows]
+        occupied_co = np.bitwise_or.reduce(pieces, axis=2)
+        all_pieces = np.bitwise_or.reduce(pieces, axis=1)
+        bishops = all_pieces[:, BISHOP]
+        same_color_bishops = ((bishops & _DARK_SQUARES) == 0) | ((bishops & _LIGHT_SQUARES) == 0)
+
+        insufficient = np.ones(len(rows), dtype=bool)
+        for color in (0, 1):
+            own = occupied_co[:, color]
+            other = occupied_co[:, 1 - color]
+            heavy = (own & (all_pieces[:, PAWN] | all_pieces[:, ROOK] | all_pieces[:, QUEEN])) != 0
+            knights = (own & all_pieces[:, KNIGHT]) != 0
+            has_bishops = (own & bishops) != 0
+            knight_draw = (popcount(own) <= 2) & \
+                ((other & ~all_pieces[:, KING] & ~all_pieces[:, QUEEN]) == 0)
+            bishop_draw = same_color_bishops & (all_pieces[:, PAWN] == 0) & (all_pieces[:, KNIGHT] == 0)
+            insufficient &= ~heavy & np.where(knights, knight_draw, np.where(has_bishops, bishop_draw, True))
+        return insufficient
+
+    def results(self, moves, rows=None):
+        """ Results of the games for the white pieces with the same rules as
+        `Game.get_result` (fifty-move rule, insufficient material, checkmate
+        and threefold repetition if tracked). The fifty-move claim at 99 half-moves doesn't check that
+        the claiming move leaves legal moves to the opponent.
+
+        Parameters:
+            moves: Moves. Legal moves of the boards (see `legal_moves`).
+            rows: np.array. Boards matching the moves (all by default).
+        Returns:
+            results: np.array. 1, 0 or -1 if the game is over, else ONGOING.
+            stalemate: np.array. Whether the game is blocked with no legal
+            moves (not a result for `Game.get_result`).
+        """
+        rows = self._rows(rows)
+        position = np.zeros(len(self), dtype=np.intp)
+        position[rows] = np.arange(len(rows))
+        n_moves = np.bincount(position[moves.row], minlength=len(rows))
+        n_quiet = np.bincount(position[moves.row], weights=~moves.zeroing, minlength=len(rows))
+        return self._outcome(rows, n_moves, n_quiet)
+
+    def _outcome(self, rows, n_moves, n_quiet):
+        """ See `results`. n_quiet is only used by boards with 99 half-moves
+        (number of legal moves which don't reset the fifty-move counter).
+        """
+        clock = self.halfmove_clock[rows]
+        fifty = ((clock >= 100) & (n_moves > 0)) | ((clock == 99) & (n_quiet > 0))
+        draw = fifty | self.is_insufficient_material(rows) | self.is_repetition(rows)
+
+        check = np.zeros(len(rows), dtype=bool)
+        no_moves = n_moves == 0
+        check[no_moves] = self.is_check(rows[no_moves])
+
+        results = np.full(len(rows), ONGOING, dtype=np.int64)
+        mate = no_moves & check & ~draw
+        results[mate] = np.where(self.turn[rows][mate], 1, -1)
+        results[draw] = 0
+        return results, no_moves & ~check & ~draw
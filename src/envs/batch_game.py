@@ -0,0 +1,218 @@
+import numpy as np
+import chess
+
+from src.envs.batch_board import BatchBoard, ONGOING
+from src.utils.encoder_decoder import get_uci_labels, encode_move
+
+NO_MOVE = -1  # Move of the boards which don't move
+
+
+def _label_tables():
+    """ Code (see `encode_move`) of each policy label and label of each
+    code, -1 for the codes without a label.
+    """
+    codes = np.array([encode_move(chess.Move.from_uci(label)) for label in get_uci_labels()], dtype=np.int64)
+    labels = np.full(1 << 15, -1, dtype=np.int64)
+    labels[codes] = np.arange(len(codes))
+    return codes, labels
+
+
+LABEL_CODES, CODE_LABELS = _label_tables()
+
+
+def _codes(moves):
+    """ Codes (see `encode_move`) of some `Moves`. """
+    return moves.from_square | (moves.to_square << 6) | (moves.promotion << 12)
+
+
+class BatchGame:
+    """ Many independent games advanced in lockstep, as the rows of a
+    `BatchBoard`: the legal moves, the moves, the results and the encoded
+    states of all of them are computed with NumPy operations over the whole
+    batch. It follows the rules of `Game` (including the threefold
+    repetition) and its encoding (`get_game_state`), so self-play and
+    rollouts of thousands of games avoid a python-chess call per move.
+
+    The moves are integer codes (see `encode_move`), NO_MOVE for the boards
+    that don't move. The legal moves are computed once per position.
+
+    Parameters:
+        boards: List[chess.Board]. Initial positions. Their move stacks give
+        the previous positions of the encoding and the repetitions.
+        T: int. Previous positions of the encoding.
+
+    Attributes:
+        board: BatchBoard. Current positions.
+        past: np.array (N, T, 2, 6) uint64. Bitboards of the T previous
+        positions of each game, the last one first.
+        depth: np.array (N,) int. Previous positions known of each game (up
+        to T, the others are encoded as zeros).
+        plies: np.array (N,) int. Moves made by each game in the batch.
+    """
+
+    def __init__(self, boards, T=8):
+        self.T = T
+        self.board = BatchBoard(boards).track_repetitions()
+        self.past = np.zeros((len(boards), T, 2, 6), dtype=np.uint64)
+        self.depth = np.zeros(len(boards), dtype=np.int64)
+        self.plies = np.zeros(len(boards), dtype=np.int64)
+        self._moves = None
+        self._status = None
+        self._seed_history(boards)
+
+    @classmethod
+    def new_games(cls, n, T=8):
+        """ Builds a batch of n games from the initial position. """
+        return cls([chess.Board() for _ in range(n)], T)
+
+    def _seed_history(self, boards):
+        """ Fills the previous positions of the encoding and of the
+        repetitions from the move stacks of the boards.
+        """
+        rows, ages, previous = [], [], []
+        for row, board in enumerate(boards):
+            window = min(max(self.T, board.halfmove_clock), len(board.move_stack))
+            board = board.copy(stack=window)
+            for age in range(1, window + 1):
+                board.pop()
+                rows.append(row)
+                ages.append(age)
+                previous.append(board.copy(stack=False))
+        if not rows:
+            return
+        rows, ages, previous = np.array(rows), np.array(ages), BatchBoard(previous)
+
+        encoded = ages <= self.T
+        self.past[rows[encoded], ages[encoded] - 1] = previous.pieces[encoded]
+        self.depth = np.minimum(np.bincount(rows, minlength=len(self)), self.T)
+
+        # Positions since the last capture or pawn move
+        clock = self.board.halfmove_clock[rows] - ages
+        counted = clock >= 0
+        self.board.history[rows[counted], clock[counted]] = previous.hash(np.flatnonzero(counted))
+
+    def __len__(self):
+        return len(self.board)
+
+    def legal_moves(self):
+        """ Legal moves of every board (a `Moves`, grouped by board). """
+        if self._moves is None:
+            self._moves = self.board.legal_moves()
+        return self._moves
+
+    def legal_codes(self):
+        """ Codes of the legal moves (in the order of `legal_moves`). """
+        return _codes(self.legal_moves())
+
+    def legal_mask(self):
+        """ Returns an array (N, labels) with the legal moves of each board
+        over the policy labels (see `get_uci_labels`).
+        """
+        moves = self.legal_moves()
+        mask = np.zeros((len(self), len(LABEL_CODES)), dtype=bool)
+        mask[moves.row, CODE_LABELS[self.legal_codes()]] = True
+        return mask
+
+    def status(self):
+        """ Result of each game for the white pieces as `Game.get_result`
+        (1, 0 or -1), ONGOING if it is not over.
+        """
+        if self._status is None:
+            self._status = self.board.results(self.legal_moves())
+        return self._status[0]
+
+    def is_over(self):
+        """ Whether each game ended or is blocked with no legal moves. """
+        self.status()
+        results, stalemate = self._status
+        return (results != ONGOING) | stalemate
+
+    def sample(self, policies=None):
+        """ Picks a legal move of each game not over, at random.
+
+        Parameters:
+            policies: np.array (N, labels). Probabilities of the moves of each
+            board (e.g. the policy of the network), masked to the legal ones.
+            None to pick the moves uniformly (with rejection sampling, so
+            most legal moves are not generated).
+        Returns:
+            np.array (N,). Codes of the picked moves, NO_MOVE for the games
+            over.
+        """
+        sampled = np.full(len(self), NO_MOVE, dtype=np.int64)
+        if policies is None and self._moves is None:
+            # Rejection sampling: only the picked moves are checked (see `BatchBoard.random_moves`)
+            moves, results, stalemate = self.board.random_moves()
+            self._status = results, stalemate
+            sampled[moves.row] = _codes(moves)
+            return sampled
+
+        moves = self.legal_moves()
+        codes = _codes(moves)
+        if policies is None:
+            weights = np.ones(len(codes))
+        else:
+            weights = np.asarray(policies, dtype=float)[moves.row, CODE_LABELS[codes]]
+            # The boards whose legal moves have no probability pick them uniformly
+            totals = np.bincount(moves.row, weights=weights, minlength=len(self))
+            weights = np.where(totals[moves.row] > 0, weights, 1.)
+        counts = np.bincount(moves.row, minlength=len(self))
+        totals = np.bincount(moves.row, weights=weights, minlength=len(self))
+        first = np.cumsum(counts) - counts
+        # Inverse transform sampling over the cumulative weights of each board
+        targets = np.cumsum(totals) - totals + np.random.random(len(self)) * totals
+        picked = np.searchsorted(np.cumsum(weights), targets, side='right')
+        picked = np.clip(picked, first, first + counts - 1)
+
+        playing = ~self.is_over()
+        sampled[playing] = codes[picked[playing]]
+        return sampled
+
+    def push(self, codes):
+        """ Makes a legal move in each board.
+
+        Parameters:
+            codes: np.array (N,). Code of the move of each board, NO_MOVE for
+            the boards that don't move.
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        rows = np.flatnonzero(codes != NO_MOVE)
+        codes = codes[rows]
+        self.past[rows, 1:] = self.past[rows, :-1]
+        self.past[rows, 0] = self.board.pieces[rows]
+        self.depth[rows] = np.minimum(self.depth[rows] + 1, self.T)
+        self.plies[rows] += 1
+        self.board.push(rows, codes & 63, (codes >> 6) & 63, codes >> 12)
+        self._moves = None
+        self._status = None
+
+    def step(self, policies=None):
+        """ Plays a move (see `sample`) in each game not over and returns
+        the played codes.
+        """
+        codes = self.sample(policies)
+        self.push(codes)
+        return codes
+
+    def encode(self, dtype=float):
+        """ Returns the states of the games encoded as `get_game_state`: an
+        array (N, 8, 8, 14 (T + 1) + 1) with the pieces of the current and
+        the T previous positions and the turn.
+        """
+        n = len(self)
+        pieces = np.concatenate([self.board.pieces[:, None], self.past], axis=1)
+        known = np.arange(self.T + 1) <= self.depth[:, None]
+        # Bit s of each bitboard is the square s (rank 1 first), the rows of
+        # the planes start at the rank 8
+        bits = np.unpackbits(pieces.astype('<u8').view(np.uint8), bitorder='little')
+        bits = bits.reshape(n, self.T + 1, 2, 6, 8, 8)[..., ::-1, :]
+        planes = np.zeros((n, self.T + 1, 2, 7, 8, 8), dtype=dtype)
+        planes[:, :, :, 1:] = bits
+        planes[:, :, :, 0] = known[:, :, None, None, None] & ~bits.any(axis=3)
+        states = planes.reshape(n, 14 * (self.T + 1), 8, 8).transpose(0, 2, 3, 1)
+        turn = np.broadcast_to(self.board.turn[:, None, None, None], (n, 8, 8, 1)).astype(dtype)
+        return np.concatenate([states, turn], axis=-1)
+
+    def to_board(self, i):
+        """ Returns the python-chess board of the game i (without its moves). """
+        return self.board.to_board(i)
@@ -1,8 +1,26 @@
 from datetime import datetime
 
 import chess
-import chess.svg
-from IPython.display import SVG, display
+
+_UNKNOWN = object()  # Result not computed yet
+
+
+def _position_key(board: chess.Board):
+    """ Key of everything the legal moves and the result of a board depend
+    on (the position and the half-move clock).
+    """
+    return (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+            board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK], board.turn,
+            board.castling_rights, board.ep_square, board.halfmove_clock)
+
+
+def _repetition_key(board: chess.Board):
+    """ Key of a position for the repetition rules: the pieces, the turn, the
+    castling rights and the en passant square if it can be captured.
+    """
+    return (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+            board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK], board.turn,
+            board.clean_castling_rights(), board.ep_square if board.has_legal_en_passant() else None)
 
 
 class Game:
@@ -11,8 +29,17 @@ class Game:
     the logic to get the state of the game (`get_result()` or `get_legal_moves()`). **After each call to the `move()`
     method, the turn will be switched**. This is intended as a way to allow users to decouple the agent play logic
     from this class (though you can extend this class, being `AgentGame` or `StockfishGame` examples of this).
+
+    The legal moves and the result are computed once per position: they are cached until the board changes (by
+    `move` or by pushing or popping moves on `board` directly). The times each position was reached are counted as
+    the moves are made and undone (`push` and `pop`), so the repetitions are checked in O(1); changes made on `board`
+    directly are detected and counted again from the last irreversible move.
+
+    The light copies (`get_copy` with a `history`) keep only the last moves of the stack, so copying costs the same
+    however long the game is. `len` still counts the dropped moves.
     """
     NULL_MOVE = '00000'
+    HISTORY = 8  # Moves kept by the light copies: the T previous positions seen by the encoder
     WHITE = chess.WHITE
     BLACK = chess.BLACK
 
@@ -27,34 +54,128 @@ class Game:
         self.date = date
         if self.date is None:
             self.date = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+        self._cache_key = None
+        self._keys = None
+        self._offset = 0  # Moves dropped from the stack by a light copy
+
+    def __getstate__(self):
+        # The copies compute their cached moves, result and repetitions again
+        state = dict(self.__dict__)
+        for name in ('_legal_moves', '_legal_set', '_result', '_counts', '_synced_len', '_synced_top'):
+            state.pop(name, None)
+        state['_cache_key'] = None
+        state['_keys'] = None
+        return state
+
+    def _cache(self):
+        """ Resets the cached legal moves and result if the board changed. """
+        key = _position_key(self.board)
+        if key != self._cache_key:
+            self._cache_key = key
+            self._legal_moves = None
+            self._legal_set = None
+            self._result = _UNKNOWN
+
+    def _reset_repetitions(self, keys=None):
+        """ Counts the positions since the last capture or pawn move again
+        (the only ones which can be repeated), or the positions `keys` (the
+        last one is the current position).
+        """
+        if keys is None:
+            board = self.board.copy(stack=min(self.board.halfmove_clock, len(self.board.move_stack)))
+            keys = [_repetition_key(board)]
+            while board.move_stack:
+                board.pop()
+                keys.append(_repetition_key(board))
+            keys.reverse()
+        self._keys = keys
+        self._counts = {}
+        for key in keys:
+            self._counts[key] = self._counts.get(key, 0) + 1
+        self._mark()
+
+    def _mark(self):
+        """ Remembers the move stack the repetitions were counted for. """
+        stack = self.board.move_stack
+        self._synced_len = len(stack)
+        self._synced_top = stack[-1] if stack else None
 
-    def move(self, movement):
+    def _sync(self):
+        """ Counts the repetitions again if the board was changed directly. """
+        stack = self.board.move_stack
+        if self._keys is None or len(stack) != self._synced_len or \
+                (stack and stack[-1] is not self._synced_top):
+            self._reset_repetitions()
+
+    def push(self, move: chess.Move):
+        """ Pushes a legal python-chess move counting the new position. """
+        self._sync()
+        self.board.push(move)
+        key = _repetition_key(self.board)
+        self._keys.append(key)
+        self._counts[key] = self._counts.get(key, 0) + 1
+        self._mark()
+
+    def pop(self):
+        """ Undoes the last move and returns it (see `push`). """
+        self._sync()
+        move = self.board.pop()
+        key = self._keys.pop()
+        self._counts[key] -= 1
+        if not self._counts[key]:
+            del self._counts[key]
+        if self._keys:
+            self._mark()
+        else:
+            self._reset_repetitions()  # Back before the first counted position
+        return move
+
+    def is_repetition(self, count=3):
+        """ Whether the current position was reached at least `count` times
+        (3 for the threefold repetition, 5 for the fivefold one).
+        """
+        self._sync()
+        return self._counts[self._keys[-1]] >= count
+
+    def _moves(self):
+        """ Cached legal moves (UCI encoded) of the position. """
+        self._cache()
+        if self._legal_moves is None:
+            self._legal_moves = [m.uci() for m in self.board.legal_moves]
+        return self._legal_moves
+
+    def move(self, movement, trusted=False):
         """ Makes a move.
         Params:
             movement: str, Movement in UCI notation (f2f3, g8f6...)
+            trusted: bool, Whether the move is known to be legal (e.g. one of
+            `get_legal_moves`), so it's pushed without checking it.
         Returns:
             success: boolean. Whether the move could be executed
         """
 
         # This is to prevent python-chess to put illegal move in the stack before launching the exception
-        success = False
-        if movement in self.get_legal_moves():
-            self.board.push(chess.Move.from_uci(movement))
-            success = True
-        return success
+        if not trusted:
+            self._moves()
+            if self._legal_set is None:
+                self._legal_set = frozenset(self._legal_moves)
+            if movement not in self._legal_set:
+                return False
+        self.push(chess.Move.from_uci(movement))
+        return True
 
     def get_legal_moves(self, final_states=False):
         """ Gets a list of legal moves in the current turn.
         Parameters:
             final_states: bool. Whether copies of the board after executing
-            each legal movement are returned.
+            each legal movement are returned (light copies, see `get_copy`).
         """
-        moves = [m.uci() for m in self.board.legal_moves]
+        moves = list(self._moves())
         if final_states:
             states = []
             for m in moves:
-                gi = self.get_copy()
-                gi.move(m)
+                gi = self.get_copy(history=self.HISTORY)
+                gi.move(m, trusted=True)
                 states.append(gi)
             moves = (moves, states)
         return moves
@@ -72,17 +193,44 @@ class Game:
 
     def set_fen(self, fen):
         self.board.set_board_fen(fen)
+        self._keys = None
+        self._offset = 0
 
     @property
     def turn(self):
         """ Returns whether is white turn."""
         return self.board.turn
 
-    def get_copy(self):
-        return Game(board=self.board.copy())
+    def get_copy(self, history=None):
+        """ Returns a copy of the game.
+        Parameters:
+            history: int. Moves of the stack kept by the copy (e.g. `HISTORY`),
+            all of them if None. The repetitions are counted as in the game.
+        """
+        game = Game(board=self.board.copy(stack=True if history is None else history))
+        game._copy_history(self)
+        return game
+
+    def _copy_history(self, game):
+        """ Takes the dropped moves and the repetitions of the game this one
+        is a copy of.
+        """
+        self._offset = len(game) - len(self.board.move_stack)
+        game._sync()
+        self._reset_repetitions(game._keys[-(self.board.halfmove_clock + 1):])
+
+    def moves_since(self, ply):
+        """ Returns the moves (python-chess) played after the first `ply`
+        ones, None if some of them were dropped by a light copy.
+        """
+        if ply < self._offset:
+            return None
+        return self.board.move_stack[ply - self._offset:]
 
     def reset(self):
         self.board.reset()
+        self._keys = None
+        self._offset = 0
 
     def free(self):
         """ This method will be implemented by children. This will serve
@@ -94,21 +242,27 @@ class Game:
     def get_result(self):
         """ Returns the result of the game for the white pieces. None if the
         game is not over. This method checks if the game ends in a draw due
-        to the fifty-move rule. Threefold is not checked because it can
-        be too slow.
+        to the fifty-move rule or the threefold repetition. The result of the
+        position is cached until the board changes.
         """
-        result = None
-        if self.board.can_claim_fifty_moves() or self.board.is_insufficient_material():
-            result = 0  # Draw
-        elif self.board.is_checkmate():
-            if self.board.turn == chess.WHITE:
-                result = 1  # Whites win
-            else:
-                result = -1  # Whites don't win
-        return result
+        self._cache()
+        if self._result is _UNKNOWN:
+            result = None
+            if self.board.can_claim_fifty_moves() or self.board.is_insufficient_material():
+                result = 0  # Draw
+            elif self.board.is_check() and not self._moves():  # Checkmate
+                if self.board.turn == chess.WHITE:
+                    result = 1  # Whites win
+                else:
+                    result = -1  # Whites don't win
+            self._result = result
+        if self._result is None and self.is_repetition():
+            return 0  # Draw by threefold repetition
+        return self._result
 
     def __len__(self):
-        return len(self.board.move_stack)
+        """ Moves played, including the ones dropped by a light copy. """
+        return self._offset + len(self.board.move_stack)
 
     def plot_board(self, save_path=None):
         """ Plots the current state of the board. This is useful for debug/log
@@ -118,6 +272,10 @@ class Game:
             save_path: str, where to save the image. None if you want to plot
             on the screen only
         """
+        # Only the plots need them, they are slow to import
+        import chess.svg
+        from IPython.display import SVG, display
+
         # Generate SVG representation of the board
         svg = chess.svg.board(board=self.board)
 
@@ -22,6 +22,12 @@ class GameStore:
         """ Expands a game. For the N movements of a game, it creates
         N games with each state + the final result of the original game +
         the next movement (in each state).
+
+        The games of the states are light copies (see `Game.get_copy`): they
+        only keep the last moves (at least `Game.HISTORY`, the ones seen by
+        the encoder), so their `get_history()` is truncated (`len` counts all
+        the moves). The moves before the i-th state are the first i moves of
+        the original game.
         """
         hist = game.get_history()
         moves = hist['moves']
@@ -37,8 +43,8 @@ class GameStore:
             augmented.append({'game': g,
                               'next_move': m,
                               'result': result})
-            g = g.get_copy()
-            g.move(m)
+            g = g.get_copy(history=Game.HISTORY)
+            g.move(m, trusted=True)  # Moves of a played game
 
         return augmented
 
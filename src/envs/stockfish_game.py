@@ -30,30 +30,33 @@ class StockfishGame(Game):
         elif type(stockfish) == StockfishAgent:
             self.stockfish = stockfish
 
-    def move(self, movement):
+    def move(self, movement, trusted=False):
         """ Makes a move. If it's not your turn, Stockfish will play and if
             the move is illegal, it will be ignored.
 
         Params:
             movement: str, Movement in UCI notation (f2f3, g8f6...)
+            trusted: bool, Whether the move is known to be legal.
         """
         # If stockfish moves first
         success = False
-        if self.stockfish.color and len(self.board.move_stack) == 0:
+        if self.stockfish.color and len(self) == 0:
             stockfish_best_move = self.stockfish.best_move(self)
-            self.board.push(chess.Move.from_uci(stockfish_best_move))
+            self.push(chess.Move.from_uci(stockfish_best_move))
             success = True
         else:
-            made_movement = super().move(movement)
+            made_movement = super().move(movement, trusted)
             if made_movement and self.get_result() is None:
                 stockfish_best_move = self.stockfish.best_move(self)
-                self.board.push(chess.Move.from_uci(stockfish_best_move))
+                self.push(chess.Move.from_uci(stockfish_best_move))
                 success = True
 
         return success
 
-    def get_copy(self):
-        return StockfishGame(board=self.board.copy(), stockfish=self.stockfish)
+    def get_copy(self, history=None):
+        game = StockfishGame(board=self.board.copy(stack=True if history is None else history), stockfish=self.stockfish)
+        game._copy_history(self)
+        return game
 
     def tearup(self):
         """ Free resources. This cannot be done in __del__ as the instances
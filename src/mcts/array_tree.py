@@ -0,0 +1,425 @@
+import numpy as np
+from threading import Lock
+
+from src.envs.game import Game
+from src.mcts.node import puct_values, ucb1_values
+from src.mcts.transposition import position_key
+from src.utils.encoder_decoder import encode_move, decode_move
+
+NO_NODE = -1
+NO_MOVE = -1
+ONGOING = 2  # Cached result of a node whose game is not over
+
+
+class NodeArrays:
+    """ Struct-of-arrays storage of a Monte Carlo Tree. Instead of one Python
+    object per node (each one with its own Game copy, lists and lock), every
+    node is an index into preallocated NumPy arrays which are grown (doubled)
+    when the capacity is exceeded. The children of a node live in a
+    contiguous range [first_child, first_child + n_children) which is
+    reserved the first time the node is expanded.
+
+    Nodes don't hold a game: the state of a node is rebuilt by pushing the
+    moves (our move and the opponent reply) from the root to the node.
+
+    Attributes:
+        root_state: Game. State of the root node.
+        size: int. Number of allocated nodes.
+        capacity: int. Number of nodes that fit in the arrays.
+    """
+
+    # name, dtype, value of an empty slot
+    FIELDS = (('parent', np.int32, NO_NODE),
+              ('move', np.int16, NO_MOVE),
+              ('reply', np.int16, NO_MOVE),
+              ('first_child', np.int32, NO_NODE),
+              ('n_children', np.int16, 0),
+              ('n_popped', np.int16, 0),
+              ('n_expanded', np.int16, 0),
+              ('visits', np.int32, 0),
+              ('children_visits', np.int32, 0),
+              ('n_priors', np.int16, 0),
+              ('value', np.float64, 0),
+              ('prior', np.float32, 1),
+              ('vloss', np.int32, 0),
+              ('result', np.int8, ONGOING),
+              ('key', np.uint64, 0))
+
+    def __init__(self, root_state: Game, capacity=4096, lock_stripes=64):
+        self.root_state = root_state
+        self.size = 0
+        self.capacity = 0
+        for name, dtype, fill in self.FIELDS:
+            setattr(self, name, np.empty(0, dtype=dtype))
+        self._grow(capacity)
+
+        # Nodes share a fixed pool of locks instead of having one each
+        self.locks = [Lock() for _ in range(lock_stripes)]
+        self.alloc_lock = Lock()
+
+        root = self.allocate(1)
+        self._set_position(root, root_state)
+
+    @classmethod
+    def bytes_per_node(cls):
+        """ Returns the memory used by a node in the arrays. """
+        return sum(np.dtype(dtype).itemsize for _, dtype, _ in cls.FIELDS)
+
+    @property
+    def nbytes(self):
+        """ Memory (bytes) reserved by the arrays. """
+        return self.capacity * self.bytes_per_node()
+
+    @property
+    def root(self):
+        return ArrayNode(self, 0)
+
+    def _grow(self, capacity):
+        for name, dtype, fill in self.FIELDS:
+            new = np.full(capacity, fill, dtype=dtype)
+            new[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, new)
+        self.capacity = capacity
+
+    def allocate(self, n):
+        """ Reserves n contiguous nodes and returns the index of the first one. """
+        with self.alloc_lock:
+            if self.size + n > self.capacity:
+                # No node can be updated while the arrays are being replaced
+                for lock in self.locks:
+                    lock.acquire()
+                try:
+                    self._grow(max(2 * self.capacity, self.size + n))
+                finally:
+                    for lock in self.locks:
+                        lock.release()
+            start = self.size
+            self.size += n
+        return start
+
+    def lock(self, index):
+        return self.locks[index % len(self.locks)]
+
+    def path(self, index):
+        """ Returns the move codes to apply from the root to reach a node. """
+        codes = []
+        while self.parent[index] != NO_NODE:
+            if self.reply[index] != NO_MOVE:
+                codes.append(self.reply[index])
+            codes.append(self.move[index])
+            index = self.parent[index]
+        return codes[::-1]
+
+    def state(self, index):
+        """ Rebuilds the game of a node from the root state. """
+        state = self.root_state.get_copy(history=Game.HISTORY)
+        for code in self.path(index):
+            state.push(decode_move(code))
+        return state
+
+    def expand_children(self, index, state=None):
+        """ Reserves the children range of a node with its legal moves. The
+        moves are stored in the reverse order of `Game.get_legal_moves` as
+        they are expanded by popping from the end of the list.
+        """
+        if self.first_child[index] != NO_NODE:
+            return
+        if state is None:
+            state = self.state(index)
+        moves = [encode_move(m) for m in state.board.legal_moves][::-1]
+        # Allocating can take every lock to grow the arrays, so it can't be
+        # done holding the lock of the node.
+        start = self.allocate(len(moves))
+        with self.lock(index):
+            if self.first_child[index] != NO_NODE:
+                return  # Another thread reserved the range first
+            self.parent[start:start + len(moves)] = index
+            self.move[start:start + len(moves)] = moves
+            self.n_children[index] = len(moves)
+            self.first_child[index] = start
+
+    def extract(self, index, capacity=None):
+        """ Copies the subtree of a node to new arrays where it is the root.
+        The rest of the nodes are not copied, so their memory is freed with
+        this store.
+
+        Parameters:
+            index: int. Node which will be the root of the new arrays.
+            capacity: int. Initial capacity of the new arrays, by default half
+            of the current one.
+        Returns:
+            NodeArrays. Arrays of the subtree.
+        """
+        if capacity is None:
+            capacity = max(self.capacity // 2, 1)
+        store = NodeArrays(self.state(index), capacity=capacity)
+        copied = [name for name, _, _ in self.FIELDS if name not in ('parent', 'move', 'reply', 'first_child')]
+        for name in copied:
+            getattr(store, name)[0] = getattr(self, name)[index]
+
+        # Children ranges are copied as contiguous blocks
+        pending = [(index, 0)]
+        while pending:
+            old, new = pending.pop()
+            first, n = self.first_child[old], self.n_children[old]
+            if first == NO_NODE:
+                continue
+            start = store.allocate(n)
+            for name in copied + ['move', 'reply']:
+                getattr(store, name)[start:start + n] = getattr(self, name)[first:first + n]
+            store.parent[start:start + n] = new
+            store.first_child[new] = start
+            pending.extend((first + k, start + k) for k in range(n)
+                           if self.first_child[first + k] != NO_NODE)
+        return store
+
+    def get_values(self, start, end):
+        """ Returns the PUCT values (Q + U - virtual loss, see `Node.get_value`)
+        of the nodes in [start, end).
+        """
+        return puct_values(self.value[start:end], self.visits[start:end], self.prior[start:end],
+                           self.children_visits[start:end], self.vloss[start:end])
+
+    def get_ucb1_values(self, start, end, parent_visits):
+        """ Returns the UCB1 values (see `Node.get_ucb1`) of the nodes in
+        [start, end), children of a node with the given visits.
+        """
+        return ucb1_values(self.value[start:end], self.visits[start:end], parent_visits)
+
+    def _set_position(self, index, state):
+        """ Caches the result and the key of the position of a node. """
+        result = state.get_result()
+        self.result[index] = ONGOING if result is None else result
+        self.key[index] = position_key(state.board)
+
+
+class ArrayNode:
+    """ View of a node stored in a `NodeArrays`. It offers the same interface
+    as `Node`, so the tree algorithms work with both backends. Views are
+    created on demand and are not stored anywhere.
+
+    Attributes:
+        store: NodeArrays. Arrays holding the tree.
+        index: int. Position of the node in the arrays.
+    """
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store: NodeArrays, index: int):
+        self.store = store
+        self.index = index
+
+    def __eq__(self, other):
+        return isinstance(other, ArrayNode) and \
+            self.store is other.store and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.store), self.index))
+
+    @property
+    def visits(self):
+        return int(self.store.visits[self.index])
+
+    @visits.setter
+    def visits(self, visits):
+        self.store.visits[self.index] = visits
+
+    @property
+    def children_visits(self):
+        return int(self.store.children_visits[self.index])
+
+    @children_visits.setter
+    def children_visits(self, visits):
+        self.store.children_visits[self.index] = visits
+
+    @property
+    def n_priors(self):
+        return int(self.store.n_priors[self.index])
+
+    @n_priors.setter
+    def n_priors(self, n):
+        self.store.n_priors[self.index] = n
+
+    @property
+    def value(self):
+        return float(self.store.value[self.index])
+
+    @value.setter
+    def value(self, value):
+        self.store.value[self.index] = value
+
+    @property
+    def prior(self):
+        return float(self.store.prior[self.index])
+
+    @prior.setter
+    def prior(self, prior):
+        self.store.prior[self.index] = prior
+
+    @property
+    def vloss(self):
+        return int(self.store.vloss[self.index])
+
+    @vloss.setter
+    def vloss(self, vloss):
+        self.store.vloss[self.index] = vloss
+
+    @property
+    def key(self):
+        """ Zobrist key of the position of the node. """
+        return int(self.store.key[self.index])
+
+    @property
+    def state(self):
+        return self.store.state(self.index)
+
+    @property
+    def lock(self):
+        return self.store.lock(self.index)
+
+    @property
+    def parent(self):
+        parent = self.store.parent[self.index]
+        return None if parent == NO_NODE else ArrayNode(self.store, int(parent))
+
+    @property
+    def children(self):
+        first = self.store.first_child[self.index]
+        return [ArrayNode(self.store, int(i))
+                for i in range(first, first + self.store.n_expanded[self.index])]
+
+    def generate_actions(self, state=None):
+        """ Reserves the children of the node from its game (see
+        `NodeArrays.expand_children`).
+        """
+        self.store.expand_children(self.index, state)
+
+    def push_moves(self, state: Game):
+        """ Pushes the moves from the parent to this node onto the game of the
+        parent and returns how many they were.
+        """
+        codes = [c for c in (self.store.move[self.index], self.store.reply[self.index]) if c != NO_MOVE]
+        for code in codes:
+            state.push(decode_move(code))
+        return len(codes)
+
+    @property
+    def unexpanded_actions(self):
+        self.store.expand_children(self.index)
+        first = self.store.first_child[self.index]
+        codes = self.store.move[first + self.store.n_popped[self.index]:
+                                first + self.store.n_children[self.index]]
+        return [decode_move(c).uci() for c in codes[::-1]]
+
+    @property
+    def is_leaf(self):
+        return self.store.n_expanded[self.index] == 0
+
+    @property
+    def is_fully_expanded(self):
+        self.store.expand_children(self.index)
+        return self.store.n_popped[self.index] == self.store.n_children[self.index]
+
+    @property
+    def is_terminal_state(self):
+        return self.store.result[self.index] != ONGOING
+
+    @property
+    def is_root(self):
+        return self.store.parent[self.index] == NO_NODE
+
+    @property
+    def moves(self):
+        """ UCI moves from the parent to this node (see `Node.moves`). """
+        codes = self.store.move[self.index], self.store.reply[self.index]
+        return [decode_move(c).uci() for c in codes if c != NO_MOVE]
+
+    def pop_unexpanded_action(self):
+        self.store.expand_children(self.index)
+        with self.lock:
+            slot = self.store.first_child[self.index] + self.store.n_popped[self.index]
+            if self.store.n_popped[self.index] == self.store.n_children[self.index]:
+                raise IndexError('pop from fully expanded node')
+            self.store.n_popped[self.index] += 1
+            # Read under the lock: `add_child` of other threads swaps the popped moves
+            code = self.store.move[slot]
+        return decode_move(code).uci()
+
+    def order_actions(self, scores):
+        """ Sorts the unexpanded actions (see `Node.order_actions`), popped
+        from the start of the children range.
+        """
+        store = self.store
+        store.expand_children(self.index)
+        with self.lock:
+            first = store.first_child[self.index]
+            start, end = first + store.n_popped[self.index], first + store.n_children[self.index]
+            codes = store.move[start:end]
+            keys = [-scores.get(decode_move(c).uci(), 0.) for c in codes]
+            store.move[start:end] = codes[np.argsort(keys, kind='stable')]
+
+    def add_child(self, state: Game):
+        """ Makes visible the child reached by the state (our move followed
+        by the opponent reply, if any). Its action must have been popped.
+        """
+        store = self.store
+        ply = len(store.path(self.index))
+        pushed = state.moves_since(len(store.root_state) + ply)
+        move = encode_move(pushed[0])
+        with self.lock:
+            first = store.first_child[self.index]
+            expanded = first + store.n_expanded[self.index]
+            popped = first + store.n_popped[self.index]
+            # Threads can make visible the popped actions in any order
+            slot = expanded + int(np.flatnonzero(store.move[expanded:popped] == move)[0])
+            if slot != expanded:
+                store.move[[slot, expanded]] = store.move[[expanded, slot]]
+            if len(pushed) > 1:
+                store.reply[expanded] = encode_move(pushed[1])
+            store._set_position(expanded, state)
+            store.n_expanded[self.index] += 1
+        return ArrayNode(store, int(expanded))
+
+    def collapse(self):
+        """ Detaches the children range of the node, keeping its statistics
+        (see `Node.collapse`). The range is freed by the next `extract`.
+        """
+        store = self.store
+        with self.lock:
+            store.first_child[self.index] = NO_NODE
+            store.n_children[self.index] = 0
+            store.n_popped[self.index] = 0
+            store.n_expanded[self.index] = 0
+            store.n_priors[self.index] = 0
+
+    @property
+    def n_reserved(self):
+        """ Slots of the arrays taken by the children range of the node. """
+        if self.store.first_child[self.index] == NO_NODE:
+            return 0
+        return int(self.store.n_children[self.index])
+
+    def get_ucb1(self):
+        """ returns the UCB1 metric of the node. """
+        return float(ucb1_values(self.value, self.visits, self.parent.visits))
+
+    def get_value(self):
+        """ Returns the Q + U for the node (see `Node.get_value`). """
+        if self.is_root:
+            return 99999999999 - self.vloss
+        return self.store.get_values(self.index, self.index + 1)[0]
+
+    def get_best_child(self, ucb1=False):
+        """Get the best child of this node.
+
+        Parameters:
+            ucb1: bool. Whether to use the UCB1 metric instead of PUCT.
+        Returns:
+            best: ArrayNode. Child with the max. PUCT (or UCB1) value.
+        """
+        first = int(self.store.first_child[self.index])
+        end = first + self.store.n_expanded[self.index]
+        if ucb1:
+            values = self.store.get_ucb1_values(first, end, self.visits)
+        else:
+            values = self.store.get_values(first, end)
+        return ArrayNode(self.store, first + int(np.argmax(values)))
@@ -0,0 +1,195 @@
+from threading import Lock
+from timeit import default_timer as timer
+
+
+class SearchBudget:
+    """ Limits of an anytime search: iterations, wall-clock time, nodes
+    added to the tree and random playouts. The search asks for permission
+    before every iteration (`next_iteration`) and stops with the first
+    exhausted limit, returning the best move found so far. The time limit
+    always allows the first iteration, so the search has a move to return.
+
+    An iteration is not started if it wouldn't end in time taking as long as
+    the mean of the ended ones, to stay within the latency target instead of
+    overshooting it by one iteration.
+
+    With `early_stop` the search also stops when the most visited root child
+    can't be overtaken by the second one in the remaining budget (all the
+    remaining iterations going to the second one).
+
+    Parameters:
+        max_iters: int. Max. number of iterations, None for no limit.
+        max_time: float. Max. seconds of search, None for no limit.
+        max_nodes: int. Max. number of nodes added to the tree, None for no
+        limit.
+        early_stop: bool. Whether to stop when the best move is decided.
+        max_playouts: int. Max. number of random playouts of the simulations,
+        None for no limit.
+
+    Attributes:
+        iterations: int. Iterations started.
+        running: int. Iterations started and not ended yet.
+        completed: int. Iterations ended.
+        iteration_time: float. Seconds spent by the ended iterations.
+        nodes: int. Nodes added to the tree.
+        playouts: int. Random playouts run by the simulations.
+        elapsed: float. Seconds since the start of the search.
+        stop_reason: str. Exhausted limit ('iterations', 'time', 'nodes' or
+        'playouts'), 'early' (decided move) or 'stopped' (see `stop`), None
+        while searching.
+    """
+
+    def __init__(self, max_iters=None, max_time=None, max_nodes=None, early_stop=False, max_playouts=None):
+        if max_iters is None and max_time is None and max_nodes is None and max_playouts is None:
+            raise ValueError('The search needs a limit of iterations, time, nodes or playouts')
+        self.max_iters = max_iters
+        self.max_time = max_time
+        self.max_nodes = max_nodes
+        self.early_stop = early_stop
+        self.max_playouts = max_playouts
+        self.lock = Lock()
+        self.start()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']  # Budgets are sent to the processes of the root parallel search
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+
+    def split(self, n):
+        """ Splits the iterations, nodes and playouts limits into n budgets
+        with the same time limit, for searches running in parallel.
+        """
+        def part(limit, i):
+            return None if limit is None else limit // n + (i < limit % n)
+        return [SearchBudget(part(self.max_iters, i), self.max_time, part(self.max_nodes, i), self.early_stop,
+                             part(self.max_playouts, i))
+                for i in range(n)]
+
+    def merge(self, reports):
+        """ Adds up the iterations, nodes and playouts of the reports of the
+        budgets split from this one (see `split`).
+        """
+        self.iterations = sum(r['iterations'] for r in reports)
+        self.nodes = sum(r['nodes'] for r in reports)
+        self.playouts = sum(r['playouts'] for r in reports)
+        reasons = [r['stop_reason'] for r in reports]
+        self.stop_reason = max(set(reasons), key=reasons.count)
+
+    def start(self):
+        """ Restarts the clock and the counters. """
+        self.iterations = 0
+        self.running = 0
+        self.completed = 0
+        self.iteration_time = 0.
+        self.nodes = 0
+        self.playouts = 0
+        self.elapsed = 0.
+        self.stop_reason = None
+        self._start = timer()
+
+    def finish(self):
+        """ Stops the clock once the running iterations ended. """
+        self.elapsed = timer() - self._start
+
+    def stop(self):
+        """ Stops the search from another thread: no more iterations are
+        started (the running ones end).
+        """
+        with self.lock:
+            if self.stop_reason is None:
+                self.stop_reason = 'stopped'
+
+    def add_node(self):
+        with self.lock:
+            self.nodes += 1
+
+    def add_playouts(self, n):
+        with self.lock:
+            self.playouts += n
+
+    def remaining_playouts(self):
+        """ Playouts left, None if they are not limited. """
+        if self.max_playouts is None:
+            return None
+        return max(self.max_playouts - self.playouts, 0)
+
+    def end_iteration(self, duration):
+        """ Counts the end of an iteration which took `duration` seconds. """
+        with self.lock:
+            self.running -= 1
+            self.completed += 1
+            self.iteration_time += duration
+
+    def remaining_iterations(self):
+        """ Upper bound of the iterations left, estimating the ones that fit
+        in the time left with the mean time of the previous ones. Each
+        iteration adds at most one node.
+        """
+        remaining = []
+        if self.max_iters is not None:
+            remaining.append(self.max_iters - self.iterations)
+        if self.max_nodes is not None:
+            remaining.append(self.max_nodes - self.nodes)
+        if self.max_time is not None and self.iterations > 0:
+            remaining.append(int((self.max_time - self.elapsed) * self.iterations / max(self.elapsed, 1e-9)))
+        return max(min(remaining), 0) if remaining else float('inf')
+
+    def next_iteration(self, root=None):
+        """ Returns whether another iteration can be run, counting it if so.
+
+        Parameters:
+            root: Node. Root of the search, checked by the early stop.
+        """
+        with self.lock:
+            if self.stop_reason is not None:
+                return False
+            self.elapsed = timer() - self._start
+            self.stop_reason = self._exhausted_limit()
+            if self.stop_reason is None and self.early_stop and root is not None and self._decided(root):
+                self.stop_reason = 'early'
+            if self.stop_reason is not None:
+                return False
+            self.iterations += 1
+            self.running += 1
+            return True
+
+    def _exhausted_limit(self):
+        if self.max_iters is not None and self.iterations >= self.max_iters:
+            return 'iterations'
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            return 'nodes'
+        if self.max_playouts is not None and self.playouts >= self.max_playouts:
+            return 'playouts'
+        if self.max_time is not None and self.iterations > 0:
+            # The next iteration (of mean duration) must end in time
+            mean_time = self.iteration_time / max(self.completed, 1)
+            if self.elapsed + mean_time > self.max_time:
+                return 'time'
+        return None
+
+    def _decided(self, root):
+        if self.iterations == 0:
+            return False
+        visits = sorted((c.visits for c in root.children), reverse=True) + [0, 0]
+        # The running iterations could also end in the second child
+        return visits[0] - visits[1] > self.remaining_iterations() + self.running
+
+    def report(self):
+        """ Returns a dict with the budget used by the search, the fractions
+        are None for the limits not given.
+        """
+        return {
+            'iterations': self.iterations,
+            'nodes': self.nodes,
+            'playouts': self.playouts,
+            'elapsed': self.elapsed,
+            'stop_reason': self.stop_reason,
+            'iters_used': None if self.max_iters is None else self.iterations / max(self.max_iters, 1),
+            'time_used': None if self.max_time is None else self.elapsed / self.max_time,
+            'nodes_used': None if self.max_nodes is None else self.nodes / max(self.max_nodes, 1),
+            'playouts_used': None if self.max_playouts is None else self.playouts / max(self.max_playouts, 1),
+        }
@@ -0,0 +1,434 @@
+import os
+import argparse
+import numpy as np
+import chess
+
+from src.envs.batch_board import BatchBoard, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+from src.utils.bitboards import BIT, popcount, scan
+
+# Pieces of a side in the order of the signatures (e.g. 'KQvKR')
+PIECE_SYMBOLS = 'KQRBNP'
+_PIECE_INDEX = {'K': KING, 'Q': QUEEN, 'R': ROOK, 'B': BISHOP, 'N': KNIGHT, 'P': PAWN}
+_VALUES = {'K': 0, 'Q': 9, 'R': 5, 'B': 3, 'N': 3, 'P': 1}
+
+# Endgames built by default: every one of them only depends on the others
+DEFAULT_ENDGAMES = ('KQvK', 'KRvK', 'KPvK', 'KQvKR')
+
+_UNKNOWN = np.iinfo(np.int32).max
+
+
+def _symmetries():
+    """ Square maps of the 8 symmetries of the board. The identity and the
+    file mirror go first, the only ones kept with pawns.
+    """
+    maps = []
+    for swap in (False, True):
+        for flip_rank in (False, True):
+            for flip_file in (False, True):
+                files, ranks = np.arange(64) % 8, np.arange(64) // 8
+                if swap:
+                    files, ranks = ranks, files
+                if flip_file:
+                    files = 7 - files
+                if flip_rank:
+                    ranks = 7 - ranks
+                maps.append(ranks * 8 + files)
+    return np.array(maps, dtype=np.int64)
+
+
+SYMMETRIES = _symmetries()
+
+
+def _side_key(side):
+    return sorted((_VALUES[p] for p in side), reverse=True), side
+
+
+def normalize(signature):
+    """ Returns the signature of the table of an endgame (the stronger side
+    as white, the pieces of each side in the order of PIECE_SYMBOLS) and
+    whether its colors are swapped.
+    """
+    white, black = (''.join(sorted(side.upper(), key=PIECE_SYMBOLS.index)) for side in signature.split('v'))
+    if _side_key(black) > _side_key(white):
+        return f'{black}v{white}', True
+    return f'{white}v{black}', False
+
+
+def _counts_signature(counts):
+    """ Signature of the pieces counted by color (black = 0, white = 1) and
+    piece index.
+    """
+    return 'v'.join(''.join(s * int(counts[color, _PIECE_INDEX[s]]) for s in PIECE_SYMBOLS)
+                    for color in (1, 0))
+
+
+def board_signature(board: chess.Board):
+    """ Signature of the pieces of a board, white first (e.g. 'KQvKR'). """
+    return 'v'.join(''.join(s * len(board.pieces(chess.Piece.from_symbol(s).piece_type, color))
+                            for s in PIECE_SYMBOLS)
+                    for color in (chess.WHITE, chess.BLACK))
+
+
+def _always_drawn(signature):
+    """ Whether no position of the endgame can be won (a lone minor piece). """
+    pieces = signature.replace('K', '').replace('v', '')
+    return len(pieces) <= 1 and pieces in ('', 'B', 'N')
+
+
+def dependencies(signature):
+    """ Endgames reached from one by a capture, a promotion or both. """
+    white, black = normalize(signature)[0].split('v')
+    found = set()
+    for us, them, swap in ((white, black, False), (black, white, True)):
+        captures = [them] + [them.replace(p, '', 1) for p in set(them) - {'K'}]
+        promotions = [us] + [us.replace('P', p, 1) for p in 'QRBN' if 'P' in us]
+        for ours in promotions:
+            for theirs in captures:
+                if (ours, theirs) != (us, them):
+                    found.add(normalize(f'{theirs}v{ours}' if swap else f'{ours}v{theirs}')[0])
+    return sorted(s for s in found if not _always_drawn(s))
+
+
+class EndgameTable:
+    """ Win/draw/loss and distance to mate of every position of an endgame
+    (see `build_table`), with the side to move and no castling rights.
+
+    A position is indexed by the side to move and the squares of its pieces
+    (in the order of the signature) reduced by the symmetries of the board
+    (the 8 of them without pawns, the file mirror with pawns). The table
+    stores the sorted keys of the legal positions and a score per key: 0 for
+    a draw, else +-(plies to mate + 1) for the side to move, so the search of
+    a key only touches a few pages of the memory-mapped files.
+
+    Parameters:
+        signature: str. Pieces of the endgame (see `normalize`).
+        keys: np.array. Sorted keys of the positions, None while building.
+        scores: np.array. Score of each key.
+    """
+
+    def __init__(self, signature, keys=None, scores=None):
+        self.signature = signature
+        white, black = signature.split('v')
+        self.pieces = [(1, _PIECE_INDEX[p]) for p in white] + [(0, _PIECE_INDEX[p]) for p in black]
+        # Columns of each kind of piece, the ones of a kind hold sorted squares
+        self.columns = {}
+        for column, piece in enumerate(self.pieces):
+            self.columns.setdefault(piece, []).append(column)
+        self.has_pawns = 'P' in signature
+        self.symmetries = SYMMETRIES[:2] if self.has_pawns else SYMMETRIES
+        self.keys = keys
+        self.scores = scores
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def n_keys(self):
+        """ Keys of every placement of the pieces (valid or not). """
+        return 2 * 64 ** len(self.pieces)
+
+    def encode(self, squares, turn):
+        keys = turn.astype(np.int64)
+        for column in range(squares.shape[1]):
+            keys = keys * 64 + squares[:, column]
+        return keys
+
+    def decode(self, keys):
+        """ Returns the squares of the pieces and the turn of the keys. """
+        n = len(self.pieces)
+        squares = np.stack([keys // 64 ** (n - 1 - c) % 64 for c in range(n)], axis=1)
+        return squares, (keys // 64 ** n).astype(bool)
+
+    def canonical(self, squares, turn):
+        """ Keys of the positions: the lowest one of their symmetries. """
+        best = None
+        for symmetry in self.symmetries:
+            mapped = symmetry[squares]
+            for columns in self.columns.values():
+                if len(columns) > 1:
+                    mapped[:, columns] = np.sort(mapped[:, columns], axis=1)
+            keys = self.encode(mapped, turn)
+            best = keys if best is None else np.minimum(best, keys)
+        return best
+
+    def boards(self, squares, turn):
+        """ Builds a `BatchBoard` with the positions. """
+        boards = BatchBoard([])
+        boards.pieces = np.zeros((len(turn), 2, 6), dtype=np.uint64)
+        for column, (color, piece) in enumerate(self.pieces):
+            boards.pieces[:, color, piece] |= BIT[squares[:, column]]
+        boards.turn = turn.astype(bool)
+        boards.castling = np.zeros(len(turn), dtype=np.uint64)
+        boards.ep_square = np.full(len(turn), -1, dtype=np.int64)
+        boards.halfmove_clock = np.zeros(len(turn), dtype=np.int64)
+        boards.fullmove_number = np.ones(len(turn), dtype=np.int64)
+        return boards
+
+    def squares(self, boards: BatchBoard, rows, mirrored=False):
+        """ Returns the squares of the pieces and the turn of some boards of
+        the endgame (of the endgame with the colors swapped if `mirrored`).
+        """
+        squares = np.zeros((len(rows), len(self.pieces)), dtype=np.int64)
+        for (color, piece), columns in self.columns.items():
+            _, found = scan(boards.pieces[rows, color ^ mirrored, piece])
+            squares[:, columns] = found.reshape(len(rows), len(columns)) ^ (56 if mirrored else 0)
+        return squares, boards.turn[rows] ^ mirrored
+
+    def probe(self, boards: BatchBoard, rows, mirrored=False):
+        """ Returns the result for the side to move (1, 0 or -1) and the
+        plies to mate (0 for draws) of some boards of the endgame.
+        """
+        keys = self.canonical(*self.squares(boards, rows, mirrored))
+        scores = np.asarray(self.scores[np.searchsorted(self.keys, keys)], dtype=np.int64)
+        return np.sign(scores), np.maximum(np.abs(scores) - 1, 0)
+
+
+class EndgameTables:
+    """ Endgame tables of a directory, memory-mapped so the processes using
+    them share their pages and only the probed ones are read. They score the
+    positions of their endgames exactly, with no search (see `SelfPlayTree`).
+    The fifty-move rule and the repetitions are not taken into account.
+
+    Parameters:
+        directory: str. Directory of the tables (see `build_table`).
+        signatures: list. Endgames to load, all of the directory by default.
+
+    Attributes:
+        tables: dict. Table of each endgame (see `EndgameTable`).
+        max_pieces: int. Pieces of the largest endgame.
+    """
+
+    def __init__(self, directory, signatures=None):
+        self.directory = directory
+        if signatures is None:
+            signatures = sorted({f.split('.')[0] for f in os.listdir(directory) if f.endswith('.scores.npy')}) \
+                if os.path.isdir(directory) else []
+        self.tables = {}
+        self.max_pieces = 0
+        for signature in signatures:
+            self.load(signature)
+
+    def __getstate__(self):
+        # The memory-mapped tables are opened again by the copies
+        return {'directory': self.directory, 'signatures': list(self.tables)}
+
+    def __setstate__(self, state):
+        self.__init__(state['directory'], state['signatures'])
+
+    def __contains__(self, signature):
+        return normalize(signature)[0] in self.tables
+
+    def _path(self, signature, name):
+        return os.path.join(self.directory, f'{signature}.{name}.npy')
+
+    def load(self, signature):
+        """ Opens the table of an endgame. """
+        signature = normalize(signature)[0]
+        keys = np.load(self._path(signature, 'keys'), mmap_mode='r')
+        scores = np.load(self._path(signature, 'scores'), mmap_mode='r')
+        self.tables[signature] = EndgameTable(signature, keys, scores)
+        self.max_pieces = max(self.max_pieces, len(signature) - 1)
+        return self.tables[signature]
+
+    def save(self, table: EndgameTable):
+        os.makedirs(self.directory, exist_ok=True)
+        np.save(self._path(table.signature, 'keys'), table.keys)
+        np.save(self._path(table.signature, 'scores'), table.scores)
+        return self.load(table.signature)
+
+    def covers(self, board: chess.Board):
+        """ Whether the position of a board is scored by the tables (en
+        passant captures and castling are not in the tables).
+        """
+        if chess.popcount(board.occupied) > self.max_pieces or board.castling_rights or board.has_legal_en_passant():
+            return False
+        return normalize(board_signature(board))[0] in self.tables or board.is_insufficient_material()
+
+    def probe(self, board: chess.Board):
+        """ Returns the result for the side to move (1, 0 or -1) and the plies
+        to mate of a position, None if the tables don't cover it.
+        """
+        if not self.covers(board):
+            return None
+        wdl, dtm, _ = self.probe_boards(BatchBoard([board]), np.zeros(1, dtype=np.intp))
+        return int(wdl[0]), int(dtm[0])
+
+    def value(self, board: chess.Board):
+        """ Result of a position with the sign of `Game.get_result` (1 when
+        the black pieces win), None if not covered.
+        """
+        probed = self.probe(board)
+        if probed is None:
+            return None
+        return -probed[0] if board.turn == chess.WHITE else probed[0]
+
+    def probe_boards(self, boards: BatchBoard, rows):
+        """ Probes some boards with a few pieces, grouped by endgame.
+
+        Returns:
+            wdl: np.array. Result for the side to move (1, 0 or -1).
+            dtm: np.array. Plies to mate, 0 for the draws.
+            found: np.array. Whether a table (or the lack of material)
+            scores the board.
+        """
+        wdl = np.zeros(len(rows), dtype=np.int64)
+        dtm = np.zeros(len(rows), dtype=np.int64)
+        found = boards.is_insufficient_material(rows)
+        counts = popcount(boards.pieces[rows]).reshape(len(rows), 12)
+        groups, inverse = np.unique(counts, axis=0, return_inverse=True)
+        for group, group_counts in enumerate(groups):
+            selected = np.flatnonzero((inverse.reshape(-1) == group) & ~found)
+            signature, mirrored = normalize(_counts_signature(group_counts.reshape(2, 6)))
+            if len(selected) == 0 or signature not in self.tables:
+                continue
+            wdl[selected], dtm[selected] = self.tables[signature].probe(boards, rows[selected], mirrored)
+            found[selected] = True
+        return wdl, dtm, found
+
+
+def _positions(table: EndgameTable, chunk):
+    """ Keys of the legal positions of an endgame, in order. """
+    keys = []
+    for start in range(0, table.n_keys, chunk):
+        raw = np.arange(start, min(start + chunk, table.n_keys), dtype=np.int64)
+        squares, turn = table.decode(raw)
+        valid = np.ones(len(raw), dtype=bool)
+        for i in range(squares.shape[1]):
+            for j in range(i):
+                valid &= squares[:, i] != squares[:, j]
+            if table.pieces[i][1] == PAWN:
+                valid &= (squares[:, i] >= 8) & (squares[:, i] < 56)
+        valid &= table.canonical(squares, turn) == raw
+        rows = np.flatnonzero(valid)
+        # The side which just moved can't be in check
+        rows = rows[~table.boards(squares[rows], ~turn[rows]).is_check()]
+        keys.append(raw[rows])
+    return np.concatenate(keys)
+
+
+def _gather(values, offsets, index):
+    """ Concatenates the slices offsets[i]:offsets[i + 1] of the indexes. """
+    starts, counts = offsets[index], offsets[index + 1] - offsets[index]
+    shift = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    return values[shift + np.arange(counts.sum())]
+
+
+def build_table(signature, tables: EndgameTables, chunk=2 ** 18, verbose=False):
+    """ Builds the table of an endgame by retrograde analysis and saves it in
+    the directory of the tables, building first the missing tables of the
+    endgames it leads to (see `dependencies`).
+
+    Every legal position gets its legal moves (with `BatchBoard`): the ones
+    staying in the endgame are the edges of the retrograde analysis, the
+    captures and promotions are scored by the smaller tables. Then the
+    positions are resolved by increasing distance to mate, starting with the
+    checkmates: the parents of a lost position are won one ply later, and a
+    position is lost once all of its moves lead to won positions (one ply
+    after the longest of them). The positions never resolved are draws.
+
+    Parameters:
+        signature: str. Endgame to build (e.g. 'KRvK').
+        tables: EndgameTables. Tables of the directory, the new ones are
+        added to it.
+        chunk: int. Positions processed at once.
+        verbose: bool. Whether to print the progress.
+    Returns:
+        EndgameTable. The new table.
+    """
+    signature = normalize(signature)[0]
+    for dependency in dependencies(signature):
+        if dependency not in tables:
+            build_table(dependency, tables, chunk, verbose)
+
+    table = EndgameTable(signature)
+    keys = _positions(table, chunk)
+    n = len(keys)
+    n_moves = np.zeros(n, dtype=np.int32)
+    mated = np.zeros(n, dtype=bool)
+    win = np.full(n, _UNKNOWN, dtype=np.int32)  # Plies of the fastest win by leaving the endgame
+    loss = np.zeros(n, dtype=np.int32)  # Plies of the slowest loss seen so far
+    parents, children = [], []
+    for start in range(0, n, chunk):
+        index = np.arange(start, min(start + chunk, n))
+        boards = table.boards(*table.decode(keys[index]))
+        moves = boards.legal_moves()
+        n_moves[index] = np.bincount(moves.row, minlength=len(index))
+        stuck = np.flatnonzero(n_moves[index] == 0)
+        mated[index[stuck]] = boards.is_check(stuck)
+
+        after = boards.take(moves.row)
+        rows = np.arange(len(moves.row))
+        after.push(rows, moves.from_square, moves.to_square, moves.promotion)
+        parent = index[moves.row]
+        inside = (moves.promotion == 0) & \
+            (popcount(np.bitwise_or.reduce(after.pieces, axis=(1, 2))) == len(table.pieces))
+        child = np.searchsorted(keys, table.canonical(*table.squares(after, rows[inside])))
+        parents.append(parent[inside].astype(np.int32))
+        children.append(child.astype(np.int32))
+
+        wdl, dtm, found = tables.probe_boards(after, rows[~inside])
+        assert found.all(), 'Missing endgame table'
+        parent = parent[~inside]
+        np.minimum.at(win, parent[wdl == -1], dtm[wdl == -1] + 1)
+        np.subtract.at(n_moves, parent[wdl == 1], 1)
+        np.maximum.at(loss, parent[wdl == 1], dtm[wdl == 1] + 1)
+        n_moves[index[stuck]] = -1  # Not lost by running out of moves
+
+    parents, children = np.concatenate(parents), np.concatenate(children)
+    by_child = parents[np.argsort(children, kind='stable')]
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(children, minlength=n))])
+    del parents, children
+
+    # Positions to resolve at each distance: won (1) or lost (-1)
+    depth = np.where(mated, 0, win)
+    kind = np.where(mated, -1, np.where(win < _UNKNOWN, 1, 0)).astype(np.int8)
+    lost = n_moves == 0
+    depth[lost], kind[lost] = loss[lost], -1
+    scores = np.zeros(n, dtype=np.int16)
+    resolved = np.zeros(n, dtype=bool)
+    while True:
+        pending = ~resolved & (depth < _UNKNOWN)
+        if not pending.any():
+            break
+        plies = depth[pending].min()
+        frontier = np.flatnonzero(pending & (depth == plies))
+        resolved[frontier] = True
+        scores[frontier] = kind[frontier] * (plies + 1)
+        # A move to a lost position wins
+        parent = _gather(by_child, offsets, frontier[kind[frontier] == -1])
+        parent = parent[~resolved[parent] & (depth[parent] > plies + 1)]
+        depth[parent], kind[parent] = plies + 1, 1
+        # A position is lost when all its moves lead to won positions
+        parent = _gather(by_child, offsets, frontier[kind[frontier] == 1])
+        parent = parent[~resolved[parent]]
+        np.subtract.at(n_moves, parent, 1)
+        np.maximum.at(loss, parent, plies + 1)
+        parent = np.unique(parent)
+        parent = parent[(n_moves[parent] == 0) & (kind[parent] == 0)]
+        depth[parent], kind[parent] = loss[parent], -1
+        if verbose:
+            print(f"{signature}: {len(frontier)} positions at {plies} plies")
+
+    table.keys, table.scores = keys, scores
+    if verbose:
+        print(f"{signature}: {n} positions, {np.count_nonzero(scores > 0)} won, "
+              f"{np.count_nonzero(scores < 0)} lost")
+    return tables.save(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds endgame tables by retrograde analysis.")
+    parser.add_argument('signatures', nargs='*', default=list(DEFAULT_ENDGAMES),
+                        help="Endgames to build, e.g. KRvK (the default ones if none).")
+    parser.add_argument('--dest_dir', default='endgames', help="Directory of the tables.")
+    parser.add_argument('--chunk', type=int, default=2 ** 18, help="Positions processed at once.")
+    args = parser.parse_args()
+
+    tables = EndgameTables(args.dest_dir)
+    for signature in args.signatures:
+        if signature not in tables:
+            build_table(signature, tables, args.chunk, verbose=True)
+
+
+if __name__ == "__main__":
+    main()
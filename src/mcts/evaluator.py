@@ -0,0 +1,248 @@
+import queue
+import threading
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import Future
+from timeit import default_timer as timer
+
+from src.envs.game import Game
+from src.mcts.transposition import position_key
+from src.utils.encoder_decoder import get_game_state, get_uci_labels, encode_move
+
+
+def history_key(board, T=8):
+    """ Key of a position and the T previous ones (the input of the encoder,
+    see `get_game_history`): the Zobrist key of the position T plies before
+    and the codes of the moves played since then.
+    """
+    back = board.copy(stack=T)
+    moves = tuple(encode_move(m) for m in back.move_stack)
+    while back.move_stack:
+        back.pop()
+    return position_key(back), moves
+
+
+class EvaluationCache:
+    """ Bounded cache of the network evaluations, keyed by the position and
+    its history (see `history_key`), so the positions reached again in a
+    search, in the next searches or in other games are not evaluated again.
+    The least recently used evaluations are evicted when the memory of the
+    cache exceeds its limit.
+
+    The policy masked to the legal moves (in the order of
+    `board.legal_moves`) and the value are stored as float16.
+
+    Parameters:
+        max_bytes: int. Max. memory of the cached evaluations.
+        T: int. Previous positions of the key, the ones seen by the encoder.
+
+    Attributes:
+        hits: int. Lookups of cached positions.
+        misses: int. Lookups of unknown positions.
+        evictions: int. Evaluations removed to stay within the memory limit.
+        nbytes: int. Approximate memory of the cached evaluations.
+    """
+
+    # Approximate memory of an entry besides its policy (key, dict slot and
+    # array headers)
+    ENTRY_BYTES = 700
+
+    def __init__(self, max_bytes=64 * 2 ** 20, T=8):
+        self.max_bytes = max_bytes
+        self.T = T
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+
+    def key(self, board):
+        return history_key(board, self.T)
+
+    def get(self, key):
+        """ Returns the policy and value cached for the key, None if unknown. """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, policy, value):
+        """ Caches the policy (over the legal moves) and the value of a key. """
+        entry = np.asarray(policy, dtype=np.float16), np.float16(value)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= self.ENTRY_BYTES + old[0].nbytes
+            self.entries[key] = entry
+            self.nbytes += self.ENTRY_BYTES + entry[0].nbytes
+            while self.nbytes > self.max_bytes and self.entries:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.nbytes -= self.ENTRY_BYTES + evicted.nbytes
+                self.evictions += 1
+        return entry
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        """ Returns a dict with the usage of the cache. """
+        return {
+            'entries': len(self),
+            'nbytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / max(self.hits + self.misses, 1),
+            'evictions': self.evictions,
+        }
+
+
+class BatchEvaluator:
+    """ Broker evaluating positions with a policy/value network in batches.
+    The search threads (of one tree or of many games sharing the broker)
+    queue their positions and wait; a worker thread collects them until the
+    batch is full or the oldest one waited `max_wait` seconds, runs a single
+    forward pass over the batch and hands every thread its priors and value.
+
+    On CPU a forward pass over a batch costs little more than over a single
+    position, so batching amortizes the model call over the leaves. With a
+    cache, the positions evaluated before are answered without queueing
+    them (the returned evaluations are the cached float16 ones either way).
+
+    Parameters:
+        model: callable. Takes a batch of encoded states (N x 8 x 8 x 127,
+        see `get_game_state`) and returns the policies (N x 1968, over
+        `get_uci_labels`) and the values (N, in [-1, 1] from the white
+        perspective), e.g. the `predict_on_batch` of a Keras model.
+        batch_size: int. Max. number of positions of a batch.
+        max_wait: float. Max. seconds a position waits for the batch to fill.
+        cache: EvaluationCache or int. Cache of the evaluations (it can be
+        shared by several evaluators), or its max. bytes to make a new one.
+        None to evaluate every position.
+
+    Attributes:
+        evaluations: int. Positions evaluated.
+        batches: int. Forward passes run.
+        wait_time: float. Seconds waited by the positions until their batch
+        was evaluated, added up.
+    """
+
+    def __init__(self, model, batch_size=32, max_wait=0.005, cache=None):
+        self.model = model
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.labels = {label: i for i, label in enumerate(get_uci_labels())}
+        if isinstance(cache, int):
+            cache = EvaluationCache(cache)
+        self.cache = cache
+        self.evaluations = 0
+        self.batches = 0
+        self.wait_time = 0.
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _start(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def close(self):
+        """ Stops the worker thread once the queued positions are evaluated. """
+        with self._lock:
+            if self._worker is not None:
+                self._queue.put(None)
+                self._worker.join()
+                self._worker = None
+
+    def evaluate(self, game: Game):
+        """ Evaluates a position, waiting for its batch.
+
+        Returns:
+            priors: dict. Probability of each legal move (UCI encoded), the
+            policy of the network masked to the legal moves.
+            value: float. Expected result from the white perspective.
+        """
+        moves = [m.uci() for m in game.board.legal_moves]
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(game.board)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return dict(zip(moves, cached[0].tolist())), float(cached[1])
+
+        self._start()
+        future = Future()
+        self._queue.put((get_game_state(game), future, timer()))
+        policy, value = future.result()
+        probs = np.array([policy[self.labels[m]] if m in self.labels else 0. for m in moves])
+        total = probs.sum()
+        probs = probs / total if total > 0 else np.full(len(moves), 1 / max(len(moves), 1))
+        if self.cache is not None:
+            probs, value = self.cache.put(key, probs, value)
+        return dict(zip(moves, probs.tolist())), float(value)
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = timer() + self.max_wait
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - timer(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._evaluate_batch(batch)
+
+    def _evaluate_batch(self, batch):
+        states, futures, queued = zip(*batch)
+        start = timer()
+        try:
+            policies, values = self.model(np.asarray(states))
+            policies = np.asarray(policies)
+            values = np.asarray(values, dtype=float).reshape(len(batch))
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        self.evaluations += len(batch)
+        self.batches += 1
+        self.wait_time += sum(start - t for t in queued)
+        for future, policy, value in zip(futures, policies, values):
+            future.set_result((policy, float(value)))
+
+    def stats(self):
+        """ Returns a dict with the usage of the broker (and its cache). """
+        stats = {
+            'evaluations': self.evaluations,
+            'batches': self.batches,
+            'avg_batch_size': self.evaluations / max(self.batches, 1),
+            'avg_wait': self.wait_time / max(self.evaluations, 1),
+        }
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        return stats
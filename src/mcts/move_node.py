@@ -0,0 +1,253 @@
+import numpy as np
+from threading import Lock
+
+from src.envs.game import Game
+from src.mcts.node import NodeStats, puct_values, ucb1_values
+from src.mcts.transposition import position_key
+from src.utils.encoder_decoder import encode_move, decode_move
+
+NO_MOVE = -1
+ONGOING = 2  # Cached result of a node whose game is not over
+
+# Nodes share a fixed pool of locks instead of having one each
+_LOCKS = [Lock() for _ in range(64)]
+
+
+class MoveNode:
+    """ Lightweight node of a Monte Carlo Tree. It offers the same interface
+    as `Node` but doesn't hold a game: it stores the move leading to it (our
+    move and the opponent reply), its cached result and Zobrist key, and the
+    codes of its legal moves, generated the first time the node is expanded.
+    Leaves don't even have arrays for the statistics of their children.
+
+    The search walks a single game pushing the moves of the nodes while
+    descending (see `generate_actions` and `push_moves`); `state` rebuilds
+    the game from the root only when it is needed outside of the search.
+
+    Attributes:
+        parent: MoveNode. Parent node, None for the root.
+        move: int. Code of our move from the parent (see `encode_move`).
+        reply: int. Code of the opponent reply, NO_MOVE if the game ended.
+        children: list. Expanded children.
+        children_stats: NodeStats. Statistics of the children.
+        result: int. Result of the game at the node, ONGOING if not over.
+        key: int. Zobrist key of the position.
+        root_state: Game. State of the root (only set in the root).
+    """
+
+    # Approximate memory of a node (moves, legal move codes and statistics),
+    # measured by src/benchmarks/node_memory.py
+    BYTES_PER_NODE = 450
+    __slots__ = ('parent', 'move', 'reply', 'children', 'children_stats', 'result', 'key',
+                 'root_state', '_stats', '_slot', '_actions', '_n_popped')
+
+    def __init__(self, state: Game, parent=None, move=NO_MOVE, reply=NO_MOVE, stats=None):
+        self.parent = parent
+        self.move = move
+        self.reply = reply
+        self.children = []
+        self.children_stats = None
+        result = state.get_result()
+        self.result = ONGOING if result is None else result
+        self.key = position_key(state.board)
+        self.root_state = state.get_copy(history=Game.HISTORY) if parent is None else None
+        # Slot of the statistics in the arrays of the parent (see `add_child`)
+        self._stats, self._slot = (NodeStats(1), 0) if stats is None else stats
+        self._actions = None
+        self._n_popped = 0
+
+    @property
+    def visits(self):
+        return int(self._stats.visits[self._slot])
+
+    @visits.setter
+    def visits(self, visits):
+        self._stats.visits[self._slot] = visits
+
+    @property
+    def value(self):
+        return float(self._stats.value[self._slot])
+
+    @value.setter
+    def value(self, value):
+        self._stats.value[self._slot] = value
+
+    @property
+    def prior(self):
+        return float(self._stats.prior[self._slot])
+
+    @prior.setter
+    def prior(self, prior):
+        self._stats.prior[self._slot] = prior
+
+    @property
+    def vloss(self):
+        return int(self._stats.vloss[self._slot])
+
+    @vloss.setter
+    def vloss(self, vloss):
+        self._stats.vloss[self._slot] = vloss
+
+    @property
+    def children_visits(self):
+        return int(self._stats.children_visits[self._slot])
+
+    @children_visits.setter
+    def children_visits(self, visits):
+        self._stats.children_visits[self._slot] = visits
+
+    @property
+    def n_priors(self):
+        return int(self._stats.n_priors[self._slot])
+
+    @n_priors.setter
+    def n_priors(self, n):
+        self._stats.n_priors[self._slot] = n
+
+    @property
+    def lock(self):
+        return _LOCKS[(id(self) >> 4) % len(_LOCKS)]
+
+    def path(self):
+        """ Returns the move codes to apply from the root to reach the node
+        and the root.
+        """
+        codes, node = [], self
+        while node.parent is not None:
+            if node.reply != NO_MOVE:
+                codes.append(node.reply)
+            codes.append(node.move)
+            node = node.parent
+        return codes[::-1], node
+
+    @property
+    def state(self):
+        """ Game of the node, rebuilt from the root state. """
+        codes, root = self.path()
+        state = root.root_state.get_copy(history=Game.HISTORY)
+        for code in codes:
+            state.push(decode_move(code))
+        return state
+
+    def push_moves(self, state: Game):
+        """ Pushes the moves from the parent to this node onto the game of the
+        parent and returns how many they were.
+        """
+        codes = [c for c in (self.move, self.reply) if c != NO_MOVE]
+        for code in codes:
+            state.push(decode_move(code))
+        return len(codes)
+
+    def generate_actions(self, state=None):
+        """ Generates the codes of the legal moves of the node from its game
+        (rebuilt if not given) the first time it is needed.
+        """
+        if self._actions is None:
+            if state is None:
+                state = self.state
+            actions = np.array([encode_move(m) for m in state.board.legal_moves], dtype=np.int16)
+            with self.lock:
+                # Other threads may have generated (and ordered or popped) them meanwhile
+                if self._actions is None:
+                    self._actions = actions
+
+    @property
+    def unexpanded_actions(self):
+        self.generate_actions()
+        return [decode_move(c).uci() for c in self._actions[:len(self._actions) - self._n_popped]]
+
+    @property
+    def is_leaf(self):
+        return len(self.children) == 0
+
+    @property
+    def is_fully_expanded(self):
+        self.generate_actions()
+        return self._n_popped == len(self._actions)
+
+    @property
+    def is_terminal_state(self):
+        return self.result != ONGOING
+
+    @property
+    def is_root(self):
+        return self.parent is None
+
+    @property
+    def moves(self):
+        """ UCI moves from the parent to this node (see `Node.moves`). """
+        return [decode_move(c).uci() for c in (self.move, self.reply) if c != NO_MOVE]
+
+    def detach(self):
+        """ Makes this node the root of its subtree. """
+        self.root_state = self.state
+        self.parent = None
+
+    def pop_unexpanded_action(self):
+        """ Pops the next legal move to expand (the last one, as `Node`). """
+        self.generate_actions()
+        with self.lock:
+            if self._n_popped == len(self._actions):
+                raise IndexError('pop from fully expanded node')
+            self._n_popped += 1
+            code = self._actions[len(self._actions) - self._n_popped]
+        return decode_move(code).uci()
+
+    def order_actions(self, scores):
+        """ Sorts the unexpanded actions (see `Node.order_actions`). """
+        self.generate_actions()
+        with self.lock:
+            n = len(self._actions) - self._n_popped
+            keys = [scores.get(decode_move(c).uci(), 0.) for c in self._actions[:n]]
+            self._actions[:n] = self._actions[:n][np.argsort(keys, kind='stable')]
+
+    def add_child(self, state: Game):
+        """ Adds the child reached by the state (after one of the popped
+        unexpanded actions and the opponent reply) and returns it.
+        """
+        codes, root = self.path()
+        pushed = state.moves_since(len(root.root_state) + len(codes))
+        reply = encode_move(pushed[1]) if len(pushed) > 1 else NO_MOVE
+        with self.lock:
+            if self.children_stats is None:
+                self.children_stats = NodeStats(len(self._actions))
+            stats = self.children_stats, self.children_stats.reserve()
+            child = MoveNode(state, parent=self, move=encode_move(pushed[0]), reply=reply, stats=stats)
+            self.children.append(child)
+        return child
+
+    def collapse(self):
+        """ Removes the subtree below the node, keeping its statistics (see
+        `Node.collapse`) and its legal moves.
+        """
+        with self.lock:
+            self.children = []
+            self.children_stats = None
+            self.n_priors = 0
+            self._n_popped = 0
+
+    def get_ucb1(self):
+        """ returns the UCB1 metric of the node. """
+        return float(ucb1_values(self.value, self.visits, self.parent.visits))
+
+    def get_value(self):
+        """ Returns the Q + U for the node (see `Node.get_value`). """
+        if self.is_root:
+            return 99999999999 - self.vloss
+        return puct_values(self.value, self.visits, self.prior, self.children_visits, self.vloss)
+
+    def get_best_child(self, ucb1=False):
+        """Get the best child of this node (see `Node.get_best_child`).
+
+        Parameters:
+            ucb1: bool. Whether to use the UCB1 metric instead of PUCT.
+        Returns:
+            best: MoveNode. Child with the max. PUCT (or UCB1) value.
+        """
+        children = self.children
+        s, n = self.children_stats, len(children)
+        if ucb1:
+            values = ucb1_values(s.value[:n], s.visits[:n], self.visits)
+        else:
+            values = puct_values(s.value[:n], s.visits[:n], s.prior[:n], s.children_visits[:n], s.vloss[:n])
+        return children[int(np.argmax(values))]
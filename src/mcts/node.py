@@ -1,6 +1,7 @@
 import numpy as np
 
 from src.envs.game import Game
+from src.mcts.transposition import position_key
 from threading import Lock
 
 VIRTUAL_LOSS = 1
@@ -17,18 +18,77 @@ class Node:
         value: float. Expected reward of this node.
         visits: int. Number of times the node has been visited
         prior: float.
+        children_visits: int. Sum of the visits of the children.
+        n_priors: int. Number of children whose prior was set by the
+        evaluator (see `SelfPlayTree`).
+        children_stats: NodeStats. Statistics of the children, None until
+        the first one is added.
     """
 
-    def __init__(self, state: Game, parent=None):
+    # Approximate memory of a node (its Game copy with the move stack and the
+    # UCI legal moves), measured by src/benchmarks/node_memory.py
+    BYTES_PER_NODE = 6000
+
+    def __init__(self, state: Game, parent=None, stats=None):
         self.state = state
         self.children = []
         self.unexpanded_actions = state.get_legal_moves()
         self.parent = parent
-        self.value = 0
-        self.visits = 0
-        self.prior = 1
-        self.vloss = 0
+        # The statistics of a node live in the arrays of its parent (see
+        # `add_child`), the ones of its children in `children_stats`
+        self._stats, self._slot = (NodeStats(1), 0) if stats is None else stats
+        self.children_stats = None
         self.lock = Lock()
+        self._key = None
+
+    @property
+    def visits(self):
+        return int(self._stats.visits[self._slot])
+
+    @visits.setter
+    def visits(self, visits):
+        self._stats.visits[self._slot] = visits
+
+    @property
+    def value(self):
+        return float(self._stats.value[self._slot])
+
+    @value.setter
+    def value(self, value):
+        self._stats.value[self._slot] = value
+
+    @property
+    def prior(self):
+        return float(self._stats.prior[self._slot])
+
+    @prior.setter
+    def prior(self, prior):
+        self._stats.prior[self._slot] = prior
+
+    @property
+    def vloss(self):
+        return int(self._stats.vloss[self._slot])
+
+    @vloss.setter
+    def vloss(self, vloss):
+        self._stats.vloss[self._slot] = vloss
+
+    @property
+    def children_visits(self):
+        """ Sum of the visits of the children, kept by the backpropagation. """
+        return int(self._stats.children_visits[self._slot])
+
+    @children_visits.setter
+    def children_visits(self, visits):
+        self._stats.children_visits[self._slot] = visits
+
+    @property
+    def n_priors(self):
+        return int(self._stats.n_priors[self._slot])
+
+    @n_priors.setter
+    def n_priors(self, n):
+        self._stats.n_priors[self._slot] = n
 
     @property
     def is_leaf(self):
@@ -46,21 +106,62 @@ class Node:
     def is_root(self):
         return self.parent is None
 
+    @property
+    def key(self):
+        """ Zobrist key of the position of the node. """
+        if self._key is None:
+            self._key = position_key(self.state.board)
+        return self._key
+
+    @property
+    def moves(self):
+        """ UCI moves from the parent to this node: our move and the opponent
+        reply (if the game didn't end with ours).
+        """
+        if self.is_root:
+            return []
+        played = self.state.moves_since(len(self.parent.state))
+        return [m.uci() for m in played]
+
     def pop_unexpanded_action(self):
         return self.unexpanded_actions.pop()
 
+    def order_actions(self, scores):
+        """ Sorts the unexpanded actions to pop the ones with the highest
+        score (dict of UCI moves) first.
+        """
+        with self.lock:
+            self.unexpanded_actions.sort(key=lambda m: scores.get(m, 0.))
+
+    def add_child(self, state: Game):
+        """ Adds the child reached by the state (after one of the popped
+        unexpanded actions) and returns it.
+        """
+        with self.lock:
+            if self.children_stats is None:
+                # Sized for the unexpanded actions and the one just popped
+                self.children_stats = NodeStats(len(self.unexpanded_actions) + 1)
+            stats = self.children_stats, self.children_stats.reserve()
+            child = Node(state, parent=self, stats=stats)
+            self.children.append(child)
+        return child
+
+    def collapse(self):
+        """ Removes the subtree below the node, which can be expanded again.
+        Its statistics (visits, value and children visits) already add up the
+        ones of the removed nodes, so they are kept.
+        """
+        with self.lock:
+            self.children = []
+            self.n_priors = 0
+            self.unexpanded_actions = self.state.get_legal_moves()
+            self.children_stats = None
+
     def get_ucb1(self):
         """ returns the UCB1 metric of the node. """
-        C = 2
-        value = 0
-        if self.visits == 0:
-            value = 99999999999  # Infinite to avoid division by 0
-        else:
-            # Vanilla MCTS
-            # Return ucb1 score = vi + c * sqrt(log(N)/ni)
-            value = self.value / self.visits + C * \
-                    np.sqrt(np.log(self.parent.visits) / self.visits)
-        return value
+        # Vanilla MCTS
+        # Return ucb1 score = vi + c * sqrt(log(N)/ni)
+        return float(ucb1_values(self.value, self.visits, self.parent.visits))
 
     def get_value(self):
         """Returns the Q + U for the node using the prior probabilities
@@ -70,20 +171,72 @@ class Node:
         Being C a constant which makes the U (exploration part of the
         equation) more important.
         """
-        C = 10
-        value = 0
         if self.is_root:
-            value = 99999999999  # Infinite to avoid division by 0
-        else:
-            value = (self.value / (1 + self.visits)) + \
-                    C * self.prior * \
-                    (np.sqrt(np.sum([c.visits for c in self.children])) / (1 + self.visits))  # noqa: E501
-        return value - self.vloss
+            return 99999999999 - self.vloss  # Infinite to avoid division by 0
+        return puct_values(self.value, self.visits, self.prior, self.children_visits, self.vloss)
 
-    def get_best_child(self):
-        """Get the best child of this node.
+    def get_best_child(self, ucb1=False):
+        """Get the best child of this node. The metric of all the children is
+        computed at once over the arrays of their statistics.
+
+        Parameters:
+            ucb1: bool. Whether to use the UCB1 metric instead of PUCT.
         Returns:
-            best: Node. Child with the max. PUCT value.
+            best: Node. Child with the max. PUCT (or UCB1) value.
         """
-        best = np.argmax([c.get_value() for c in self.children])
-        return self.children[best]
+        children = self.children
+        s, n = self.children_stats, len(children)
+        if ucb1:
+            values = ucb1_values(s.value[:n], s.visits[:n], self.visits)
+        else:
+            values = puct_values(s.value[:n], s.visits[:n], s.prior[:n], s.children_visits[:n], s.vloss[:n])
+        return children[int(np.argmax(values))]
+
+
+class NodeStats:
+    """ Statistics of the children of a node in contiguous arrays, so the
+    selection scores all of them with a few NumPy operations. The arrays are
+    sized for the legal moves of the node and grown (doubled) if needed.
+
+    Attributes:
+        visits, value, prior, vloss, children_visits, n_priors: np.array.
+        Statistics of each child (see `Node`).
+    """
+
+    # name, dtype, initial value
+    FIELDS = (('visits', np.int64, 0),
+              ('value', np.float64, 0),
+              ('prior', np.float64, 1),
+              ('vloss', np.int64, 0),
+              ('children_visits', np.int64, 0),
+              ('n_priors', np.int64, 0))
+
+    def __init__(self, capacity):
+        self.size = 0
+        for name, dtype, fill in self.FIELDS:
+            setattr(self, name, np.full(capacity, fill, dtype=dtype))
+
+    def reserve(self):
+        """ Returns a new slot with the initial statistics. """
+        if self.size == len(self.visits):
+            for name, dtype, fill in self.FIELDS:
+                old = getattr(self, name)
+                setattr(self, name, np.concatenate([old, np.full(len(old), fill, dtype=dtype)]))
+        self.size += 1
+        return self.size - 1
+
+
+def puct_values(value, visits, prior, children_visits, vloss):
+    """ Q + U - virtual loss of nodes (scalars or arrays), see `Node.get_value`. """
+    C = 10
+    return value / (1 + visits) + C * prior * np.sqrt(children_visits) / (1 + visits) - vloss
+
+
+def ucb1_values(value, visits, parent_visits):
+    """ UCB1 of nodes (scalars or arrays) with the same parent, infinite for
+    the ones not visited yet (see `Node.get_ucb1`).
+    """
+    C = 2
+    seen = np.maximum(visits, 1)
+    ucb1 = value / seen + C * np.sqrt(np.log(max(parent_visits, 1)) / seen)
+    return np.where(visits == 0, 99999999999, ucb1)
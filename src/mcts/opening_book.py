@@ -0,0 +1,171 @@
+import os
+import random
+import argparse
+import numpy as np
+import chess
+
+from src.envs.game_store import GameStore
+from src.mcts.transposition import position_key
+from src.utils.encoder_decoder import encode_move, decode_move
+
+INDEX_DTYPE = np.dtype([('key', '<u8'), ('first', '<u4'), ('n', '<u2')])
+MOVES_DTYPE = np.dtype([('move', '<u2'), ('count', '<u4'), ('score', '<i4')])
+
+
+def game_result(board: chess.Board):
+    """ Result of a played game for the white pieces, 0 if unfinished. """
+    outcome = board.outcome(claim_draw=True)
+    if outcome is None or outcome.winner is None:
+        return 0
+    return 1 if outcome.winner == chess.WHITE else -1
+
+
+def build_book(games, path, max_plies=30, min_count=1):
+    """ Folds games into an opening book: the times each move was played
+    from each position of their first plies and the results it got.
+
+    Parameters:
+        games: GameStore or List[Game]. Games of the book.
+        path: str. Prefix of the files of the book (see `OpeningBook`).
+        max_plies: int. Plies of each game added to the book.
+        min_count: int. Times a move must be played to be kept.
+    Returns:
+        OpeningBook. The new book.
+    """
+    stats = {}
+    for game in games:
+        result = game_result(game.board)
+        board = chess.Board()
+        for move in game.board.move_stack[:max_plies]:
+            moves = stats.setdefault(position_key(board), {})
+            count, score = moves.get(encode_move(move), (0, 0))
+            # Results for the side playing the move
+            moves[encode_move(move)] = count + 1, score + (result if board.turn == chess.WHITE else -result)
+            board.push(move)
+
+    positions = []
+    for key, moves in stats.items():
+        moves = sorted(((m, c, s) for m, (c, s) in moves.items() if c >= min_count), key=lambda e: -e[1])
+        if moves:
+            positions.append((key, moves))
+
+    # Open addressing with linear probing, at most half full (the key 0 is an empty bucket)
+    size = 1 << max(int(np.ceil(np.log2(max(2 * len(positions), 2)))), 1)
+    index = np.zeros(size, dtype=INDEX_DTYPE)
+    entries = np.zeros(sum(len(moves) for _, moves in positions), dtype=MOVES_DTYPE)
+    first = 0
+    for key, moves in positions:
+        bucket = key & (size - 1)
+        while index['key'][bucket] != 0:
+            bucket = (bucket + 1) & (size - 1)
+        index[bucket] = key, first, len(moves)
+        entries[first:first + len(moves)] = moves
+        first += len(moves)
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    np.save(f'{path}.index.npy', index)
+    np.save(f'{path}.moves.npy', entries)
+    return OpeningBook(path)
+
+
+class OpeningBook:
+    """ Moves played from the positions of a set of games (see `build_book`),
+    probed before searching so the opening moves cost a hash lookup. The
+    positions are buckets of a hash table indexed by the low bits of their
+    Zobrist key (linear probing), pointing to their moves sorted by the times
+    they were played. Both arrays are memory-mapped from their files.
+
+    Parameters:
+        path: str. Prefix of the files of the book.
+        min_count: int. Times a move must have been played to be chosen.
+        weighted: bool. Whether to choose the moves at random, weighted by
+        the times they were played, instead of the most played one.
+
+    Attributes:
+        hits: int. Positions found in the book.
+        misses: int. Positions not in the book.
+    """
+
+    def __init__(self, path, min_count=1, weighted=False):
+        self.path = path
+        self.min_count = min_count
+        self.weighted = weighted
+        self.index = np.load(f'{path}.index.npy', mmap_mode='r')
+        self.moves = np.load(f'{path}.moves.npy', mmap_mode='r')
+        self.mask = len(self.index) - 1
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        # The memory-mapped arrays are opened again by the copies
+        return {'path': self.path, 'min_count': self.min_count, 'weighted': self.weighted}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __len__(self):
+        """ Positions of the book. """
+        return int(np.count_nonzero(self.index['key']))
+
+    def lookup(self, board: chess.Board):
+        """ Returns the moves of a position (an array of MOVES_DTYPE, the
+        most played first), None if it isn't in the book.
+        """
+        key = position_key(board)
+        bucket = key & self.mask
+        while True:
+            entry = self.index[bucket]
+            if int(entry['key']) == key:
+                self.hits += 1
+                return self.moves[entry['first']:entry['first'] + entry['n']]
+            if int(entry['key']) == 0:
+                self.misses += 1
+                return None
+            bucket = (bucket + 1) & self.mask
+
+    def probe(self, board: chess.Board):
+        """ Returns a dict with the times each move (UCI encoded) was played
+        from the position and the average result it got for the side to move.
+        Empty if the position isn't in the book.
+        """
+        moves = self.lookup(board)
+        if moves is None:
+            return {}
+        return {decode_move(int(m['move'])).uci(): (int(m['count']), m['score'] / m['count']) for m in moves}
+
+    def best_move(self, board: chess.Board):
+        """ Returns the book move (UCI encoded) of a position, None if it has
+        no legal move played at least `min_count` times.
+        """
+        moves = self.lookup(board)
+        if moves is None:
+            return None
+        # Legal moves only, in case of a collision of the keys
+        moves = [(decode_move(int(m['move'])), int(m['count'])) for m in moves if m['count'] >= self.min_count]
+        moves = [(m, c) for m, c in moves if board.is_legal(m)]
+        if not moves:
+            return None
+        if self.weighted:
+            return random.choices([m for m, _ in moves], weights=[c for _, c in moves])[0].uci()
+        return moves[0][0].uci()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds an opening book from JSON datasets of games.")
+    parser.add_argument('datasets', nargs='+', help="JSON datasets of games (see GameStore).")
+    parser.add_argument('--dest_path', default='book', help="Prefix of the files of the book.")
+    parser.add_argument('--max_plies', type=int, default=30)
+    parser.add_argument('--min_count', type=int, default=1)
+    args = parser.parse_args()
+
+    store = GameStore()
+    for path in args.datasets:
+        store.load(path)
+    book = build_book(store, args.dest_path, args.max_plies, args.min_count)
+    print(f"{len(book)} positions from {len(store)} games")
+
+
+if __name__ == "__main__":
+    main()
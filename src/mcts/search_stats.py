@@ -0,0 +1,213 @@
+import json
+import threading
+from contextlib import contextmanager
+from timeit import default_timer as timer
+
+PHASES = ('select', 'expand', 'simulate', 'backprop')
+
+
+class SearchStats:
+    """ Statistics of a search, cheap enough to be always collected: a few
+    timer calls per iteration, a non-blocking attempt before every lock and
+    one update of the totals per iteration. The counters of each thread are
+    kept apart and added up at the end of its iterations.
+
+    Attributes:
+        iterations: int. Iterations run.
+        nodes: int. Nodes added to the tree.
+        pruned: int. Nodes removed from the tree to stay within its caps.
+        playouts: int. Random playouts run by the simulations.
+        playouts_saved: int. Playouts not run compared to the fixed number
+        of the tree (negative if the adaptive rollouts ran more).
+        table_hits: int. Positions scored by the endgame tables.
+        elapsed: float. Seconds of search.
+        max_depth: int. Depth of the deepest node reached by an iteration.
+        total_depth: int. Sum of the depths reached by the iterations.
+        tree_size: int. Nodes of the tree at the end of the search.
+        tree_bytes: int. Memory (estimated for the object backends) of the
+        tree at the end of the search.
+        phase_time: dict. Seconds spent in each phase (see PHASES), added
+        up by all the threads.
+        lock_acquisitions: int. Node locks taken.
+        lock_contentions: int. Node locks found taken by another thread.
+        lock_wait: float. Seconds waiting for node locks.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start()
+
+    def start(self):
+        """ Restarts the clock and the counters. """
+        self._local = threading.local()
+        self.iterations = 0
+        self.nodes = 0
+        self.pruned = 0
+        self.playouts = 0
+        self.playouts_saved = 0
+        self.table_hits = 0
+        self.elapsed = 0.
+        self.max_depth = 0
+        self.total_depth = 0
+        self.tree_size = 0
+        self.tree_bytes = 0
+        self.phase_time = dict.fromkeys(PHASES, 0.)
+        self.lock_acquisitions = 0
+        self.lock_contentions = 0
+        self.lock_wait = 0.
+        self._start = timer()
+
+    def finish(self, tree_size=None, tree_bytes=None):
+        """ Stops the clock and records the size of the tree. """
+        self.elapsed = timer() - self._start
+        if tree_size is not None:
+            self.tree_size = tree_size
+        if tree_bytes is not None:
+            self.tree_bytes = tree_bytes
+
+    def _counters(self):
+        """ Counters of the current iteration of this thread. """
+        local = self._local
+        if not hasattr(local, 'expand'):
+            self._reset_counters()
+        return local
+
+    def _reset_counters(self):
+        local = self._local
+        local.expand = 0.
+        local.nodes = 0
+        local.playouts = 0
+        local.saved = 0
+        local.table_hits = 0
+        local.acquisitions = 0
+        local.contentions = 0
+        local.wait = 0.
+
+    @contextmanager
+    def locked(self, lock):
+        """ Takes a lock counting if it had to wait for it. """
+        counters = self._counters()
+        counters.acquisitions += 1
+        if not lock.acquire(blocking=False):
+            start = timer()
+            lock.acquire()
+            counters.contentions += 1
+            counters.wait += timer() - start
+        try:
+            yield
+        finally:
+            lock.release()
+
+    def add_expansion(self, seconds):
+        """ Counts a node added by the expansion phase. """
+        counters = self._counters()
+        counters.expand += seconds
+        counters.nodes += 1
+
+    def add_playouts(self, n, saved=0):
+        """ Counts the playouts of a simulation and the ones saved. """
+        counters = self._counters()
+        counters.playouts += n
+        counters.saved += saved
+
+    def add_table_hit(self):
+        """ Counts a position scored by the endgame tables. """
+        self._counters().table_hits += 1
+
+    def add_pruned(self, nodes):
+        """ Counts the nodes removed by a pruning of the tree. """
+        with self.lock:
+            self.pruned += nodes
+
+    def record_iteration(self, depth, select, simulate, backprop):
+        """ Adds up an iteration of the current thread: the depth it reached
+        and the seconds of its phases (select including the expansion).
+        """
+        counters = self._counters()
+        with self.lock:
+            self.iterations += 1
+            self.nodes += counters.nodes
+            self.playouts += counters.playouts
+            self.playouts_saved += counters.saved
+            self.table_hits += counters.table_hits
+            self.max_depth = max(self.max_depth, depth)
+            self.total_depth += depth
+            self.phase_time['select'] += select - counters.expand
+            self.phase_time['expand'] += counters.expand
+            self.phase_time['simulate'] += simulate
+            self.phase_time['backprop'] += backprop
+            self.lock_acquisitions += counters.acquisitions
+            self.lock_contentions += counters.contentions
+            self.lock_wait += counters.wait
+        self._reset_counters()
+
+    @property
+    def avg_depth(self):
+        return self.total_depth / max(self.iterations, 1)
+
+    @property
+    def nodes_per_second(self):
+        return self.nodes / max(self.elapsed, 1e-9)
+
+    @property
+    def iterations_per_second(self):
+        return self.iterations / max(self.elapsed, 1e-9)
+
+    @property
+    def lock_contention(self):
+        """ Fraction of the lock acquisitions which had to wait. """
+        return self.lock_contentions / max(self.lock_acquisitions, 1)
+
+    def merge(self, other: dict):
+        """ Adds up the statistics (see `as_dict`) of another search (e.g.
+        in a process of the root parallel search).
+        """
+        self.iterations += other['iterations']
+        self.nodes += other['nodes']
+        self.pruned += other['pruned']
+        self.playouts += other['playouts']
+        self.playouts_saved += other['playouts_saved']
+        self.table_hits += other['table_hits']
+        self.max_depth = max(self.max_depth, other['max_depth'])
+        self.total_depth += other['total_depth']
+        for phase in PHASES:
+            self.phase_time[phase] += other['phase_time'][phase]
+        self.lock_acquisitions += other['lock_acquisitions']
+        self.lock_contentions += other['lock_contentions']
+        self.lock_wait += other['lock_wait']
+        self.tree_size += other['tree_size']
+        self.tree_bytes += other['tree_bytes']
+
+    def as_dict(self):
+        return {
+            'iterations': self.iterations,
+            'nodes': self.nodes,
+            'pruned': self.pruned,
+            'playouts': self.playouts,
+            'playouts_saved': self.playouts_saved,
+            'table_hits': self.table_hits,
+            'elapsed': self.elapsed,
+            'iterations_per_second': self.iterations_per_second,
+            'nodes_per_second': self.nodes_per_second,
+            'max_depth': self.max_depth,
+            'avg_depth': self.avg_depth,
+            'total_depth': self.total_depth,
+            'tree_size': self.tree_size,
+            'tree_bytes': self.tree_bytes,
+            'phase_time': dict(self.phase_time),
+            'lock_acquisitions': self.lock_acquisitions,
+            'lock_contentions': self.lock_contentions,
+            'lock_contention': self.lock_contention,
+            'lock_wait': self.lock_wait,
+        }
+
+    def to_json(self, **extra):
+        """ Returns the statistics as a JSON line, with the extra fields
+        (e.g. the release or the position).
+        """
+        return json.dumps({**extra, **self.as_dict()})
+
+    def write_jsonl(self, path, **extra):
+        """ Appends the statistics as a line of a JSON lines file. """
+        with open(path, 'a') as f:
+            f.write(self.to_json(**extra) + '\n')
@@ -1,12 +1,19 @@
 import numpy as np
 from src.envs.game import Game
 from src.agents.agent import Agent
-from concurrent.futures import ThreadPoolExecutor
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from timeit import default_timer as timer
 
-from src.mcts.simulation import RandomSimulation
+from src.mcts.simulation import BatchRandomSimulation
 from src.mcts.tree import Tree
 from src.mcts.node import Node
+from src.mcts.array_tree import ArrayNode, NodeArrays
+from src.mcts.move_node import MoveNode
+from src.mcts.transposition import TranspositionTable
+from src.mcts.budget import SearchBudget
+from src.mcts.search_stats import SearchStats
 
 VIRTUAL_LOSS = 1
 
@@ -17,95 +24,560 @@ class SelfPlayTree(Tree):
     Parameters:
         root: Node or Game. Root state of the tree. You can pass a Node object
         with a Game as state or directly the game (it will make the Node).
+        threads: int. Number of threads searching this tree.
+        processes: int. Number of processes searching independent trees.
+        backend: str. Storage of the nodes, 'object', 'array' or 'move' (see `Tree`).
+        capacity: int. Initial number of nodes of the 'array' backend.
+        rollouts: int. Random playouts run to evaluate each new node (the
+        reference of the playouts saved by `adaptive_rollouts`).
+        transpositions: TranspositionTable or int. Table sharing the
+        statistics of the nodes reaching the same position (by different move
+        orders), or its size to make a new one. None to search a plain tree.
+        selection: str. Metric maximized to select the children, 'puct' (see
+        `Node.get_value`) or 'ucb1' (see `Node.get_ucb1`).
+        node_cap: int. Max. number of nodes of the tree, None for no limit.
+        memory_cap: int. Max. bytes of the tree (estimated for the object
+        backends, see `nbytes`), None for no limit.
+        prune_ratio: float. Fraction of the caps the tree is pruned down to
+        when one of them is exceeded (see `prune`).
+        evaluator: BatchEvaluator. Network evaluating the new nodes (value)
+        and the nodes whose children are selected (priors) instead of the
+        random playouts. The threads of the tree (and other trees sharing
+        it) are evaluated in batches. Not supported with `processes` > 1.
+        widening: ProgressiveWidening. Limits the expanded children of the
+        nodes by their visits, expanding the most promising moves first.
+        None to expand all the moves of a node before going deeper.
+        adaptive_rollouts: AdaptiveRollouts. Adapts the playouts of each new
+        node to the uncertainty of its result, None for `rollouts` each.
+        rollout_moves: int. Max. moves of each playout.
+        static_evaluator: StaticEvaluator. Scores the playouts unfinished
+        after `rollout_moves` (instead of as a draw), so they can be short.
+        endgame_tables: EndgameTables. Score exactly the positions of their
+        endgames: the descent stops at them and they are not simulated.
+
+    Attributes:
+        pruned: int. Nodes removed by the pruning since the tree was made.
+        last_search: dict. Budget used by the last search (see
+        `SearchBudget.report`).
+        last_stats: SearchStats. Statistics of the last search.
+        last_ponder: dict. Budget used by the last pondering.
     """
 
-    def __init__(self, root, threads=6):
-        super().__init__(root)
-        self.num_threads = threads
+    SELECTIONS = ('puct', 'ucb1')
 
-    def search_move(self, agent, max_iters=200, verbose=False, noise=True, ai_move=False):
-        """ Explores and selects the best next state to choose from the root state
+    def __init__(self, root, threads=6, processes=1, backend='object', capacity=4096, rollouts=500,
+                 transpositions=None, selection='puct', node_cap=None, memory_cap=None, prune_ratio=0.8,
+                 evaluator=None, widening=None, adaptive_rollouts=None, rollout_moves=100,
+                 static_evaluator=None, endgame_tables=None):
+        super().__init__(root, backend=backend, capacity=capacity)
+        self.num_threads = threads
+        self.num_processes = processes
+        self.backend = backend
+        self.rollouts = rollouts
+        if isinstance(transpositions, int):
+            transpositions = TranspositionTable(transpositions)
+        self.transpositions = transpositions
+        if selection not in self.SELECTIONS:
+            raise ValueError(f'Unknown selection metric: {selection}')
+        self.selection = selection
+        self.node_cap = node_cap
+        self.memory_cap = memory_cap
+        self.prune_ratio = prune_ratio
+        if evaluator is not None and processes > 1:
+            raise ValueError('The evaluator is shared by threads, not by processes')
+        self.evaluator = evaluator
+        self.widening = widening
+        self.adaptive_rollouts = adaptive_rollouts
+        self.rollout_moves = rollout_moves
+        self.static_evaluator = static_evaluator
+        self.endgame_tables = endgame_tables
+        self.pruned = 0
+        self.budget = None
+        self.stats = None
+        self.last_search = None
+        self.last_stats = None
+        self.last_ponder = None
+        self._ponder = None
+        self._walks = threading.local()
+        self._size_lock = threading.Lock()
+        # Pruning waits for the running iterations and holds the new ones
+        self._prune_gate = threading.Condition()
+        self._running = 0
+        self._pruning = False
+
+    def search_move(self, agent, max_iters=200, verbose=False, noise=True, ai_move=False, max_time=None,
+                    max_nodes=None, early_stop=False, max_playouts=None):
+        """ Explores and selects the best next state to choose from the root state.
+
+        With `threads` > 1 the iterations run concurrently over this tree
+        (tree parallelism, the virtual loss keeps the threads on different
+        paths). With `processes` > 1 every process searches its own tree from
+        the root (root parallelism, not limited by the GIL) and their root
+        visit counts are merged. In that case the game and the agent must be
+        picklable and this tree is not grown.
+
+        The search stops with the first limit reached (see `SearchBudget`)
+        and the budget it used is left in `last_search`. Its statistics
+        (see `SearchStats`) are left in `last_stats`.
 
         Parameters:
             agent: Player. Agent which will be used in the simulations against
-            max_iters: int. Number of interactions to run the algorithm.
+            max_iters: int. Number of interactions to run the algorithm, None
+            to search until another limit.
             verbose: bool. Whether to print the search status.
             noise: bool. Whether to add Dirichlet noise to the calc policy.
             ai_move: bool. Whether to return the move that AI will make after
             our best move
+            max_time: float. Seconds to search, None for no time limit.
+            max_nodes: int. Nodes to add to the tree, None for no limit.
+            early_stop: bool. Whether to stop when the most visited move can't
+            be overtaken in the remaining budget.
+            max_playouts: int. Random playouts to run, None for no limit.
+        Returns:
+            str. UCI encoded best move or, if `ai_move`, tuple with it and the
+            reply of the opponent expected by the tree.
         """
+        self.stop_pondering()
+        budget = SearchBudget(max_iters, max_time, max_nodes, early_stop, max_playouts)
+        stats = SearchStats()
+        if self.num_processes > 1:
+            moves, visits = self._root_parallel_search(agent, budget, verbose, stats)
+        else:
+            self._tree_search(agent, budget, verbose, stats)
+            moves = [self._child_moves(c) for c in self.root.children]
+            visits = [c.visits for c in self.root.children]
+        self.last_search = budget.report()
+        self.last_stats = stats
+        if verbose:
+            print(f"Search budget used: {self.last_search}")
+            print(f"Search stats: {stats.to_json()}")
 
-        # with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
-        #     for _ in range(max_iters):
-        #         print("Iteration: ", _)
-        #         executor.submit(self.explore_tree, node=self.root, agent=agent, verbose=verbose)
+        best = Game.NULL_MOVE, Game.NULL_MOVE
+        if moves:
+            nb_moves = len(self.root.state)
+            policy = self._visits_policy(np.array(visits), 1 + sum(visits), nb_moves, noise=noise)
+            best = moves[np.argmax(policy)]
 
-        self.explore_tree(self.root, agent=agent, verbose=verbose)
+        if not ai_move:
+            return best[0]
+        return best
 
-        #print("Root visits:", self.root.visits)  # Print the number of visits of the root node
-        #print("Root children:", len(self.root.children))  # Print the number of children of the root node
+    def _tree_search(self, agent, budget, verbose=False, stats=None, node=None):
+        """ Runs iterations over this tree (or the subtree of a node) using the
+        threads until the budget is exhausted, collecting their statistics in
+        `stats`.
+        """
+        self.budget = budget
+        self.stats = stats
+        budget.start()
+        if stats is not None:
+            stats.start()
+        try:
+            if self.num_threads <= 1:
+                self._search_worker(agent, budget, verbose, node)
+                return
+
+            with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+                futures = [executor.submit(self._search_worker, agent, budget, verbose, node)
+                           for _ in range(self.num_threads)]
+                for future in futures:
+                    future.result()  # Raise the errors of the threads
+        finally:
+            self.budget = None
+            self.stats = None
+            budget.finish()
+            if stats is not None:
+                stats.finish(self.size, self.nbytes)
+
+    def _search_worker(self, agent, budget, verbose=False, node=None):
+        # The subtrees are searched without pruning, which could remove them
+        capped = node is None and (self.node_cap is not None or self.memory_cap is not None)
+        if capped:
+            self._prune_if_needed()
+        while budget.next_iteration(self.root if node is None else node):
+            start = timer()
+            if capped:
+                self._enter_iteration()
+            try:
+                self.explore_tree(self.root if node is None else node, agent=agent, verbose=verbose)
+            finally:
+                if capped:
+                    self._exit_iteration()
+                budget.end_iteration(timer() - start)
+            if capped:
+                self._prune_if_needed()
+
+    def _enter_iteration(self):
+        with self._prune_gate:
+            while self._pruning:
+                self._prune_gate.wait()
+            self._running += 1
+
+    def _exit_iteration(self):
+        with self._prune_gate:
+            self._running -= 1
+            self._prune_gate.notify_all()
+
+    def _prune_if_needed(self):
+        """ Prunes the tree if it exceeds a cap, once no iteration is running
+        (the other threads wait for it before starting a new one).
+        """
+        if not self._over_cap(*self._usage()):
+            return
+        with self._prune_gate:
+            if self._pruning:
+                return  # Another thread is pruning
+            self._pruning = True
+            while self._running:
+                self._prune_gate.wait()
+        try:
+            if self._over_cap(*self._usage()):
+                self.prune()
+        finally:
+            with self._prune_gate:
+                self._pruning = False
+                self._prune_gate.notify_all()
+
+    def _usage(self):
+        """ Returns the nodes of the tree and the slots they take in memory
+        (the 'array' backend reserves all the children of a node at once).
+        """
+        if isinstance(self.root, ArrayNode):
+            return self.size, self.root.store.size
+        return self.size, self.size
+
+    def _over_cap(self, nodes, slots, ratio=1.):
+        if self.node_cap is not None and nodes > self.node_cap * ratio:
+            return True
+        return self.memory_cap is not None and slots * self._slot_bytes() > self.memory_cap * ratio
+
+    def _slot_bytes(self):
+        if isinstance(self.root, ArrayNode):
+            return NodeArrays.bytes_per_node()
+        return type(self.root).BYTES_PER_NODE
+
+    def prune(self):
+        """ Removes the subtrees of the least visited nodes until the tree is
+        within `prune_ratio` of its caps, so the search can go on for long at
+        a steady memory. The nodes below a collapsed node are removed, while
+        it keeps its statistics (which add up the removed ones) and can be
+        expanded again. Deeper nodes are collapsed first among equal visits.
+        The 'array' backend is compacted into new arrays afterwards.
+
+        It must not run concurrently with the iterations (see
+        `_prune_if_needed`).
 
-        policy = self.compute_policy(self.root, noise=noise)
-        #print("Policy:", policy)  # Print the computed policy vector
-        max_val = np.argmax(policy)
-        #print("Max value index:", max_val)  # Print the index of the maximum value in the policy vector
+        Returns:
+            int. Number of nodes removed.
+        """
+        nodes, slots = self._usage()
+        candidates = []
+        pending = [(self.root, 0)]
+        while pending:
+            node, depth = pending.pop()
+            children = node.children
+            if children and not node.is_root:
+                candidates.append((node.visits, -depth, len(candidates), node))
+            pending.extend((child, depth + 1) for child in children)
+        candidates.sort(key=lambda c: c[:3])
+
+        collapsed = set()
+        removed = 0
+        for *_, node in candidates:
+            if not self._over_cap(nodes, slots, self.prune_ratio):
+                break
+            if self._has_ancestor(node, collapsed):
+                continue  # Already removed
+            sub_nodes, sub_slots = self._subtree_usage(node)
+            node.collapse()
+            collapsed.add(node)
+            nodes -= sub_nodes
+            slots -= sub_slots
+            removed += sub_nodes
+
+        if isinstance(self.root, ArrayNode) and removed:
+            capacity = None
+            if self.memory_cap is not None:
+                capacity = max(self.memory_cap // self._slot_bytes(), slots)
+            self.root = self.root.store.extract(self.root.index, capacity=capacity).root
+        self.size = self.count_nodes(self.root)
+        self.pruned += removed
+        if self.stats is not None:
+            self.stats.add_pruned(removed)
+        return removed
+
+    @staticmethod
+    def _has_ancestor(node, ancestors):
+        node = node.parent
+        while node is not None:
+            if node in ancestors:
+                return True
+            node = node.parent
+        return False
+
+    @staticmethod
+    def _subtree_usage(node):
+        """ Nodes below a node and the slots they take (see `_usage`). """
+        array = isinstance(node, ArrayNode)
+        nodes, slots = 0, node.n_reserved if array else 0
+        pending = list(node.children)
+        while pending:
+            child = pending.pop()
+            nodes += 1
+            slots += child.n_reserved if array else 1
+            pending.extend(child.children)
+        return nodes, slots
+
+    def start_pondering(self, agent, node=None, max_iters=None, max_time=None, max_nodes=None):
+        """ Searches the subtree of a node (e.g. the child with the opponent
+        reply expected after our move) in a background thread, while the
+        opponent thinks, until `stop_pondering` is called or a limit is
+        reached. The tree must not be used meanwhile.
 
-        # After the last play the opponent has played, so we use the before last one
-        b_mov = Game.NULL_MOVE
+        Parameters:
+            agent: Agent. Plays the opponent replies of the new nodes.
+            node: Node. Root of the pondered subtree, the root by default.
+            max_iters, max_time, max_nodes: Limits of the pondering (see
+            `SearchBudget`), none by default.
+        """
+        self.stop_pondering()
+        if max_iters is None and max_time is None and max_nodes is None:
+            max_time = float('inf')  # Until stopped
+        budget = SearchBudget(max_iters, max_time, max_nodes)
+        executor = ThreadPoolExecutor(max_workers=1)
+        self._ponder = budget, executor.submit(self._tree_search, agent, budget, False, None, node)
+        executor.shutdown(wait=False)
+
+    @property
+    def is_pondering(self):
+        return self._ponder is not None
+
+    def stop_pondering(self):
+        """ Stops the pondering once its running iterations end, leaving
+        the budget it used in `last_ponder`.
 
-        # The agent move which will be made after the last one of ours.
-        agent_last_mov = Game.NULL_MOVE
+        Returns:
+            bool. Whether the tree was pondering.
+        """
+        if self._ponder is None:
+            return False
+        budget, future = self._ponder
+        self._ponder = None
+        budget.stop()
+        future.result()  # Raise the errors of the search
+        self.last_ponder = budget.report()
+        return True
+
+    def _root_parallel_search(self, agent, budget, verbose=False, stats=None):
+        """ Searches independent trees in a process pool and merges the visit
+        counts of their root children. The iterations and nodes of the budget
+        are split between the processes. Their statistics are added up in
+        `stats`.
 
-        try:
-            b_mov = self.root.children[max_val].state.board.move_stack[-2]
-            agent_last_mov = self.root.children[max_val] \
-                .state.board.move_stack[-1]
-        except IndexError:
-            # Should get here if it is not the agent's turn. For example, at
-            # the first turn if the agent plays blacks.
-            print("Exception")
-            pass
+        Returns:
+            moves: List[tuple]. Our move and the expected reply of each child.
+            visits: List[int]. Merged visits of each child.
+        """
+        seeds = np.random.randint(2 ** 31, size=self.num_processes)
+        root_state = self.root.state
+        # Every process fills its own table
+        tt_size = None if self.transpositions is None else self.transpositions.size
+
+        visits = {}
+        replies = {}
+        reports = []
+        budget.start()
+        if stats is not None:
+            stats.start()
+        with ProcessPoolExecutor(max_workers=self.num_processes) as executor:
+            futures = [executor.submit(_search_root_visits, root_state, agent, part, int(seed),
+                                       self.num_threads, self.backend, self.rollouts, tt_size,
+                                       self.selection, verbose, self.node_cap, self.memory_cap,
+                                       self.prune_ratio, self.widening, self.adaptive_rollouts,
+                                       self.rollout_moves, self.static_evaluator, self.endgame_tables)
+                       for part, seed in zip(budget.split(self.num_processes), seeds)]
+            for future in futures:
+                children, report, worker_stats = future.result()
+                reports.append(report)
+                if stats is not None:
+                    stats.merge(worker_stats)
+                for move, reply, v in children:
+                    visits[move] = visits.get(move, 0) + v
+                    # Keep the reply seen by the tree which visited it most
+                    if v > replies.get(move, ('', -1))[1]:
+                        replies[move] = reply, v
+        budget.merge(reports)
+        budget.finish()
+        if stats is not None:
+            stats.finish()
+
+        moves = [(m, replies[m][0]) for m in visits]
+        return moves, [visits[m] for m in visits]
+
+    def _child_moves(self, child):
+        """ Returns our move and the opponent reply (or the null move if the
+        game ended with ours) leading from the root to a child.
+        """
+        moves = child.moves + [Game.NULL_MOVE]
+        return moves[0], moves[1]
 
-        moves = str(b_mov), str(agent_last_mov)
-        #print("moves", moves)
+    def reroot(self, game: Game):
+        """ Moves the root of the tree to the node reached by the moves played
+        in the game since the root (pairs of our move and the opponent reply),
+        keeping its statistics. The rest of the tree is freed.
 
-        if not ai_move:
-            #print("ai")
-            moves = str(agent_last_mov)
-        return moves
+        Parameters:
+            game: Game. Current game, which must have started from the root.
+        Returns:
+            bool. Whether the game position is in the tree.
+        """
+        self.stop_pondering()
+        # The root state may keep only its last moves (a light copy)
+        root_state = self.root.state
+        root_moves = root_state.board.move_stack
+        played = game.moves_since(len(root_state) - len(root_moves))
+        if played is None or played[:len(root_moves)] != root_moves:
+            return False
+
+        node = self.root
+        remaining = [m.uci() for m in played[len(root_moves):]]
+        while remaining:
+            matching = [c for c in node.children if c.moves == remaining[:2]]
+            if not matching:
+                return False
+            node = matching[0]
+            remaining = remaining[2:]
+
+        if node is not self.root and isinstance(node, ArrayNode):
+            # Compact the subtree into new arrays
+            node = node.store.extract(node.index).root
+        elif node is not self.root:
+            self.root.children = []
+            if isinstance(node, MoveNode):
+                node.detach()  # It keeps the root state
+            node.parent = None
+        self.root = node
+        self.size = self.count_nodes(node)
+        return True
 
     def explore_tree(self, node, agent, verbose=False):
-        agent_copy = agent.get_copy()
-
-        # agent_copy.connect()
         start = timer()
-        current_node = self.select(node, agent)
+        state = self._walk_state(node)
+        depth = None if state is None else len(state)
+        current_node = self.select(node, agent, state)
+        selected = timer()
+        v = self.simulate(current_node, agent, state)
+        simulated = timer()
+        self.backprop(current_node, v, remove_vloss=True, start=node)
         end = timer()
-        v = self.simulate(current_node, agent)
-        self.backprop(current_node, v, remove_vloss=True)
-
-        # agent_copy.disconnect()
-
+        if state is not None:
+            # Back to the node for the next iteration
+            while len(state) > depth:
+                state.pop()
+
+        if self.stats is not None:
+            self.stats.record_iteration(self._depth(current_node, node), selected - start,
+                                        simulated - selected, end - simulated)
         elap = round(end - start, 2)
         if verbose:
             print(f"Elapsed on iteration: {elap} secs")
 
-    def select(self, node, agent):
+    @staticmethod
+    def _depth(node, ancestor):
+        depth = 0
+        while node != ancestor and node.parent is not None:
+            node = node.parent
+            depth += 1
+        return depth
+
+    def _locked(self, node):
+        """ Lock of a node, counting its contention in the search statistics. """
+        if self.stats is None:
+            return node.lock
+        return self.stats.locked(node.lock)
+
+    def _walk_state(self, node):
+        """ Returns the game walked by the iterations of this thread from the
+        node, None for the nodes holding their own game (`Node`).
+
+        The nodes storing only moves (`ArrayNode`, `MoveNode`) don't copy a
+        game per node: `select` pushes the moves of the path onto a single
+        game per thread, which `explore_tree` pops after each iteration.
+        """
+        if isinstance(node, Node):
+            return None
+        walk = self._walks
+        if getattr(walk, 'node', None) != node:
+            walk.node, walk.state = node, node.state
+        return walk.state
+
+    def select(self, node, agent, state=None):
+        """ Descends from the node to a new expanded child (or a terminal
+        state) adding virtual loss to the nodes of the path, so concurrent
+        iterations prefer other paths until `backprop` removes it.
+
+        Parameters:
+            node: Node. Node where the descent starts.
+            agent: Agent. Plays the opponent replies of the new child.
+            state: Game. Game of the node for the nodes without one (see
+            `_walk_state`), the moves of the path are pushed onto it.
+        """
         current_node = node
+        with self._locked(current_node):
+            current_node.vloss += VIRTUAL_LOSS
+
         while not current_node.is_terminal_state:
-            if not current_node.is_fully_expanded:
-                current_node = self.expand(current_node, agent=agent)
+            if state is not None:
+                current_node.generate_actions(state)
+            if not current_node.is_fully_expanded and self._can_widen(current_node):
+                new_node = self.expand(current_node, agent=agent, state=state)
+                if new_node is not None:
+                    current_node = new_node
+                    with self._locked(current_node):
+                        current_node.vloss += VIRTUAL_LOSS
+                    break
+            if current_node.is_leaf:
+                # Other threads are still expanding its children
                 break
-            else:
-                current_node = current_node.get_best_child()
-
-        # Wait if game is not updated yet
-        with current_node.lock:
-            current_node.vloss += VIRTUAL_LOSS
+            if self.transpositions is not None:
+                self._share_statistics(current_node)
+            if self.evaluator is not None:
+                self._update_prior(current_node, state)
+            current_node = current_node.get_best_child(ucb1=self.selection == 'ucb1')
+            if state is not None:
+                current_node.push_moves(state)
+            with self._locked(current_node):
+                current_node.vloss += VIRTUAL_LOSS
+            if self._in_tables(current_node, state):
+                break  # Scored exactly by `simulate`
 
         return current_node
 
-    def expand(self, node, agent=None):
+    def _in_tables(self, node, state=None):
+        """ Whether the position of a node is in the endgame tables. """
+        if self.endgame_tables is None:
+            return False
+        return self.endgame_tables.covers((node.state if state is None else state).board)
+
+    def _can_widen(self, node):
+        """ Whether a new child of the node can be expanded (see
+        `ProgressiveWidening`).
+        """
+        if self.widening is None:
+            return True
+        return len(node.children) < self.widening.max_children(node.visits)
+
+    def _order_actions(self, node, state=None):
+        """ Sorts the actions of a node before its first expansion, so the most
+        promising ones are expanded first (see `ProgressiveWidening.scores`).
+        """
+        game = node.state if state is None else state
+        priors = None
+        if self.widening.order == 'prior' and self.evaluator is not None:
+            priors, _ = self.evaluator.evaluate(game)
+        node.order_actions(self.widening.scores(game.board, priors))
+
+    def expand(self, node, agent=None, state=None):
         """
         From a given state (node), adds to itself all its children
         (game states after all the possible legal game moves are applied).
@@ -115,46 +587,75 @@ class SelfPlayTree(Tree):
         Parameters:
             node: Node. Node which will be expanded.
             agent: Agent. that will be used to play the games.
+            state: Game. Game of the node to push the moves onto, instead of
+            copying the game of the node.
+        Returns:
+            new_child: Node. The new child, None if other threads already
+            expanded all the actions of the node.
         """
-        new_state = node.state.get_copy()
-        new_state.move(node.pop_unexpanded_action())
+        start = timer()
+        if self.widening is not None and node.is_leaf:
+            self._order_actions(node, state)
+        try:
+            action = node.pop_unexpanded_action()
+        except IndexError:
+            return None
+
+        new_state = node.state.get_copy(history=Game.HISTORY) if state is None else state
+        new_state.move(action, trusted=True)
         # Move opponent
         if new_state.get_result() is None:
             bm = agent.best_move(new_state)
             new_state.move(bm)
 
-        new_child = Node(new_state, parent=node)
-        node.children.append(new_child)
-
-        # If this node was the last one before fully expand the node
-        # we calculate the priors of the children
-        # (only do it once)
-        #if node.is_fully_expanded:
-        #   self._update_prior(node, agent)
-
+        new_child = node.add_child(new_state)
+        with self._size_lock:
+            self.size += 1
+        if self.budget is not None:
+            self.budget.add_node()
+        if self.stats is not None:
+            self.stats.add_expansion(timer() - start)
         return new_child
 
-    def simulate(self, node: Node, agent: Agent):
+    def simulate(self, node: Node, agent: Agent, state=None):
         """ Rollout from the current node until a final state.
 
         Parameters:
             node: Node. Game state from which the simulation will be run.
             agent: Agent. that will be used to play the games.
+            state: Game. Game of the node, if it doesn't have one.
         Returns:
             results_sim: float, Result of the playout/predicted value from NN.
         """
-        result = node.state.get_result()
-
-        if result is None:
-            # result = agent.predict_outcome(node.state)
-
-            # Random sim
-            sim = RandomSimulation(node.state.get_copy())
-            result = sim.run(repetitions=500)
+        if state is None:
+            state = node.state
+        result = state.get_result()
+        if result is None and self.endgame_tables is not None:
+            result = self.endgame_tables.value(state.board)
+            if result is not None and self.stats is not None:
+                self.stats.add_table_hit()
+
+        if result is None and self.evaluator is not None:
+            _, result = self.evaluator.evaluate(state)
+        elif result is None and self.adaptive_rollouts is not None:
+            limit = None if self.budget is None else self.budget.remaining_playouts()
+            result, playouts = self.adaptive_rollouts.run(state, limit, self.rollout_moves, self.static_evaluator)
+            self._count_playouts(playouts)
+        elif result is None:
+            # Random sims, played in bulk
+            sim = BatchRandomSimulation(state)
+            result, _ = sim.run(self.rollout_moves, self.rollouts, self.static_evaluator)
+            self._count_playouts(self.rollouts)
 
         return result
 
-    def backprop(self, node: Node, value: float, remove_vloss=False):
+    def _count_playouts(self, n):
+        if self.budget is not None:
+            self.budget.add_playouts(n)
+        if self.stats is not None:
+            self.stats.add_playouts(n, saved=self.rollouts - n)
+
+    def backprop(self, node: Node, value: float, remove_vloss=False, child_visits=0, start=None):
         """ Backpropagation phase of the algorithm.
 
         Parameters:
@@ -162,39 +663,109 @@ class SelfPlayTree(Tree):
                 the simulation process.
             value: float, value that will be added to all the ancestors
                 until root.
-            remove_vloss: Remove virtual loss from the parent nodes to allow
-                the exploration of the same path by other threads
+            remove_vloss: Remove virtual loss from the node and its ancestors
+                to allow the exploration of the same path by other threads
+            child_visits: int. Visits gained by the child of the node in the
+                path, added to the sum of visits of its children.
+            start: Node. Node where the selection started (e.g. the expected
+                child while pondering), the last one whose virtual loss is
+                removed: `select` added none to its ancestors. The root if None.
         """
-        with node.lock:
-            node.visits += 1
-            node.value += value
+        with self._locked(node):
+            visits = node.visits
+            if self.transpositions is None:
+                node.visits += 1
+                node.value += value
+            else:
+                node.visits, node.value = self.transpositions.backup(node.key, value, node.visits, node.value)
+            node.children_visits += child_visits
             if remove_vloss:
                 node.vloss -= VIRTUAL_LOSS
+            gained = node.visits - visits
 
         if node.parent is not None:
-            self.backprop(node.parent, value)
+            self.backprop(node.parent, value, remove_vloss=remove_vloss and node is not start,
+                          child_visits=gained, start=start)
 
-    def _update_prior(self, node, agent):
-        """ Update the priors of the children nodes """
-        priors = agent.predict_policy(node.state, mask_legal_moves=True)
-        children = reversed(node.children)
-        for p, n in zip(priors, children):
-            n.prior = p
+    def _share_statistics(self, node):
+        """ Updates the statistics of the children of a node with the ones of
+        their positions in the transposition table, if they have more visits
+        (collected through other move orders).
+        """
+        children = node.children
+        visits = np.array([c.visits for c in children])
+        shared, value = self.transpositions.lookup([c.key for c in children], visits)
+        gained = 0
+        for i in np.flatnonzero(shared > visits):
+            with self._locked(children[i]):
+                if shared[i] > children[i].visits:
+                    gained += int(shared[i]) - children[i].visits
+                    children[i].visits, children[i].value = int(shared[i]), float(value[i])
+        if gained:
+            with self._locked(node):
+                node.children_visits += gained
+
+    def _update_prior(self, node, state=None):
+        """ Sets the priors of the children of a node with the policy of the
+        evaluator, once they are expanded (the selection only compares the
+        children of fully expanded nodes). Children added later by other
+        threads get theirs in the next selection.
+        """
+        children = node.children
+        if node.n_priors >= len(children):
+            return
+        priors, _ = self.evaluator.evaluate(node.state if state is None else state)
+        with self._locked(node):
+            for child in children:
+                child.prior = priors.get(child.moves[0], 0.)
+            node.n_priors = max(node.n_priors, len(children))
 
     def compute_policy(self, node: Node, noise=True):
         """ Calculates the policy vector given a game state """
+        nb_moves = len(node.state)
+        visits = np.array([c.visits for c in node.children])
+        return self._visits_policy(visits, node.visits, nb_moves, noise=noise)
+
+    @staticmethod
+    def _visits_policy(visits, total_visits, nb_moves, noise=True):
+        """ Policy vector proportional to the visit counts of the children
+        (see `compute_policy`).
+        """
         # Select tau = 1 -> 0 (if number of moves > 30)
-        nb_moves = len(node.state.board.move_stack)
         tau = 1
         if nb_moves >= 30:
             tau = nb_moves / (1 + np.power(nb_moves, 1.3))
 
         # Select argmax π(a|node) proportional to the visit count
-        policy = np.array([np.power(v.visits, 1 / tau)
-                           for v in node.children]) / np.power(node.visits, 1 / tau)
+        policy = np.power(visits, 1 / tau) / np.power(total_visits, 1 / tau)
 
         # apply random noise for ensuring exploration
         if noise:
             epsilon = 0.25
-            policy = (1 - epsilon) * policy + np.random.dirichlet([0.03] * len(node.children))
+            policy = (1 - epsilon) * policy + np.random.dirichlet([0.03] * len(visits))
         return policy
+
+
+def _search_root_visits(root_state, agent, budget, seed, threads=1, backend='object', rollouts=500,
+                        transpositions=None, selection='puct', verbose=False, node_cap=None,
+                        memory_cap=None, prune_ratio=0.8, widening=None, adaptive_rollouts=None,
+                        rollout_moves=100, static_evaluator=None, endgame_tables=None):
+    """ Searches a new tree from the root state in a worker process.
+
+    Returns:
+        children: List[tuple]. Our move, the expected reply and the visits
+        of each child of the root.
+        report: dict. Budget used by the search (see `SearchBudget.report`).
+        stats: dict. Statistics of the search (see `SearchStats.as_dict`).
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    tree = SelfPlayTree(root_state, threads=threads, backend=backend, rollouts=rollouts,
+                        transpositions=transpositions, selection=selection, node_cap=node_cap,
+                        memory_cap=memory_cap, prune_ratio=prune_ratio, widening=widening,
+                        adaptive_rollouts=adaptive_rollouts, rollout_moves=rollout_moves,
+                        static_evaluator=static_evaluator, endgame_tables=endgame_tables)
+    stats = SearchStats()
+    tree._tree_search(agent, budget, verbose, stats)
+    children = [tree._child_moves(c) + (c.visits,) for c in tree.root.children]
+    return children, budget.report(), stats.as_dict()
@@ -1,5 +1,7 @@
 from src.envs.game import Game
+from src.envs.batch_board import BatchBoard, ONGOING
 
+import math
 import random
 import numpy as np
 
@@ -13,24 +15,128 @@ class RandomSimulation(object):
         """
         self.game = game
 
-    def run(self, max_moves=100, repetitions=1):
-        """ Runs the game simulation for max_moves """
+    def run(self, max_moves=100, repetitions=1, evaluator=None):
+        """ Runs the game simulation for max_moves. The unfinished games are
+        scored by the evaluator (a `StaticEvaluator`) or as a draw.
+        """
         results = []
         for i in range(repetitions):
+            # Every repetition starts from the initial state
+            game = self.game.get_copy(history=Game.HISTORY)
             n_mov = 0
             # While the game is not finished and the nb of moves is low
-            while n_mov < max_moves and self.game.get_result() is None:
-                legal_moves = self.game.get_legal_moves()
+            while n_mov < max_moves and game.get_result() is None:
+                legal_moves = game.get_legal_moves()
                 if legal_moves:
-                    self.game.move(random.choice(legal_moves))
+                    game.move(random.choice(legal_moves), trusted=True)
                     n_mov += 1
                 else:
                     break  # No legal moves available, exit the loop
 
-            result = self.game.get_result()
+            result = game.get_result()
             if result is not None:
                 results.append(result)
+            elif evaluator is not None and any(game.board.legal_moves):
+                results.append(evaluator.evaluate_board(game.board))
             else:
                 results.append(0)  # Draw
 
         return np.mean(results)
+
+
+class BatchRandomSimulation(object):
+    """ Random playouts from the same game played in bulk: all the
+    repetitions advance together as a `BatchBoard`, with bitboard move
+    generation and no UCI strings. The playouts follow the rules of
+    `RandomSimulation` (uniform legal moves, unfinished games are a draw or
+    scored by an evaluator). The playouts end on a threefold repetition of
+    their own positions.
+    """
+
+    def __init__(self, game: Game):
+        """ Parameters:
+                game: Game. The game to simulate.
+        """
+        self.game = game
+
+    def run(self, max_moves=100, repetitions=500, evaluator=None):
+        """ Runs the playouts for max_moves.
+
+        Parameters:
+            max_moves: int. Moves of each playout.
+            repetitions: int. Number of playouts.
+            evaluator: StaticEvaluator. Scores the playouts unfinished after
+            max_moves, None to score them as a draw.
+        Returns:
+            mean: float. Mean result of the playouts (for the white pieces).
+            var: float. Variance of the results.
+        """
+        results = self.playouts(max_moves, repetitions, evaluator)
+        return results.mean(), results.var()
+
+    def playouts(self, max_moves=100, repetitions=500, evaluator=None):
+        """ Returns the result of each playout (see `run`). """
+        boards = BatchBoard.from_board(self.game.board, repetitions, track_repetitions=True)
+        results = np.zeros(repetitions)
+        active = np.arange(repetitions)
+
+        for n_mov in range(max_moves + 1):
+            moves, status, blocked = boards.random_moves(active)
+            over = (status != ONGOING) | blocked
+            results[active[over]] = np.where(blocked[over], 0, status[over])
+            active = active[~over]
+            if n_mov == max_moves or len(active) == 0:
+                if evaluator is not None and len(active):
+                    results[active] = evaluator.evaluate(boards, active)
+                break
+            boards.push(active, moves.from_square, moves.to_square, moves.promotion)
+
+        return results
+
+
+class AdaptiveRollouts(object):
+    """ Number of random playouts adapted to each leaf. A first batch of
+    `min_rollouts` playouts estimates the variance of the result, which
+    gives the playouts needed for the confidence interval of the mean to be
+    within `tolerance`; they are run in a second batch (and so on, up to
+    `max_rollouts`). Clear positions (e.g. a forced result, where every
+    playout ends the same) stop after the first batch, uncertain ones get
+    more playouts than a fixed count.
+
+    Parameters:
+        min_rollouts: int. Playouts of the first batch.
+        max_rollouts: int. Max. playouts of a leaf.
+        tolerance: float. Half width of the confidence interval of the mean
+        result to stop at.
+        z: float. Normal quantile of the confidence interval (1.96 for 95%).
+    """
+
+    def __init__(self, min_rollouts=32, max_rollouts=1000, tolerance=0.05, z=1.96):
+        self.min_rollouts = min_rollouts
+        self.max_rollouts = max_rollouts
+        self.tolerance = tolerance
+        self.z = z
+
+    def run(self, game: Game, limit=None, max_moves=100, evaluator=None):
+        """ Runs the playouts of a leaf.
+
+        Parameters:
+            game: Game. Position of the leaf.
+            limit: int. Max. playouts left in the budget of the search, None
+            for no limit (at least one playout is always run).
+            max_moves, evaluator: See `BatchRandomSimulation.run`.
+        Returns:
+            mean: float. Mean result of the playouts (for the white pieces).
+            n: int. Number of playouts run.
+        """
+        cap = self.max_rollouts if limit is None else max(min(self.max_rollouts, limit), 1)
+        sim = BatchRandomSimulation(game)
+        results = sim.playouts(max_moves, min(self.min_rollouts, cap), evaluator)
+        while len(results) < cap:
+            std, n = results.std(), len(results)
+            if self.z * std / math.sqrt(n) <= self.tolerance:
+                break
+            needed = math.ceil((self.z * std / self.tolerance) ** 2)
+            extra = min(max(needed - n, self.min_rollouts), cap - n)
+            results = np.concatenate([results, sim.playouts(max_moves, extra, evaluator)])
+        return results.mean(), len(results)
@@ -0,0 +1,126 @@
+import numpy as np
+import chess
+
+from src.envs.batch_board import BatchBoard, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+
+# Centipawns of each piece (indexed as the `BatchBoard` arrays)
+PIECE_VALUES = np.array([100, 320, 330, 500, 900, 0])
+
+# Piece-square tables for the white pieces, from the rank 8 (first row) to
+# the rank 1 (Simplified Evaluation Function by Tomasz Michniewski)
+_TABLES = {
+    PAWN: [[0, 0, 0, 0, 0, 0, 0, 0],
+           [50, 50, 50, 50, 50, 50, 50, 50],
+           [10, 10, 20, 30, 30, 20, 10, 10],
+           [5, 5, 10, 25, 25, 10, 5, 5],
+           [0, 0, 0, 20, 20, 0, 0, 0],
+           [5, -5, -10, 0, 0, -10, -5, 5],
+           [5, 10, 10, -20, -20, 10, 10, 5],
+           [0, 0, 0, 0, 0, 0, 0, 0]],
+    KNIGHT: [[-50, -40, -30, -30, -30, -30, -40, -50],
+             [-40, -20, 0, 0, 0, 0, -20, -40],
+             [-30, 0, 10, 15, 15, 10, 0, -30],
+             [-30, 5, 15, 20, 20, 15, 5, -30],
+             [-30, 0, 15, 20, 20, 15, 0, -30],
+             [-30, 5, 10, 15, 15, 10, 5, -30],
+             [-40, -20, 0, 5, 5, 0, -20, -40],
+             [-50, -40, -30, -30, -30, -30, -40, -50]],
+    BISHOP: [[-20, -10, -10, -10, -10, -10, -10, -20],
+             [-10, 0, 0, 0, 0, 0, 0, -10],
+             [-10, 0, 5, 10, 10, 5, 0, -10],
+             [-10, 5, 5, 10, 10, 5, 5, -10],
+             [-10, 0, 10, 10, 10, 10, 0, -10],
+             [-10, 10, 10, 10, 10, 10, 10, -10],
+             [-10, 5, 0, 0, 0, 0, 5, -10],
+             [-20, -10, -10, -10, -10, -10, -10, -20]],
+    ROOK: [[0, 0, 0, 0, 0, 0, 0, 0],
+           [5, 10, 10, 10, 10, 10, 10, 5],
+           [-5, 0, 0, 0, 0, 0, 0, -5],
+           [-5, 0, 0, 0, 0, 0, 0, -5],
+           [-5, 0, 0, 0, 0, 0, 0, -5],
+           [-5, 0, 0, 0, 0, 0, 0, -5],
+           [-5, 0, 0, 0, 0, 0, 0, -5],
+           [0, 0, 0, 5, 5, 0, 0, 0]],
+    QUEEN: [[-20, -10, -10, -5, -5, -10, -10, -20],
+            [-10, 0, 0, 0, 0, 0, 0, -10],
+            [-10, 0, 5, 5, 5, 5, 0, -10],
+            [-5, 0, 5, 5, 5, 5, 0, -5],
+            [0, 0, 5, 5, 5, 5, 0, -5],
+            [-10, 5, 5, 5, 5, 5, 0, -10],
+            [-10, 0, 5, 0, 0, 0, 0, -10],
+            [-20, -10, -10, -5, -5, -10, -10, -20]],
+    KING: [[-30, -40, -40, -50, -50, -40, -40, -30],
+           [-30, -40, -40, -50, -50, -40, -40, -30],
+           [-30, -40, -40, -50, -50, -40, -40, -30],
+           [-30, -40, -40, -50, -50, -40, -40, -30],
+           [-20, -30, -30, -40, -40, -30, -30, -20],
+           [-10, -20, -20, -20, -20, -20, -20, -10],
+           [20, 20, 0, 0, 0, 0, 20, 20],
+           [20, 30, 10, 0, 0, 10, 30, 20]],
+}
+
+
+def _square_tables():
+    """ Centipawns of each color (black = 0, white = 1), piece and square
+    (a1 = 0), negative for the black pieces.
+    """
+    tables = np.zeros((2, 6, 64))
+    for piece, rows in _TABLES.items():
+        white = np.array(rows[::-1]).reshape(64) + PIECE_VALUES[piece]
+        tables[1, piece] = white
+        tables[0, piece] = -white[np.arange(64) ^ 56]  # Mirrored ranks
+    return tables
+
+
+class StaticEvaluator:
+    """ Fast static evaluation of positions stored in a `BatchBoard`:
+    material, piece-square tables and mobility (pseudo-legal moves of the
+    side to move minus the ones of the other side), computed for the whole
+    batch from the bitboards. It scores the unfinished random playouts (see
+    `BatchRandomSimulation`), so they can be short and still give a signal.
+
+    The score in centipawns (for the white pieces) is mapped to a value in
+    (-1, 1) with -tanh(score / scale), the sign of the results it is mixed
+    with (`Game.get_result`, `BatchBoard.results`): 1 is a mate of the white
+    pieces, so the value is positive when the black pieces are ahead.
+
+    Parameters:
+        mobility: float. Centipawns of each move of difference in mobility.
+        scale: float. Centipawns of a value of tanh(1) ~ 0.76.
+    """
+
+    TABLES = _square_tables()
+
+    def __init__(self, mobility=5., scale=600.):
+        self.mobility = mobility
+        self.scale = scale
+
+    def scores(self, boards: BatchBoard, rows=None):
+        """ Returns the centipawns of each board for the white pieces. """
+        rows = boards._rows(rows)
+        pieces = boards.pieces[rows].astype('<u8')
+        # Bit s of each bitboard is the square s
+        bits = np.unpackbits(pieces.view(np.uint8), bitorder='little').reshape(len(rows), 2, 6, 64)
+        score = np.einsum('ncps,cps->n', bits, self.TABLES)
+        if self.mobility:
+            score += self.mobility * self._mobility(boards, rows)
+        return score
+
+    def _mobility(self, boards, rows):
+        """ Pseudo-legal moves of the white pieces minus the black ones. """
+        ours = np.bincount(boards._pseudo_legal_moves(rows)[0].row, minlength=len(rows))
+        flipped = boards.take(rows)
+        flipped.turn = ~flipped.turn
+        flipped.ep_square[:] = -1
+        theirs = np.bincount(flipped._pseudo_legal_moves(np.arange(len(rows)))[0].row, minlength=len(rows))
+        return np.where(boards.turn[rows], 1, -1) * (ours - theirs)
+
+    def evaluate(self, boards: BatchBoard, rows=None):
+        """ Returns the value of each board in (-1, 1), with the sign of
+        `Game.get_result` (positive when the black pieces are ahead).
+        """
+        return -np.tanh(self.scores(boards, rows) / self.scale)
+
+    def evaluate_board(self, board: chess.Board):
+        """ Value of a single python-chess board (see `evaluate`). """
+        return float(self.evaluate(BatchBoard([board]))[0])
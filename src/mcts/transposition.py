@@ -0,0 +1,156 @@
+import numpy as np
+import chess.polyglot
+from threading import Lock
+
+
+def position_key(board) -> int:
+    """ Zobrist hash (Polyglot keys) of the position of a chess.Board. Move
+    orders reaching the same pieces, side to move, castling rights and en
+    passant square get the same key.
+    """
+    return chess.polyglot.zobrist_hash(board)
+
+
+class TranspositionTable:
+    """ Bounded table of node statistics (visits and accumulated value)
+    shared by all the nodes of the search reaching the same position, so a
+    transposed position reuses the work done under another parent.
+
+    The table is an array of buckets indexed by the low bits of the Zobrist
+    key. Each bucket has two entries, the full key is stored to tell apart
+    positions sharing a bucket:
+        - the first entry keeps the most visited position of the bucket,
+        - the second one is always replaced by a new position. Before it is
+        replaced, its position moves to the first entry if it has more
+        visits (two-tier replacement). The evicted position starts again
+        from the statistics of its node if it's backpropagated again.
+
+    Parameters:
+        size: int. Max. number of positions (rounded up to a power of two).
+
+    Attributes:
+        lookups: int. Positions looked up in the table (including backups).
+        hits: int. Lookups of positions found in the table.
+        collisions: int. Lookups which found their bucket holding other
+        positions only.
+        evictions: int. Positions replaced by others.
+        shared_visits: int. Visits adopted by nodes from other nodes reaching
+        the same position.
+    """
+
+    def __init__(self, size=2 ** 16):
+        n_buckets = 1 << max(int(np.ceil(np.log2(max(size, 2)))) - 1, 0)
+        self.mask = np.uint64(n_buckets - 1)
+        self.keys = np.zeros((n_buckets, 2), dtype=np.uint64)
+        self.visits = np.zeros((n_buckets, 2), dtype=np.int64)
+        self.value = np.zeros((n_buckets, 2), dtype=np.float64)
+        self.lock = Lock()
+        self.clear_stats()
+
+    @property
+    def size(self):
+        """ Max. number of positions of the table. """
+        return self.keys.size
+
+    def __len__(self):
+        return int(np.count_nonzero(self.visits))
+
+    def clear_stats(self):
+        self.lookups = 0
+        self.hits = 0
+        self.collisions = 0
+        self.evictions = 0
+        self.shared_visits = 0
+
+    def lookup(self, keys, visits=None):
+        """ Finds the statistics of some positions.
+
+        Parameters:
+            keys: array. Zobrist keys of the positions.
+            visits: array. Visits of the nodes of the positions, to count the
+            visits they gain from the table (`shared_visits`).
+        Returns:
+            visits: np.array. Visits of each position, 0 if not in the table.
+            value: np.array. Accumulated value of each position.
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        with self.lock:
+            buckets = (keys & self.mask).astype(np.intp)
+            stored = self.keys[buckets]
+            occupied = self.visits[buckets] > 0
+            found = (stored == keys[:, None]) & occupied
+            hit = found.any(axis=1)
+            self.lookups += len(keys)
+            self.hits += int(hit.sum())
+            self.collisions += int((~hit & occupied.any(axis=1)).sum())
+            slot = np.argmax(found, axis=1)
+            shared = np.where(hit, self.visits[buckets, slot], 0)
+            value = np.where(hit, self.value[buckets, slot], 0.)
+            if visits is not None:
+                self.shared_visits += int(np.maximum(shared - visits, 0).sum())
+        return shared, value
+
+    def backup(self, key, value, visits=0, total=0.):
+        """ Adds a visit with the value to a position. A position not in the
+        table, or with less visits than the node, is stored starting from the
+        statistics of the node (which may have been collected before the
+        position was evicted).
+
+        Parameters:
+            key: int. Zobrist key of the position.
+            value: float. Value of the visit.
+            visits: int. Visits of the node before this one.
+            total: float. Accumulated value of the node before this one.
+        Returns:
+            visits: int. Visits of the position after the backup.
+            total: float. Accumulated value of the position.
+        """
+        key = np.uint64(key)
+        bucket = int(key & self.mask)
+        with self.lock:
+            keys, counts = self.keys[bucket], self.visits[bucket]
+            found = np.flatnonzero((keys == key) & (counts > 0))
+            self.lookups += 1
+            self.hits += len(found)
+            self.collisions += int(not len(found) and counts.any())
+            if len(found):
+                slot = found[0]
+                self.shared_visits += max(int(counts[slot]) - visits, 0)
+                stale = counts[slot] < visits  # Made again after an eviction
+            else:
+                slot = self._replace(bucket)
+                self.keys[bucket, slot] = key
+                stale = True
+            if stale:
+                self.visits[bucket, slot] = visits
+                self.value[bucket, slot] = total
+            self.visits[bucket, slot] += 1
+            self.value[bucket, slot] += value
+            return int(self.visits[bucket, slot]), float(self.value[bucket, slot])
+
+    def _replace(self, bucket):
+        """ Returns the entry of the bucket for a new position (two-tier). """
+        visits = self.visits[bucket]
+        if visits[0] == 0 or visits[1] == 0:
+            return 0 if visits[0] == 0 else 1
+        self.evictions += 1
+        if visits[1] > visits[0]:
+            # Keep the most visited position in the first entry
+            self.keys[bucket, 0] = self.keys[bucket, 1]
+            self.visits[bucket, 0] = self.visits[bucket, 1]
+            self.value[bucket, 0] = self.value[bucket, 1]
+        return 1
+
+    def stats(self):
+        """ Returns a dict with the usage of the table. """
+        return {
+            'size': self.size,
+            'entries': len(self),
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'hit_rate': self.hits / max(self.lookups, 1),
+            'collisions': self.collisions,
+            'collision_rate': self.collisions / max(self.lookups, 1),
+            'evictions': self.evictions,
+            'shared_visits': self.shared_visits,
+        }
@@ -1,5 +1,8 @@
 from src.agents.agent import Agent
+from src.envs.game import Game
 from src.mcts.node import Node
+from src.mcts.array_tree import NodeArrays, ArrayNode
+from src.mcts.move_node import MoveNode
 
 VIRTUAL_LOSS = 1
 
@@ -10,15 +13,56 @@ class Tree:
     Parameters:
         root: Node or Game. Root state of the tree. You can pass a Node object
         with a Game as state or directly the game (it will make the Node).
+        backend: str. How the nodes are stored when the root is a Game:
+            'object': one `Node` object per node, each with its own Game.
+            'array': `NodeArrays`, preallocated NumPy arrays holding only the
+            statistics and move codes of the nodes (predictable memory).
+            'move': one lightweight `MoveNode` per node, storing only its move
+            and, once expanded, the codes of its legal moves.
+        capacity: int. Initial number of nodes of the 'array' backend (the
+        arrays are grown when needed).
     """
 
-    def __init__(self, root):
-        if type(root) is Node:
+    BACKENDS = ('object', 'array', 'move')
+
+    def __init__(self, root, backend='object', capacity=4096):
+        if backend not in self.BACKENDS:
+            raise ValueError(f'Unknown tree backend: {backend}')
+
+        if type(root) in (Node, ArrayNode, MoveNode):
             self.root = root
+        elif backend == 'array':
+            self.root = NodeArrays(root.get_copy(history=Game.HISTORY), capacity=capacity).root
+        elif backend == 'move':
+            self.root = MoveNode(root)
         else:
-            self.root = Node(root.get_copy())
+            self.root = Node(root.get_copy(history=Game.HISTORY))
 
         self.root.visits = 1
+        self.size = self.count_nodes(self.root)
+
+    @staticmethod
+    def count_nodes(root):
+        """ Returns the number of expanded nodes of the subtree of a node (of
+        all the arrays for the 'array' backend).
+        """
+        if isinstance(root, ArrayNode):
+            return 1 + int(root.store.n_expanded[:root.store.size].sum())
+        size, pending = 0, [root]
+        while pending:
+            node = pending.pop()
+            size += 1
+            pending.extend(node.children)
+        return size
+
+    @property
+    def nbytes(self):
+        """ Memory used by the tree, estimated for the object backends (see
+        `BYTES_PER_NODE` of the node classes).
+        """
+        if isinstance(self.root, ArrayNode):
+            return self.root.store.nbytes
+        return self.size * type(self.root).BYTES_PER_NODE
 
     def search_move(self, agent, max_iters=200, verbose=False, noise=True, ai_move=False):
         """ Explores and selects the best next state to choose from the root
@@ -37,13 +81,13 @@ class Tree:
     def explore_tree(self, node, agent, verbose=False):
         pass
 
-    def select(self, node, agent):
+    def select(self, node, agent, state=None):
         pass
 
-    def expand(self, node, agent=None):
+    def expand(self, node, agent=None, state=None):
         pass
 
-    def simulate(self, node: Node, agent: Agent):
+    def simulate(self, node: Node, agent: Agent, state=None):
         pass
 
     def backprop(self, node: Node, value: float, remove_vloss=False):
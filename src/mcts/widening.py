@@ -0,0 +1,59 @@
+import math
+import chess
+
+PIECE_VALUES = {chess.PAWN: 1, chess.KNIGHT: 3, chess.BISHOP: 3, chess.ROOK: 5, chess.QUEEN: 9, chess.KING: 0}
+
+
+def tactical_score(board: chess.Board, move: chess.Move):
+    """ Cheap ordering score of a move: captures first (most valuable victim,
+    least valuable attacker), then checks and promotions, then the rest.
+    """
+    score = 0.
+    if board.is_capture(move):
+        victim = board.piece_type_at(move.to_square) or chess.PAWN  # En passant
+        score += 100 + 10 * PIECE_VALUES[victim] - PIECE_VALUES[board.piece_type_at(move.from_square)]
+    if board.gives_check(move):
+        score += 50
+    if move.promotion:
+        score += 10 * PIECE_VALUES[move.promotion]
+    return score
+
+
+class ProgressiveWidening:
+    """ Progressive widening of the tree: a node only has
+    ceil(c * visits ^ alpha) expanded children, so the search goes deeper
+    after a few moves of each node instead of expanding all of them first.
+    The moves are expanded from the most promising, by the prior of the
+    evaluator (see `SelfPlayTree`) or by `tactical_score`.
+
+    Parameters:
+        c: float. Children of a node with one visit.
+        alpha: float. Growth of the children with the visits, in (0, 1).
+        order: str. Order of the moves to expand, 'prior' (the tactical
+        one for the trees without evaluator) or 'tactical'.
+    """
+
+    ORDERS = ('prior', 'tactical')
+
+    def __init__(self, c=1., alpha=0.5, order='prior'):
+        if order not in self.ORDERS:
+            raise ValueError(f'Unknown move order: {order}')
+        self.c = c
+        self.alpha = alpha
+        self.order = order
+
+    def max_children(self, visits):
+        """ Number of children a node with the given visits can have. """
+        return max(1, math.ceil(self.c * visits ** self.alpha))
+
+    def scores(self, board: chess.Board, priors=None):
+        """ Returns the score of every legal move (UCI encoded), the higher
+        the sooner it's expanded.
+
+        Parameters:
+            board: chess.Board. Position of the node.
+            priors: dict. Priors of the moves, used with the 'prior' order.
+        """
+        if self.order == 'prior' and priors is not None:
+            return priors
+        return {m.uci(): tactical_score(board, m) for m in board.legal_moves}
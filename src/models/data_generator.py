@@ -1,10 +1,18 @@
-from tensorflow.keras.utils import to_categorical
 import numpy as np
 
 from src.envs.game_store import GameStore
 from src.utils.encoder_decoder import get_uci_labels, get_game_state
 
 
+def _one_hot(index, num_classes):
+    """ One-hot vector as `to_categorical` of Keras (float32), so TensorFlow
+    isn't imported just to build the targets.
+    """
+    vector = np.zeros(num_classes, dtype=np.float32)
+    vector[index] = 1
+    return vector
+
+
 class DataGenerator:
     """ Transforms a Dataset to a Data generator to be fed to the training
     loop of the neural network.
@@ -38,7 +46,7 @@ class DataGenerator:
             flip = np.random.rand() < self.random_flips
             batch_x.extend([get_game_state(i_g['game'], flipped=flip) for i_g in i_augmented])
             batch_y_policies.extend([
-                to_categorical(self.uci_ids[targets['next_move']], num_classes=1968)
+                _one_hot(self.uci_ids[targets['next_move']], num_classes=1968)
                 for targets in i_augmented]
             )
             batch_y_values.extend([targets['result']
@@ -1,6 +1,5 @@
 import sys
 import os
-from tqdm import tqdm
 import argparse
 import numpy as np
 sys.path.append(os.path.abspath("."))
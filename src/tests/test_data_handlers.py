@@ -43,6 +43,23 @@ def test_game_store_save():
     shutil.rmtree(test_dir)
 
 
+def test_game_store_augment_game_keeps_last_moves():
+    game = Game(date='2023-05-02', player_color=Game.WHITE)
+    moves = ['e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1c4', 'g8f6', 'd2d3', 'f8c5', 'e1g1', 'e8g8', 'c2c3']
+    for m in moves:
+        game.move(m)
+    augmented = GameStore().augment_game(game)
+    assert [a['next_move'] for a in augmented] == moves
+    replay = Game()
+    for i, a in enumerate(augmented):
+        # Light copies: only the last moves seen by the encoder are kept
+        assert a['game'].get_fen() == replay.get_fen() and len(a['game']) == i
+        kept = a['game'].get_history()['moves']
+        assert len(kept) >= min(i, Game.HISTORY) and kept == moves[i - len(kept):i]
+        replay.move(moves[i])
+    assert len(augmented[-1]['game'].get_history()['moves']) < len(moves) - 1
+
+
 def test_data_generator_len():
     # Create a sample dataset for testing
     game1 = Game(date='2023-05-01', player_color=Game.WHITE)
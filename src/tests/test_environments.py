@@ -1,4 +1,12 @@
+import random
+
+import chess
+import numpy as np
+
+from src.envs.batch_board import BatchBoard, ONGOING
+from src.envs.batch_game import BatchGame, LABEL_CODES, NO_MOVE
 from src.envs.game import Game
+from src.utils.encoder_decoder import get_game_state, get_uci_labels, encode_move, decode_move
 
 
 def test_move():
@@ -35,3 +43,186 @@ def test_get_result():
     assert game.get_result() is None  # Game not over yet
 
 
+def test_batch_board_perft():
+    # Number of leaf positions at depth 3 of well known perft positions
+    positions = {chess.STARTING_FEN: 8902,
+                 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1': 97862,
+                 '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1': 2812,
+                 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1': 9467}
+    for fen, nodes in positions.items():
+        batch = BatchBoard([chess.Board(fen)])
+        for _ in range(2):
+            moves = batch.legal_moves()
+            batch = batch.take(moves.row)
+            batch.push(np.arange(len(moves.row)), moves.from_square, moves.to_square, moves.promotion)
+        assert len(batch.legal_moves().row) == nodes
+
+
+def test_batch_board_matches_game():
+    random.seed(0)
+    games = [Game() for _ in range(8)]
+    batch = BatchBoard([g.board for g in games]).track_repetitions()
+    for _ in range(60):
+        moves = batch.legal_moves()
+        results, _ = batch.results(moves)
+        rows, picked = [], []
+        for i, game in enumerate(games):
+            ucis = [chess.Move(int(f), int(t), int(p) or None).uci() for f, t, p in
+                    zip(moves.from_square[moves.row == i], moves.to_square[moves.row == i],
+                        moves.promotion[moves.row == i])]
+            assert sorted(ucis) == sorted(game.get_legal_moves())
+            assert batch.to_board(i).fen() == game.board.fen()
+            result = game.get_result()
+            assert results[i] == (ONGOING if result is None else result)
+            if result is None and ucis:
+                picked.append(random.randrange(len(ucis)))
+                rows.append(i)
+                game.move(ucis[picked[-1]])
+        index = np.array([np.flatnonzero(moves.row == r)[p] for r, p in zip(rows, picked)], dtype=int)
+        batch.push(np.array(rows), moves.from_square[index], moves.to_square[index], moves.promotion[index])
+
+
+def test_game_cache():
+    game = Game()
+    moves = game.get_legal_moves()
+    moves.pop()  # The callers get their own list
+    assert len(game.get_legal_moves()) == 20
+    assert game.move('f2f3') and game.move('e7e5') and game.move('g2g4')
+    assert game.get_result() is None
+    assert game.move('d8h4') and game.get_result() == 1  # Checkmate (white to move)
+    assert game.get_legal_moves() == []
+    # Pushes and pops on the board reset the cached moves and result
+    game.board.pop()
+    assert game.get_result() is None and 'd8h4' in game.get_legal_moves()
+    game.board.push_uci('d8h4')
+    assert game.get_result() == 1
+
+    game = Game()
+    assert game.move('e2e4', trusted=True) and game.get_legal_moves() == Game(board=game.board.copy()).get_legal_moves()
+    assert not game.move('e2e4')
+    game.set_fen('8/8/8/8/8/8/8/K6k')
+    assert game.get_result() == 0  # Insufficient material
+
+
+def test_repetitions():
+    shuffle = ['g1f3', 'g8f6', 'f3g1', 'f6g8'] * 2
+    game = Game()
+    for move in shuffle:
+        assert game.get_result() is None
+        assert game.move(move)
+    assert game.is_repetition() and not game.is_repetition(4)
+    assert game.get_result() == 0  # Threefold repetition
+    assert game.get_copy().get_result() == 0
+    assert game.get_legal_moves()  # Not a stalemate
+    game.pop()
+    assert game.get_result() is None and not game.is_repetition()
+    # Changes on the board are counted again
+    game.board.push_uci('f6g8')
+    assert game.get_result() == 0
+    game.board.pop()
+    game.board.pop()
+    game.push(chess.Move.from_uci('f3g1'))
+    assert not game.is_repetition()
+    for move in ['f6g8', 'g1f3', 'g8f6', 'f3g1', 'f6g8']:
+        game.move(move)
+    assert game.is_repetition(4) and not game.is_repetition(5)
+    game.set_fen(chess.STARTING_BOARD_FEN)
+    assert not game.is_repetition()
+
+    # Castling rights make a different position
+    game = Game(board=chess.Board('r3k3/8/8/8/8/8/8/4K2R w Kq - 0 1'))
+    for move in ['h1h2', 'e8d8', 'h2h1', 'd8e8'] * 2:
+        game.move(move)
+    assert game.get_result() is None
+    game.move('h1h2')
+    game.move('e8d8')
+    assert game.get_result() == 0
+
+    batch = BatchBoard.from_board(chess.Board(), 2, track_repetitions=True)
+    for move in shuffle:
+        move = chess.Move.from_uci(move)
+        results, _ = batch.results(batch.legal_moves())
+        assert (results == ONGOING).all()
+        batch.push(np.array([0, 1]), np.array([move.from_square] * 2), np.array([move.to_square] * 2), np.zeros(2, dtype=int))
+    results, _ = batch.results(batch.legal_moves())
+    assert (results == 0).all()
+    assert (batch.take([0]).is_repetition()) and not batch.is_repetition(count=4).any()
+
+
+def test_light_copy():
+    random.seed(0)
+    game = Game()
+    for _ in range(40):
+        game.move(random.choice(game.get_legal_moves()), trusted=True)
+    light = game.get_copy(history=Game.HISTORY)
+    assert len(light.board.move_stack) == Game.HISTORY and len(light) == len(game) == 40
+    assert light.board.fen() == game.board.fen()
+    assert (get_game_state(light) == get_game_state(game)).all()  # Same history planes
+    assert light.moves_since(36) == game.moves_since(36) == game.board.move_stack[36:]
+    assert light.moves_since(20) is None
+    assert light.get_copy(history=4).moves_since(36) == game.moves_since(36)
+    assert len(game.get_copy()) == 40 and len(light.get_copy()) == 40
+
+    light.move(light.get_legal_moves()[0])
+    assert len(light) == 41 and len(light.board.move_stack) == Game.HISTORY + 1
+    for _ in range(Game.HISTORY + 1):
+        light.pop()
+    assert len(light) == 32 and light.board.fen() == game.board.copy(stack=8).root().fen()
+
+    # The repetitions before the copy still count
+    game = Game()
+    for move in ['g1f3', 'g8f6', 'f3g1', 'f6g8'] * 2:
+        game.move(move)
+    light = game.get_copy(history=2)
+    assert light.get_result() == 0 and light.is_repetition()
+    states = Game(board=game.board.copy(stack=7)).get_legal_moves(final_states=True)[1]
+    assert all(len(state.board.move_stack) == Game.HISTORY for state in states)
+
+
+def test_batch_game():
+    random.seed(0)
+    np.random.seed(0)
+    labels = get_uci_labels()
+    games = [Game() for _ in range(6)]
+    for game in games[3:]:  # Games with previous moves
+        for _ in range(random.randrange(1, 12)):
+            game.move(random.choice(game.get_legal_moves()))
+    # Knights shuffled twice: the next repetition ends the game
+    for move in ['g1f3', 'g8f6', 'f3g1', 'f6g8'] * 2:
+        games[0].move(move)
+    games[0].board.pop()
+    batch = BatchGame([games[0].board])
+    assert batch.status()[0] == ONGOING
+    batch.push([encode_move(chess.Move.from_uci('f6g8'))])
+    assert batch.status()[0] == 0 and batch.is_over()[0] and batch.sample()[0] == NO_MOVE
+
+    batch = BatchGame([game.board for game in games])
+
+    for ply in range(40):
+        # Every third ply the moves are picked without generating all of them first
+        checked = ply % 3 != 0
+        mask = batch.legal_mask() if checked else None
+        status = batch.status() if checked else None
+        states = batch.encode()
+        for i, game in enumerate(games):
+            result = game.get_result()
+            if checked:
+                assert sorted(labels[j] for j in np.flatnonzero(mask[i])) == sorted(game.get_legal_moves())
+                assert status[i] == (ONGOING if result is None else result)
+            assert np.array_equal(states[i], get_game_state(game))
+        policies = np.random.random((len(games), len(labels))) if ply % 2 else None
+        codes = batch.step(policies)
+        for game, code in zip(games, codes):
+            assert (code == NO_MOVE) == (game.get_result() is not None or not game.get_legal_moves())
+            if code != NO_MOVE:
+                assert game.move(decode_move(code).uci())
+
+    # The picked moves follow the policies
+    batch = BatchGame.new_games(200)
+    policies = np.zeros((200, len(LABEL_CODES)))
+    policies[:, labels.index('e2e4')] = 3.
+    policies[:, labels.index('d2d4')] = 1.
+    policies[:, labels.index('e2e5')] = 100.  # Illegal
+    codes = batch.sample(policies)
+    assert set(decode_move(c).uci() for c in codes) == {'e2e4', 'd2d4'}
+    assert 120 < sum(decode_move(c).uci() == 'e2e4' for c in codes) < 180
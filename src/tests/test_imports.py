@@ -0,0 +1,21 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.mark.parametrize('module', ['src.envs.game', 'src.mcts.self_play', 'src.stockfish.stockfish'])
+def test_import_time(module):
+    # Plotting, TensorFlow and downloads are only loaded by the features using them
+    code = ("import sys, time\n"
+            "start = time.perf_counter()\n"
+            f"import {module}\n"
+            "print(time.perf_counter() - start)\n"
+            "print(' '.join(m for m in ('IPython', 'tensorflow', 'requests', 'chess.svg') if m in sys.modules))")
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=ROOT).stdout.splitlines()
+    assert float(output[0]) < 2.  # Loose budget, see src/benchmarks/import_time.py
+    assert len(output) == 1 or not output[1]
@@ -0,0 +1,664 @@
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import chess
+import numpy as np
+
+from src.agents.cached_agent import CachedAgent, ReplyCache
+from src.agents.mcts_agent import MCTSAgent
+from src.agents.random_agent import RandomAgent
+from src.envs.batch_board import BatchBoard
+from src.envs.game import Game
+from src.envs.game_store import GameStore
+from src.mcts.array_tree import NodeArrays
+from src.mcts.budget import SearchBudget
+from src.mcts.endgame import EndgameTables, build_table
+from src.mcts.evaluator import BatchEvaluator, EvaluationCache
+from src.mcts.search_stats import PHASES
+from src.mcts.node import Node
+from src.mcts.opening_book import OpeningBook, build_book
+from src.mcts.self_play import SelfPlayTree
+from src.mcts.static_evaluation import StaticEvaluator
+from src.mcts.simulation import RandomSimulation, BatchRandomSimulation, AdaptiveRollouts
+from src.mcts.transposition import TranspositionTable
+from src.mcts.widening import ProgressiveWidening
+from src.utils.encoder_decoder import get_uci_labels
+
+# Black to move mates with d8h4 (fool's mate)
+FOOLS_MATE_FEN = 'rnbqkbnr/pppp1ppp/8/4p3/6P1/5P2/PPPPP2P/RNBQKBNR b KQkq - 0 2'
+
+
+def _explore(tree, agent, iters, seed=0):
+    random.seed(seed)
+    np.random.seed(seed)
+    for _ in range(iters):
+        tree.explore_tree(tree.root, agent)
+    return tree
+
+
+def test_array_backend_matches_object_backend():
+    agent = RandomAgent(Game.WHITE)
+    object_tree = _explore(SelfPlayTree(Game(), backend='object', rollouts=8), agent, 25)
+    array_tree = _explore(SelfPlayTree(Game(), backend='array', capacity=16, rollouts=8), agent, 25)
+
+    assert [c.visits for c in object_tree.root.children] == \
+           [c.visits for c in array_tree.root.children]
+    assert np.allclose([c.value for c in object_tree.root.children],
+                       [c.value for c in array_tree.root.children])
+    assert [str(c.state.board.move_stack) for c in object_tree.root.children] == \
+           [str(c.state.board.move_stack) for c in array_tree.root.children]
+    assert object_tree.search_move(agent, max_iters=0, noise=False) == \
+           array_tree.search_move(agent, max_iters=0, noise=False)
+    # The arrays grew from the initial capacity
+    assert array_tree.root.store.capacity >= array_tree.root.store.size > 16
+
+
+def test_move_backend_matches_object_backend():
+    agent = RandomAgent(Game.WHITE)
+    game = Game(board=chess.Board(FOOLS_MATE_FEN), player_color=Game.BLACK)
+    object_tree = _explore(SelfPlayTree(game, backend='object', rollouts=8), agent, 25)
+    move_tree = _explore(SelfPlayTree(game, backend='move', rollouts=8), agent, 25)
+
+    assert [(c.moves, c.visits, c.value) for c in _nodes(object_tree.root)] == \
+           [(c.moves, c.visits, c.value) for c in _nodes(move_tree.root)]
+    assert [c.state.board.fen() for c in move_tree.root.children] == \
+           [c.state.board.fen() for c in object_tree.root.children]
+    # The walked game is back at the root and the leaves have no moves
+    assert move_tree._walk_state(move_tree.root).board.fen() == game.board.fen()
+    assert all(c._actions is None for c in _nodes(move_tree.root) if c.is_leaf)
+
+
+def test_array_backend_terminal_nodes():
+    game = Game(board=chess.Board(FOOLS_MATE_FEN), player_color=Game.BLACK)
+    tree = _explore(SelfPlayTree(game, backend='array', rollouts=8), RandomAgent(Game.WHITE), 30)
+    mate = [c for c in tree.root.children if c.state.board.move_stack[-1].uci() == 'd8h4'][0]
+    assert mate.is_terminal_state
+    assert mate.state.get_result() is not None
+    assert NodeArrays.bytes_per_node() < 64
+
+
+def test_search_move_runs_max_iters():
+    game = Game()
+    tree = SelfPlayTree(game, threads=1, rollouts=8)
+    move = tree.search_move(RandomAgent(Game.BLACK), max_iters=25, noise=False)
+    assert tree.root.visits == 26
+    assert move in game.get_legal_moves()
+
+
+def test_tree_parallel_search_removes_virtual_loss():
+    tree = SelfPlayTree(Game(), threads=4, backend='array', rollouts=8)
+    move, reply = tree.search_move(RandomAgent(Game.BLACK), max_iters=40, ai_move=True)
+    assert tree.root.visits == 41
+    assert sum(c.visits for c in tree.root.children) == 40
+    assert not tree.root.store.vloss.any()
+    assert move in Game().get_legal_moves()
+
+
+def test_root_parallel_search_merges_visits():
+    game = Game()
+    tree = SelfPlayTree(game, threads=1, processes=2, rollouts=8)
+    budget = SearchBudget(max_iters=21)
+    moves, visits = tree._root_parallel_search(RandomAgent(Game.BLACK), budget)
+    assert budget.iterations == 21
+    assert sum(visits) == 21
+    assert len(set(m for m, _ in moves)) == len(moves)
+    assert all(m in game.get_legal_moves() for m, _ in moves)
+
+
+def test_mcts_agent_plays_legal_move():
+    game = Game()
+    game.move('e2e4')
+    agent = MCTSAgent(Game.BLACK, threads=1, rollouts=8)
+    assert game.move(agent.best_move(game, max_iters=10)) is True
+
+
+def test_random_simulation_resets_each_repetition():
+    game = Game(board=chess.Board(FOOLS_MATE_FEN))
+    game.move('a7a6')
+    random.seed(0)
+    RandomSimulation(game).run(max_moves=4, repetitions=3)
+    assert len(game) == 1  # The simulated game is not modified
+
+
+def test_batch_random_simulation():
+    np.random.seed(0)
+    game = Game(board=chess.Board(FOOLS_MATE_FEN))
+    results = BatchRandomSimulation(game).playouts(max_moves=1, repetitions=300)
+    # Only d8h4 (1 of the 30 legal moves) mates at the first move
+    mate = game.get_copy()
+    mate.move('d8h4')
+    assert set(results) == {0, mate.get_result()}
+    assert 0 < np.mean(results != 0) < 0.1
+
+    mean, var = BatchRandomSimulation(Game()).run(max_moves=20, repetitions=50)
+    assert -1 <= mean <= 1 and var >= 0
+
+
+def test_mcts_agent_reuses_subtree():
+    for backend in SelfPlayTree.BACKENDS:
+        game = Game()
+        agent = MCTSAgent(Game.WHITE, threads=1, rollouts=4, backend=backend)
+        move = agent.best_move(game, max_iters=30)
+        child = [c for c in agent.tree.root.children if c.moves[0] == move][0]
+        visits, reply = child.visits, child.moves[1]
+        game.move(move)
+        game.move(reply)
+
+        agent.best_move(game, max_iters=5)
+        assert agent.tree.root.is_root
+        assert agent.tree.root.visits == visits + 5
+        assert agent.tree.root.state.board.fen() == game.board.fen()
+
+
+def test_transposition_table_eviction():
+    table = TranspositionTable(size=4)  # 2 buckets of 2 entries, keys 2, 4, 6, 8 share one
+    for _ in range(3):
+        table.backup(2, 1.)
+    assert table.backup(4, .5) == (1, .5)
+    visits, value = table.lookup([2, 4, 8])
+    assert list(visits) == [3, 1, 0] and list(value) == [3., .5, 0.]
+    assert (table.hits, table.collisions) == (4, 2)
+
+    # The new position replaces the least visited one
+    table.backup(6, 0.)
+    assert list(table.lookup([2, 4, 6])[0]) == [3, 0, 1]
+    assert table.evictions == 1 and len(table) <= table.size
+    # An evicted node comes back with its own statistics
+    assert table.backup(4, 1., visits=5, total=2.) == (6, 3.)
+
+
+def _child(node, moves):
+    state = node.state.get_copy()
+    for move in moves:
+        state.move(move)
+    return node.add_child(state)
+
+
+def test_transposition_table_shares_statistics():
+    root = Node(Game())
+    knights = _child(_child(root, ['g1f3', 'g8f6']), ['b1c3', 'b8c6'])
+    transposed = _child(_child(root, ['b1c3', 'b8c6']), ['g1f3', 'g8f6'])
+    assert knights.key == transposed.key != root.key
+
+    tree = SelfPlayTree(root, transpositions=64)
+    for _ in range(3):
+        tree.backprop(knights, 1.)
+    tree._share_statistics(transposed.parent)
+    assert (transposed.visits, transposed.value) == (3, 3.)
+    tree.backprop(transposed, 0.)
+    assert (transposed.visits, transposed.value) == (4, 3.)
+    assert transposed.parent.visits == 1
+    assert transposed.parent.children_visits == 4
+    assert tree.transpositions.stats()['shared_visits'] == 3
+
+
+def test_search_with_transposition_table():
+    for backend in SelfPlayTree.BACKENDS:
+        tree = SelfPlayTree(Game(), backend=backend, rollouts=4, transpositions=256)
+        _explore(tree, RandomAgent(Game.BLACK), 30)
+        stats = tree.transpositions.stats()
+        assert tree.root.visits == 31
+        assert stats['lookups'] > 0 and 0 <= stats['hit_rate'] <= 1
+        assert 0 < stats['entries'] <= 256
+
+
+def _nodes(node):
+    yield node
+    for child in node.children:
+        yield from _nodes(child)
+
+
+def test_incremental_selection_statistics():
+    for backend in SelfPlayTree.BACKENDS:
+        for selection in SelfPlayTree.SELECTIONS:
+            tree = SelfPlayTree(Game(), backend=backend, rollouts=4, selection=selection)
+            _explore(tree, RandomAgent(Game.BLACK), 25)
+            for node in _nodes(tree.root):
+                assert node.children_visits == sum(c.visits for c in node.children)
+                if len(node.children) > 1:
+                    # Same choice as scoring the children one by one
+                    scores = [c.get_ucb1() if selection == 'ucb1' else c.get_value() for c in node.children]
+                    assert node.get_best_child(ucb1=selection == 'ucb1') == node.children[np.argmax(scores)]
+
+
+def test_node_allocates_children_stats_lazily():
+    node = Node(Game())
+    assert node.children_stats is None
+    state = Game()
+    state.move(node.pop_unexpanded_action())
+    child = node.add_child(state)
+    # The child's statistics live in a slot of the parent, not in arrays of their own
+    assert child._stats is node.children_stats and child.children_stats is None
+    child.visits = 3
+    assert node.children_stats.visits[0] == 3
+    node.collapse()
+    assert node.children_stats is None
+
+
+def test_search_time_budget():
+    agent = MCTSAgent(Game.WHITE, threads=2, rollouts=4)
+    move = agent.best_move(Game(), max_iters=None, max_time=0.5)
+    report = agent.last_search
+    assert move in Game().get_legal_moves()
+    assert report['stop_reason'] == 'time' and report['iterations'] >= 1
+    # Loose upper bound, the machine may be loaded
+    assert report['elapsed'] < 30 and report['iters_used'] is None
+
+
+def test_search_nodes_budget_and_early_stop():
+    tree = SelfPlayTree(Game(), threads=1, rollouts=4)
+    tree.search_move(RandomAgent(Game.BLACK), max_iters=None, max_nodes=5)
+    assert tree.last_search['stop_reason'] == 'nodes'
+    assert tree.last_search['nodes'] == len(tree.root.children) == 5
+
+    # Only one legal move (out of check), it can't be overtaken after half the iterations
+    game = Game(board=chess.Board('7k/8/8/8/8/8/7P/r6K w - - 0 1'))
+    tree = SelfPlayTree(game, threads=1, rollouts=4)
+    assert tree.search_move(RandomAgent(Game.BLACK), max_iters=100, early_stop=True, noise=False) == 'h1g2'
+    assert tree.last_search['stop_reason'] == 'early'
+    assert tree.last_search['iterations'] <= 52
+
+
+class CountingAgent(RandomAgent):
+    calls = 0
+
+    def best_move(self, game):
+        self.calls += 1
+        return super().best_move(game)
+
+
+def test_reply_cache_evicts_and_persists(tmp_path):
+    path = str(tmp_path / 'replies.sqlite')
+    cache = ReplyCache(size=2, path=path)
+    for key, move in [(1, 'e2e4'), (2 ** 64 - 1, 'd2d4'), (3, 'g1f3')]:
+        cache.put(key, move)
+    assert len(cache) == 2 and cache.evictions == 1
+    assert cache.get(3) == 'g1f3'
+    assert cache.get(1) == 'e2e4'  # Evicted from memory, read from the file
+    assert cache.get(4) is None
+    assert (cache.hits, cache.disk_hits, cache.misses) == (1, 1, 1)
+    cache.close()
+
+    reopened = ReplyCache(path=path)
+    assert reopened.get(2 ** 64 - 1) == 'd2d4'
+    assert reopened.stats()['disk_hits'] == 1
+
+
+def test_cached_agent_asks_each_position_once():
+    agent = CountingAgent(Game.BLACK)
+    cached = CachedAgent(agent, cache=ReplyCache(size=16))
+    game = Game()
+    game.move('e2e4')
+    moves = {cached.best_move(game) for _ in range(5)}
+    assert agent.calls == 1 and len(moves) == 1
+    assert game.get_copy().move(moves.pop())
+
+    # A move illegal in the position (key collision) is not returned
+    cached.cache.put(cached.cache.moves.popitem()[0], 'a1a8')
+    assert cached.best_move(game) in game.get_legal_moves()
+    assert agent.calls == 2
+
+    # Copies and new agents of the same class share the cache of the process
+    assert cached.get_copy().cache is cached.cache
+    assert CachedAgent(RandomAgent(Game.WHITE)).cache is CachedAgent(RandomAgent(Game.BLACK)).cache
+
+
+class DepthAgent(RandomAgent):
+    def __init__(self, color, depth):
+        super().__init__(color)
+        self.depth = depth
+
+
+def test_cached_agents_share_by_configuration():
+    # Agents configured alike share the cache of the process, the others don't
+    shallow, deep = CachedAgent(DepthAgent(Game.WHITE, 1)), CachedAgent(DepthAgent(Game.WHITE, 2))
+    assert shallow.cache is not deep.cache
+    assert CachedAgent(DepthAgent(Game.BLACK, 2)).cache is deep.cache
+
+    # Agents with other state (e.g. a nested search) get their own cache
+    agent = DepthAgent(Game.WHITE, 1)
+    agent.search = object()
+    assert agent.cache_key() is None
+    assert CachedAgent(agent).cache is not CachedAgent(agent).cache
+
+
+def test_mcts_agent_caches_replies():
+    cache = ReplyCache(size=1024)
+    agent = MCTSAgent(Game.WHITE, threads=1, rollouts=4, opponent=CountingAgent(Game.BLACK), reply_cache=cache)
+    game = Game()
+    agent.best_move(game, max_iters=20)
+    calls = agent.opponent.agent.calls
+    assert calls == len(cache) == 20
+
+    # A new search reuses the replies of the expanded children
+    agent.tree = None
+    agent.best_move(game, max_iters=20)
+    assert agent.opponent.agent.calls == calls
+    assert cache.hits >= 20
+
+
+def test_search_stats(tmp_path):
+    path = str(tmp_path / 'stats.jsonl')
+    game = Game()
+    agent = MCTSAgent(Game.WHITE, threads=2, rollouts=4, backend='move', stats_path=path)
+    agent.best_move(game, max_iters=20)
+    stats = agent.last_stats
+    assert stats.iterations == 20 and stats.nodes == 20
+    assert stats.tree_size == agent.tree.count_nodes(agent.tree.root) == 21
+    assert 1 <= stats.avg_depth <= stats.max_depth
+    assert stats.tree_bytes > 0 and stats.nodes_per_second > 0
+    assert 0 < sum(stats.phase_time.values()) <= 2 * stats.elapsed
+    assert stats.lock_acquisitions > 0 and 0 <= stats.lock_contention <= 1
+
+    agent.best_move(game, max_iters=5)
+    lines = [json.loads(line) for line in open(path)]
+    assert [line['iterations'] for line in lines] == [20, 5]
+    assert set(lines[0]['phase_time']) == set(PHASES) and lines[0]['fen'] == game.board.fen()
+
+    tree = SelfPlayTree(game, threads=1, processes=2, backend='array', rollouts=4)
+    tree.search_move(RandomAgent(Game.BLACK), max_iters=6)
+    assert tree.last_stats.iterations == 6 and tree.last_stats.tree_size == 8
+
+
+def test_capped_tree_prunes_least_visited_subtrees():
+    game = Game()
+    game.board.set_fen('7k/8/8/8/8/8/7P/7K w - - 0 1')
+    for backend in SelfPlayTree.BACKENDS:
+        random.seed(1)  # Replies keeping the pawn, so the tree outgrows the cap
+        np.random.seed(1)
+        tree = SelfPlayTree(game, threads=1, backend=backend, rollouts=1, node_cap=12, prune_ratio=0.5)
+        tree.search_move(RandomAgent(Game.BLACK), max_iters=30)
+        assert tree.pruned > 0 and tree.last_stats.pruned == tree.pruned
+        assert tree.size == tree.count_nodes(tree.root) <= 12
+        # The collapsed nodes keep the visits of their removed subtrees
+        assert tree.root.visits == 1 + 30
+        for node in _nodes(tree.root):
+            assert node.visits >= sum(c.visits for c in node.children)
+            assert node.vloss == 0
+
+    tree = SelfPlayTree(game, threads=2, backend='array', capacity=8, rollouts=1, memory_cap=1000)
+    tree.search_move(RandomAgent(Game.BLACK), max_iters=30)
+    assert tree.pruned > 0 and tree.root.visits == 1 + 30
+    assert tree.root.store.size * NodeArrays.bytes_per_node() <= 1000
+
+
+class CountingModel:
+    """ Policy/value model preferring one move, counting its batches. """
+
+    def __init__(self, favourite='e2e4', value=0.5):
+        self.favourite = get_uci_labels().index(favourite)
+        self.value = value
+        self.batch_sizes = []
+
+    def __call__(self, states):
+        assert states.shape[1:] == (8, 8, 127)
+        self.batch_sizes.append(len(states))
+        policies = np.ones((len(states), 1968))
+        policies[:, self.favourite] = 100
+        return policies, np.full(len(states), self.value)
+
+
+def test_batch_evaluator_batches_concurrent_positions():
+    model = CountingModel()
+    with BatchEvaluator(model, batch_size=8, max_wait=0.5) as evaluator:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: evaluator.evaluate(Game()), range(8)))
+    assert model.batch_sizes == [8] and evaluator.stats()['avg_batch_size'] == 8
+    priors, value = results[0]
+    assert value == 0.5 and len(priors) == 20
+    assert abs(sum(priors.values()) - 1) < 1e-9 and max(priors, key=priors.get) == 'e2e4'
+
+
+def test_search_with_batch_evaluator():
+    for backend in SelfPlayTree.BACKENDS:
+        model = CountingModel()
+        with BatchEvaluator(model, batch_size=4, max_wait=0.01) as evaluator:
+            tree = SelfPlayTree(Game(), threads=4, backend=backend, evaluator=evaluator)
+            tree.search_move(RandomAgent(Game.BLACK), max_iters=40, noise=False)
+        assert max(model.batch_sizes) > 1
+        # Every new node is evaluated by the network instead of the playouts
+        assert tree.root.value == 40 * 0.5
+        priors = {c.moves[0]: c.prior for c in tree.root.children}
+        assert len(priors) == 20 and max(priors, key=priors.get) == 'e2e4'
+        assert abs(sum(priors.values()) - 1) < 1e-6
+
+
+def test_evaluation_cache():
+    model = CountingModel(value=1 / 3)
+    cache = EvaluationCache(max_bytes=2 * EvaluationCache.ENTRY_BYTES + 100)
+    with BatchEvaluator(model, batch_size=1, cache=cache) as evaluator:
+        game = Game()
+        first = evaluator.evaluate(game)
+        assert evaluator.evaluate(game) == first and len(model.batch_sizes) == 1
+        assert first[1] == float(np.float16(1 / 3))
+
+        # Same position with another history
+        for move in ['g1f3', 'g8f6', 'f3g1', 'f6g8']:
+            game.move(move)
+        evaluator.evaluate(game)
+        assert len(model.batch_sizes) == 2 and cache.hits == 1 and cache.misses == 2
+
+        game.move('e2e4')
+        evaluator.evaluate(game)
+    assert cache.evictions == 1 and len(cache) == 2 and cache.nbytes <= cache.max_bytes
+    assert evaluator.stats()['cache']['hit_rate'] == 1 / 4
+
+
+def test_search_with_evaluation_cache():
+    model = CountingModel()
+    with BatchEvaluator(model, batch_size=1, cache=2 ** 20) as evaluator:
+        game = Game()
+        game.board.set_fen('7k/8/8/8/8/8/7P/7K w - - 0 1')
+        tree = SelfPlayTree(game, threads=1, backend='move', evaluator=evaluator)
+        tree.search_move(RandomAgent(Game.BLACK), max_iters=30)
+    # The priors of the children of a node reuse its evaluation as a leaf
+    assert evaluator.cache.hits >= 1
+    assert sum(model.batch_sizes) == evaluator.cache.misses
+
+
+def test_progressive_widening_goes_deeper():
+    for backend in SelfPlayTree.BACKENDS:
+        tree = SelfPlayTree(Game(), threads=1, backend=backend, rollouts=1, widening=ProgressiveWidening())
+        tree.search_move(RandomAgent(Game.BLACK), max_iters=16)
+        # The root had 16 visits in the last iteration: 4 children, the other
+        # iterations went deeper
+        assert len(tree.root.children) == 4
+        assert tree.last_stats.max_depth >= 3
+        for node in _nodes(tree.root):
+            assert len(node.children) <= tree.widening.max_children(node.visits)
+
+
+def test_progressive_widening_move_order():
+    # White can take the queen (d1d8), check (e.g. f1b5) or push pawns
+    fen = '3qk3/8/8/8/8/8/4PPPP/3QKB2 w - - 0 1'
+    for backend in SelfPlayTree.BACKENDS:
+        game = Game()
+        game.board.set_fen(fen)
+        tree = SelfPlayTree(game, threads=1, backend=backend, rollouts=1,
+                            widening=ProgressiveWidening(order='tactical'))
+        _explore(tree, RandomAgent(Game.BLACK), 6)
+        first, second = [chess.Move.from_uci(c.moves[0]) for c in tree.root.children[:2]]
+        assert first.uci() == 'd1d8' and game.board.gives_check(second)
+
+    model = CountingModel(favourite='h2h4')
+    with BatchEvaluator(model, batch_size=1) as evaluator:
+        tree = SelfPlayTree(game, threads=1, backend='move', evaluator=evaluator, widening=ProgressiveWidening())
+        _explore(tree, RandomAgent(Game.BLACK), 1)
+    assert tree.root.children[0].moves[0] == 'h2h4'
+
+
+def test_adaptive_rollouts():
+    np.random.seed(0)
+    # 100 random moves from the initial position are always a draw
+    assert AdaptiveRollouts(min_rollouts=16, tolerance=1e-6).run(Game()) == (0, 16)
+
+    game = Game(board=chess.Board('k7/8/8/8/8/8/1R6/1R5K w - - 0 1'))
+    # A loose interval stops after the first batch, a tight one at the cap
+    assert AdaptiveRollouts(min_rollouts=16, tolerance=1.).run(game)[1] == 16
+    mean, n = AdaptiveRollouts(min_rollouts=16, max_rollouts=64, tolerance=1e-6).run(game)
+    assert n == 64 and -1 <= mean <= 1
+    assert AdaptiveRollouts(min_rollouts=16, tolerance=1e-6).run(game, limit=40)[1] == 40
+    assert AdaptiveRollouts(min_rollouts=16).run(game, limit=0)[1] == 1
+
+
+def test_search_playouts_budget():
+    adaptive = AdaptiveRollouts(min_rollouts=8, max_rollouts=16, tolerance=1.)
+    tree = SelfPlayTree(Game(), threads=1, backend='move', rollouts=100, adaptive_rollouts=adaptive)
+    tree.search_move(RandomAgent(Game.BLACK), max_iters=None, max_playouts=40)
+    stats = tree.last_stats
+    assert tree.last_search['stop_reason'] == 'playouts' and tree.last_search['playouts'] == 40
+    assert stats.playouts == 40 and stats.playouts_saved == stats.iterations * 100 - 40
+
+
+def test_static_evaluator():
+    evaluator = StaticEvaluator()
+    fens = ['rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1',
+            'rnb1kbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+            FOOLS_MATE_FEN]
+    boards = [chess.Board(fen) for fen in fens]
+    scores = evaluator.scores(BatchBoard(boards + [b.mirror() for b in boards]))
+    assert np.allclose(scores[:3], -scores[3:])  # Same position for the other side
+    assert evaluator.scores(BatchBoard([chess.Board()]))[0] == 0
+    assert 800 < scores[1] < 1000  # A queen up
+    values = evaluator.evaluate(BatchBoard(boards))
+    assert np.allclose(values, [evaluator.evaluate_board(b) for b in boards])
+    assert np.all(np.abs(values) < 1)
+
+
+def test_truncated_rollouts():
+    np.random.seed(0)
+    game = Game(board=chess.Board('rnb1kbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'))
+    results = BatchRandomSimulation(game).playouts(max_moves=4, repetitions=20, evaluator=StaticEvaluator())
+    # A queen up after 4 random moves is a graded win, with the sign of a mate of the black king
+    assert np.all((-1 < results) & (results < 0))
+    assert -1 < RandomSimulation(game).run(max_moves=4, repetitions=2, evaluator=StaticEvaluator()) < 0
+
+    tree = SelfPlayTree(game, threads=1, backend='move', rollouts=8, rollout_moves=4,
+                        static_evaluator=StaticEvaluator())
+    tree.search_move(RandomAgent(Game.BLACK), max_iters=5)
+    assert -1 < tree.root.value / tree.root.visits < 0
+
+
+def test_truncated_rollouts_agree_with_mates():
+    # Two black queens: the playouts of the node mate the white king or are cut short far ahead
+    np.random.seed(0)
+    game = Game(board=chess.Board('k7/8/8/8/8/8/qq6/7K w - - 0 1'))
+    results = BatchRandomSimulation(game).playouts(max_moves=6, repetitions=200, evaluator=StaticEvaluator())
+    mated = results == Game(board=chess.Board('k7/8/8/8/8/8/6qq/7K w - - 0 1')).get_result()
+    truncated = (0 < results) & (results < 1)
+    assert mated.any() and truncated.any()
+    assert np.all(results[truncated] > 0.9)  # Same sign as the mates
+    assert StaticEvaluator().evaluate_board(game.board) > 0.9
+
+
+def test_pondering():
+    for backend in ('object', 'move'):
+        game = Game()
+        agent = MCTSAgent(Game.WHITE, threads=1, rollouts=1, rollout_moves=10, backend=backend)
+        move = agent.best_move(game, max_iters=4)
+        child = [c for c in agent.tree.root.children if c.moves[0] == move][0]
+        assert agent.ponder()
+        while child.visits < 4:
+            time.sleep(0.01)
+        agent.stop_pondering()
+        # Only the virtual loss added by the pondering search is removed
+        assert agent.tree.root.vloss == 0 and child.vloss == 0
+        game.move(move)
+        game.move(child.moves[1])  # The expected reply
+        agent.best_move(game, max_iters=2)
+        assert not agent.tree.is_pondering
+        assert agent.last_ponder['stop_reason'] == 'stopped' and agent.last_ponder['iterations'] >= 3
+        # The search continued from the pondered subtree
+        assert agent.tree.root.visits >= 4 + 2
+
+
+def test_endgame_tables(tmp_path):
+    tables = EndgameTables(str(tmp_path))
+    build_table('KPvK', tables)  # Builds first the tables of its promotions
+    assert sorted(tables.tables) == ['KPvK', 'KQvK', 'KRvK']
+    # Longest mates: 10 moves with a queen, 16 with a rook
+    assert tables.tables['KQvK'].scores.max() - 1 == 19
+    assert tables.tables['KRvK'].scores.max() - 1 == 31
+    tables = EndgameTables(str(tmp_path))  # Memory-mapped from the files
+
+    assert tables.probe(chess.Board('k7/1Q6/1K6/8/8/8/8/8 b - - 0 1')) == (-1, 0)
+    assert tables.value(chess.Board('k7/1Q6/1K6/8/8/8/8/8 b - - 0 1')) == -1
+    assert tables.probe(chess.Board('4k3/8/4K3/4P3/8/8/8/8 b - - 0 1'))[0] == -1
+    assert tables.value(chess.Board('8/8/8/8/8/4k3/4P3/4K3 w - - 0 1')) == 0
+    assert tables.value(chess.Board('4k3/4p3/4K3/8/8/8/8/8 b - - 0 1')) == 0  # Colors swapped
+    assert tables.value(chess.Board('8/8/8/8/4p3/4k3/8/4K3 w - - 0 1')) == 1
+    assert tables.value(chess.Board('8/8/8/8/8/2k5/8/r3K3 b - - 0 1')) == 1
+    assert tables.value(chess.Board('8/8/8/8/8/2k5/8/r1q1K3 b - - 0 1')) is None
+    assert tables.value(chess.Board()) is None
+
+    # The tables score as the mates they lead to (a win one ply before the mate included)
+    for fen in ('k7/1Q6/1K6/8/8/8/8/8 b - - 0 1', 'K7/1q6/1k6/8/8/8/8/8 w - - 0 1'):
+        game = Game(board=chess.Board(fen))
+        assert game.get_result() == tables.value(game.board) != 0
+    before_mate = chess.Board('k7/8/1K6/8/8/8/8/1Q6 w - - 0 1')
+    assert tables.value(before_mate) == Game(board=chess.Board('k7/1Q6/1K6/8/8/8/8/8 b - - 0 1')).get_result()
+
+    # Every win has a move to a loss one ply shorter, every loss only moves to wins
+    random.seed(0)
+    for signature, table in tables.tables.items():
+        for key in random.sample(list(table.keys), 30):
+            squares, turn = table.decode(np.array([key]))
+            board = table.boards(squares, turn).to_board(0)
+            wdl, dtm = tables.probe(board)
+            after = []
+            for move in board.legal_moves:
+                board.push(move)
+                after.append(tables.probe(board) if not board.is_checkmate() else (-1, 0))
+                board.pop()
+            if wdl == 1:
+                assert (-1, dtm - 1) in after and all(w > -1 or d >= dtm - 1 for w, d in after)
+            elif wdl == -1:
+                assert all(w == 1 for w, _ in after) and max((d for _, d in after), default=-1) == dtm - 1
+            else:
+                assert all(w >= 0 for w, _ in after) and any(w == 0 for w, _ in after)
+
+    for backend in ('object', 'move'):
+        tree = SelfPlayTree(Game(board=chess.Board('8/8/8/3k4/8/8/8/R3K3 w - - 0 1')), threads=1,
+                            backend=backend, rollouts=8, endgame_tables=tables)
+        tree.search_move(RandomAgent(Game.BLACK), max_iters=40)
+        stats = tree.last_stats
+        # No playouts: the new nodes are scored by the tables (or drawn once the rook is lost)
+        assert stats.playouts == 0 and stats.table_hits > 0
+        assert stats.max_depth == 1
+        assert tree.root.value < 0  # A win of the white pieces, with the sign of a mate of the black king
+
+
+def test_opening_book(tmp_path):
+    games = []
+    for moves in (['e2e4', 'e7e5', 'g1f3'], ['e2e4', 'c7c5'], ['d2d4', 'd7d5'], ['e2e4', 'e7e5', 'f1c4']):
+        game = Game()
+        for move in moves:
+            game.move(move)
+        games.append(game)
+    mate = Game()
+    for move in ['f2f3', 'e7e5', 'g2g4', 'd8h4']:
+        mate.move(move)
+    path = str(tmp_path / 'book')
+    book = build_book(GameStore(games + [mate]), path, max_plies=2)
+
+    book = OpeningBook(path)  # Memory-mapped from the files
+    assert len(book) == 4  # Initial position, after e2e4, d2d4 and f2f3
+    assert book.probe(chess.Board()) == {'e2e4': (3, 0.), 'd2d4': (1, 0.), 'f2f3': (1, -1.)}
+    assert book.best_move(chess.Board()) == 'e2e4'
+    after = chess.Board()
+    after.push_uci('e2e4')
+    assert book.best_move(after) == 'e7e5'
+    after.push_uci('e7e5')
+    assert book.best_move(after) is None  # Beyond max_plies
+    assert OpeningBook(path, min_count=2).best_move(chess.Board('8/8/8/8/8/8/8/K6k w - - 0 1')) is None
+    assert OpeningBook(path, weighted=True).best_move(chess.Board()) in ('e2e4', 'd2d4', 'f2f3')
+
+    agent = MCTSAgent(Game.WHITE, threads=1, rollouts=1, rollout_moves=10, opening_book=book)
+    game = Game()
+    assert agent.best_move(game) == 'e2e4' and agent.tree is None and agent.book_moves == 1
+    game.move('e2e4')
+    game.move('c7c5')
+    agent.best_move(game, max_iters=2)  # Out of the book
+    assert agent.book_moves == 1 and agent.tree is not None
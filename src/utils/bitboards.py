@@ -0,0 +1,149 @@
+import numpy as np
+import chess
+
+# Bitboards follow the python-chess square numbering (a1 = bit 0, h8 = bit 63)
+# and are stored as np.uint64. Every function works over arrays of squares
+# and bitboards, so many boards can be processed with one NumPy call.
+
+B_FILE = np.uint64(0x0202020202020202)
+DIAG_C7B2 = np.uint64(0x0004081020408000)
+SHIFT_INDEX = np.uint64(58)
+
+# Lines through a square used by the sliding pieces
+RANK, FILE, DIAG, ANTI_DIAG = range(4)
+_LINE_DIRECTIONS = (((1, 0), (-1, 0)), ((0, 1), (0, -1)),
+                    ((1, 1), (-1, -1)), ((1, -1), (-1, 1)))
+
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0f0f0f0f0f0f0f0f)
+_H01 = np.uint64(0x0101010101010101)
+
+BIT = np.array([1 << sq for sq in chess.SQUARES], dtype=np.uint64)
+
+# Set bits of every byte value, used to serialize bitboards a byte at a time
+_BYTE_BITS = np.array([[b >> i & 1 for i in range(8)] for b in range(256)], dtype=bool)
+
+
+def _walk(square, occupied, directions):
+    """ Squares attacked from a square along some directions (slow, only used
+    to build the tables).
+    """
+    attacks = 0
+    for df, dr in directions:
+        f, r = chess.square_file(square) + df, chess.square_rank(square) + dr
+        while 0 <= f < 8 and 0 <= r < 8:
+            attacks |= 1 << chess.square(f, r)
+            if occupied & (1 << chess.square(f, r)):
+                break
+            f, r = f + df, r + dr
+    return attacks
+
+
+def _line_index(line, square, occupied):
+    """ Index of the occupancy of a line in the attack tables. The occupied
+    squares of a rank or a diagonal are in different files, so multiplying by
+    the B file gathers them in the 6 upper bits (kindergarten bitboards). The
+    files are first shifted to the A file and gathered with the c7-b2 diagonal.
+    """
+    occupied = occupied & LINE_MASKS[line, square.astype(np.intp)]
+    if line == FILE:
+        occupied = occupied >> (square & np.uint64(7))
+        return (occupied * DIAG_C7B2) >> SHIFT_INDEX
+    return (occupied * B_FILE) >> SHIFT_INDEX
+
+
+def _line_masks():
+    masks = np.zeros((4, 64), dtype=np.uint64)
+    for line, directions in enumerate(_LINE_DIRECTIONS):
+        for square in chess.SQUARES:
+            masks[line, square] = _walk(square, 0, directions)
+    return masks
+
+
+def _line_tables():
+    """ Attacks of every line and square indexed by `_line_index`. """
+    tables = np.zeros((4, 64, 64), dtype=np.uint64)
+    squares = np.array(chess.SQUARES, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for line, directions in enumerate(_LINE_DIRECTIONS):
+            for square in chess.SQUARES:
+                mask = int(LINE_MASKS[line, square])
+                # Enumerate every subset of the line (Carry-Rippler)
+                subsets, subset = [], 0
+                while True:
+                    subsets.append(subset)
+                    subset = (subset - mask) & mask
+                    if subset == 0:
+                        break
+                occupied = np.array(subsets, dtype=np.uint64)
+                index = _line_index(line, np.full(len(subsets), squares[square]), occupied)
+                attacks = np.array([_walk(square, s, directions) for s in subsets], dtype=np.uint64)
+                tables[line, square, index] = attacks
+                # Subsets sharing an index must attack the same squares
+                assert (tables[line, square, index] == attacks).all()
+    return tables
+
+
+def _step_attacks(deltas):
+    attacks = np.zeros(64, dtype=np.uint64)
+    for square in chess.SQUARES:
+        for df, dr in deltas:
+            f, r = chess.square_file(square) + df, chess.square_rank(square) + dr
+            if 0 <= f < 8 and 0 <= r < 8:
+                attacks[square] |= BIT[chess.square(f, r)]
+    return attacks
+
+
+LINE_MASKS = _line_masks()
+LINE_ATTACKS = _line_tables()
+
+KNIGHT_ATTACKS = _step_attacks([(1, 2), (2, 1), (2, -1), (1, -2),
+                                (-1, -2), (-2, -1), (-2, 1), (-1, 2)])
+KING_ATTACKS = _step_attacks([(1, 0), (1, 1), (0, 1), (-1, 1),
+                              (-1, 0), (-1, -1), (0, -1), (1, -1)])
+# Indexed by [color, square], color as in python-chess (BLACK = 0, WHITE = 1)
+PAWN_ATTACKS = np.stack([_step_attacks([(-1, -1), (1, -1)]),
+                         _step_attacks([(-1, 1), (1, 1)])])
+
+
+def line_attacks(line, square, occupied):
+    """ Squares attacked along a line from the squares (arrays of the same
+    shape) given the occupied bitboards. The uint64 products are expected to
+    overflow (NumPy only warns about it with scalars).
+    """
+    index = _line_index(line, square.astype(np.uint64), occupied)
+    return LINE_ATTACKS[line, square, index.astype(np.intp)]
+
+
+def bishop_attacks(square, occupied):
+    return line_attacks(DIAG, square, occupied) | line_attacks(ANTI_DIAG, square, occupied)
+
+
+def rook_attacks(square, occupied):
+    return line_attacks(RANK, square, occupied) | line_attacks(FILE, square, occupied)
+
+
+def popcount(bb):
+    """ Number of set bits of each bitboard (SWAR). """
+    bb = np.asarray(bb, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        bb = bb - ((bb >> np.uint64(1)) & _M1)
+        bb = (bb & _M2) + ((bb >> np.uint64(2)) & _M2)
+        bb = (bb + (bb >> np.uint64(4))) & _M4
+        return ((bb * _H01) >> np.uint64(56)).astype(np.int64)
+
+
+def scan(bb):
+    """ Serializes a 1D array of bitboards into its set bits.
+
+    Returns:
+        rows: np.array. Position in the input array of each set bit.
+        squares: np.array. Square of each set bit.
+    """
+    data = np.ascontiguousarray(bb, dtype='<u8').view(np.uint8)
+    index = np.flatnonzero(data)
+    # Bit i of the byte j of the input is the square 8 * (j % 8) + i
+    byte, bit = np.nonzero(_BYTE_BITS[data[index]])
+    index = index[byte]
+    return index // 8, (index % 8) * 8 + bit
@@ -125,3 +125,28 @@ def get_uci_labels():
                 labels_array.append(letter + '2' + l_r + '1' + p)
                 labels_array.append(letter + '7' + l_r + '8' + p)
     return labels_array
+
+
+def encode_move(move):
+    """ Packs a python-chess move into a 15 bits integer: origin square
+    (bits 0-5), destination square (bits 6-11) and promotion piece type
+    (bits 12-14, 0 if none).
+
+    Parameters:
+        move: chess.Move. Move to encode.
+    Returns:
+        code: int. Encoded move.
+    """
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+def decode_move(code):
+    """ Inverse of `encode_move`.
+
+    Parameters:
+        code: int. Encoded move.
+    Returns:
+        move: chess.Move. Decoded move.
+    """
+    code = int(code)
+    return chess.Move(code & 63, (code >> 6) & 63, (code >> 12) or None)
@@ -1,7 +1,6 @@
 import platform
 import os
 
-import requests
 import zipfile
 import shutil
 # from logger import Logger
@@ -28,7 +27,8 @@ def download_stockfish_binary(path) -> str:
         print("Unsupported operating system:", os_name)
         return
 
-    # Download the zip file
+    # Download the zip file (requests is slow to import, only needed here)
+    import requests
     response = requests.get(download_url)
     if response.status_code == 200:
         # Save the zip file